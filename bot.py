@@ -10,7 +10,7 @@ from telebot import TeleBot, types
 from telebot.custom_filters import TextMatchFilter, TextStartsFilter
 
 from config import BOT_TOKEN, ADMIN_IDS, DEBUG
-from database import db_manager
+from database import db_manager, review_buffer, activity_tracker, quiz_session_store
 
 from start import register_start_handlers
 from cards import register_cards_handlers
@@ -40,6 +40,9 @@ def init_bot():
         with db_manager.get_connection() as conn:
             logger.info("Database connection established")
 
+        # Пользователи переносятся в свои шарды, если SHARD_COUNT изменился
+        db_manager.rebalance()
+
         if BOT_TOKEN == 'YOUR_BOT_TOKEN_HERE':
             logger.error("Please set BOT_TOKEN environment variable or in .env file")
             sys.exit(1)
@@ -102,18 +105,18 @@ def register_base_handlers():
 
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 stats = UserUtils.get_user_stats(conn, user_id)
-                all_cards = CardUtils.get_user_cards(conn, user_id)
+                counts = CardUtils.get_card_counts(conn, user_id)
                 categories = CategoryUtils.get_user_categories(conn, user_id)
 
                 if not stats:
                     bot.send_message(message.chat.id, "Статистика пока недоступна. Создайте первые карточки!")
                     return
 
-                total_cards = len(all_cards)
-                learned_cards = len([c for c in all_cards if c['status'] == 'learned'])
-                learning_cards = len([c for c in all_cards if c['status'] == 'learning'])
+                total_cards = counts['total']
+                learned_cards = counts['learned']
+                learning_cards = counts['learning']
 
                 total_answers = stats['correct_answers'] + stats['wrong_answers']
                 if total_answers > 0:
@@ -155,24 +158,14 @@ def register_base_handlers():
                 bot.send_message(message.chat.id, "У вас нет доступа к этой команде")
                 return
 
-            from database import with_connection
-
-            with with_connection() as conn:
-                cursor = conn.execute('SELECT COUNT(*) as users FROM users')
-                total_users = cursor.fetchone()['users']
-
-                cursor = conn.execute('SELECT COUNT(*) as cards FROM cards')
-                total_cards = cursor.fetchone()['cards']
+            from database import AnalyticsUtils
 
-                cursor = conn.execute('SELECT COUNT(*) as categories FROM categories')
-                total_categories = cursor.fetchone()['categories']
-
-                cursor = conn.execute('''
-                                      SELECT COUNT(*) as active_users
-                                      FROM users
-                                      WHERE last_active >= DATE ('now', '-7 days')
-                                      ''')
-                active_users = cursor.fetchone()['active_users']
+            # Счетчики собираются со всех шардов
+            stats = AnalyticsUtils.get_global_stats()
+            total_users = stats.get('total_users', 0)
+            total_cards = stats.get('total_cards', 0)
+            total_categories = stats.get('total_categories', 0)
+            active_users = stats.get('active_week', 0)
 
             admin_text = (f"*Админ-панель*\n\n*Общая статистика:*\n• Пользователей: {total_users}\n"
                           f"• Активных (7 дней): {active_users}\n• Карточек: {total_cards}\n"
@@ -183,9 +176,13 @@ def register_base_handlers():
             btn_export_all = types.InlineKeyboardButton('Экспорт всех данных', callback_data='admin_export')
             btn_cleanup = types.InlineKeyboardButton('Очистка БД', callback_data='admin_cleanup')
             btn_stats = types.InlineKeyboardButton('Подробная статистика', callback_data='admin_stats')
+            btn_queries = types.InlineKeyboardButton('Профиль запросов', callback_data='admin_queries')
+            btn_rebuild = types.InlineKeyboardButton('Пересчет статистики', callback_data='admin_rebuild_stats')
+            btn_reschedule = types.InlineKeyboardButton('Пересчет расписания', callback_data='admin_reschedule')
             btn_logs = types.InlineKeyboardButton('Просмотр логов', callback_data='admin_logs')
 
-            markup.add(btn_broadcast, btn_export_all, btn_cleanup, btn_stats, btn_logs)
+            markup.add(btn_broadcast, btn_export_all, btn_cleanup, btn_stats, btn_queries, btn_rebuild, btn_reschedule,
+                       btn_logs)
 
             bot.send_message(message.chat.id, admin_text, parse_mode='Markdown', reply_markup=markup)
 
@@ -218,14 +215,11 @@ def register_base_handlers():
     @bot.message_handler(commands=['about'])
     def about_command(message):
         try:
-            from database import with_connection
-
-            with with_connection() as conn:
-                cursor = conn.execute('SELECT COUNT(*) as users FROM users')
-                total_users = cursor.fetchone()['users']
+            from database import AnalyticsUtils
 
-                cursor = conn.execute('SELECT COUNT(*) as cards FROM cards')
-                total_cards = cursor.fetchone()['cards']
+            stats = AnalyticsUtils.get_global_stats()
+            total_users = stats.get('total_users', 0)
+            total_cards = stats.get('total_cards', 0)
 
             about_text = (f"*О боте*\n\n*Flashcards Bot* — умный помощник для обучения\n\n*Возможности:*\n"
                           f"• Система интервальных повторений (SM-2)\n• Умные напоминания о повторении\n"
@@ -252,13 +246,11 @@ def register_base_handlers():
     @bot.message_handler(func=lambda message: True)
     def handle_text_messages(message):
         try:
-            from database import UserUtils, with_connection
-
             user_id = message.from_user.id
             text = message.text.strip()
 
-            with with_connection() as conn:
-                UserUtils.update_user_activity(conn, user_id)
+            # Отметка активности копится в памяти и пишется в БД пачками
+            activity_tracker.touch(user_id)
 
             if text == 'Мои карточки':
                 from cards import view_cards_list
@@ -292,12 +284,10 @@ def register_base_handlers():
     @bot.callback_query_handler(func=lambda call: True)
     def handle_callback_queries(call):
         try:
-            from database import UserUtils, with_connection
-
             user_id = call.from_user.id
 
-            with with_connection() as conn:
-                UserUtils.update_user_activity(conn, user_id)
+            # Отметка активности копится в памяти и пишется в БД пачками
+            activity_tracker.touch(user_id)
 
             if call.data == 'main_menu':
                 from start import start_command
@@ -322,7 +312,7 @@ def register_base_handlers():
 
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 category_stats = AnalyticsUtils.get_category_stats(conn, user_id)
                 daily_stats = AnalyticsUtils.get_daily_stats(conn, user_id, days=7)
                 learning_progress = AnalyticsUtils.get_learning_progress(conn, user_id)
@@ -377,6 +367,10 @@ def register_base_handlers():
 # Обработка админских callback'ов
     def handle_admin_callbacks(call):
         try:
+            if call.from_user.id not in ADMIN_IDS:
+                bot.answer_callback_query(call.id, "У вас нет доступа к этой функции")
+                return
+
             if call.data == 'admin_broadcast':
                 msg = bot.send_message(
                     call.message.chat.id,
@@ -391,6 +385,22 @@ def register_base_handlers():
                 cleanup_database(call)
             elif call.data == 'admin_stats':
                 show_admin_stats(call)
+            elif call.data == 'admin_queries':
+                show_query_profile(call)
+            elif call.data == 'admin_queries_reset':
+                from database import query_profiler, category_cache, known_users
+                query_profiler.reset()
+                category_cache.reset_stats()
+                known_users.reset_stats()
+                show_query_profile(call)
+            elif call.data == 'admin_queries_toggle':
+                from database import query_profiler
+                query_profiler.enabled = not query_profiler.enabled
+                show_query_profile(call)
+            elif call.data == 'admin_rebuild_stats':
+                rebuild_stats(call)
+            elif call.data == 'admin_reschedule':
+                reschedule_cards(call)
             elif call.data == 'admin_logs':
                 send_logs(call)
 
@@ -410,19 +420,18 @@ def register_base_handlers():
             users_sent = 0
             users_failed = 0
 
-            from database import with_connection
+            from database import UserUtils
 
-            with with_connection() as conn:
-                cursor = conn.execute('SELECT telegram_id FROM users')
-                users = cursor.fetchall()
+            # Получатели собираются со всех шардов
+            users = UserUtils.get_all_user_ids()
 
             progress_msg = bot.send_message(message.chat.id, f"*Начало рассылки*\n\nПолучателей: {len(users)}\n"
                                                              f"Сообщение: {broadcast_text[:50]}...\n\n"
                                                              f"Отправка...", parse_mode='Markdown')
 
-            for user in users:
+            for user_id in users:
                 try:
-                    bot.send_message(user['telegram_id'], broadcast_text)
+                    bot.send_message(user_id, broadcast_text)
                     users_sent += 1
 
                     if users_sent % 10 == 0:
@@ -432,7 +441,7 @@ def register_base_handlers():
 
                 except Exception as e:
                     users_failed += 1
-                    logger.error(f"Failed to send to {user['telegram_id']}: {e}")
+                    logger.error(f"Failed to send to {user_id}: {e}")
 
             bot.edit_message_text(f"*Рассылка завершена*\n\n• Всего получателей: {len(users)}\n"
                                   f"• Успешно отправлено: {users_sent}\n• Не удалось отправить: {users_failed}\n\n"
@@ -446,18 +455,17 @@ def register_base_handlers():
 # Экспорт всех данных пользователей
     def export_all_data(call):
         try:
-            from database import with_connection, ExportImportUtils
+            from database import with_connection, UserUtils, ExportImportUtils
             import io
 
-            with with_connection() as conn:
-                cursor = conn.execute('SELECT telegram_id FROM users')
-                users = cursor.fetchall()
+            users = UserUtils.get_all_user_ids()
 
             # Создаем общий файл с данными всех пользователей
             all_data = {'export_date': datetime.now().isoformat(), 'total_users': len(users), 'users_data': []}
 
-            for user in users[:10]:  # Ограничиваем 10 пользователями для безопасности
-                user_data = ExportImportUtils.export_user_data(conn, user['telegram_id'])
+            for user_id in users[:10]:  # Ограничиваем 10 пользователями для безопасности
+                with with_connection(telegram_id=user_id) as conn:
+                    user_data = ExportImportUtils.export_user_data(conn, user_id)
                 if user_data:
                     all_data['users_data'].append(user_data)
 
@@ -479,21 +487,19 @@ def register_base_handlers():
 # Очистка базы данных
     def cleanup_database(call):
         try:
-            from database import with_connection, MaintenanceUtils
+            from database import MaintenanceUtils
 
-            with with_connection() as conn:
-                cursor = conn.execute('''
-                                      DELETE
-                                      FROM users
-                                      WHERE last_active < DATE ('now', '-30 days')
-                                      ''')
-                deleted_users = cursor.rowcount
+            # Очистка выполняется на каждом шарде
+            deleted_users = sum(db_manager.map_shards(MaintenanceUtils.delete_inactive_users, 30))
 
-                cleanup_stats = MaintenanceUtils.cleanup_old_data(conn, call.from_user.id, days_old=90)
+            # Старые сессии не удаляются, а переносятся в архивную БД
+            archived_sessions = MaintenanceUtils.archive_old_sessions(days_old=90)
+            deleted_sessions = sum(db_manager.map_shards(MaintenanceUtils.delete_orphan_archived_sessions))
 
             result_text = (f"*Очистка завершена*\n\n*Удалено:*\n• Пользователей: {deleted_users}\n"
-                           f"• Сессий: {cleanup_stats['deleted_sessions']}\n\n"
-                           f"*Всего удалено записей:* {deleted_users + cleanup_stats['total_deleted']}")
+                           f"• Архивных сессий удаленных пользователей: {deleted_sessions}\n\n"
+                           f"*Перенесено в архив:* {archived_sessions} сессий старше 90 дней\n\n"
+                           f"*Всего удалено записей:* {deleted_users + deleted_sessions}")
 
             bot.edit_message_text(result_text, call.message.chat.id, call.message.message_id, parse_mode='Markdown')
 
@@ -504,46 +510,116 @@ def register_base_handlers():
 # Показать расширенную статистику для админа
     def show_admin_stats(call):
         try:
-            from database import with_connection
-
-            with with_connection() as conn:
-                cursor = conn.execute('''
-                                      SELECT COUNT(*)                                                           as total_users,
-                                             COUNT(CASE WHEN last_active >= DATE ('now', '-7 days') THEN 1 END) as active_week,
-                                             COUNT(CASE WHEN last_active >= DATE ('now', '-1 day') THEN 1 END)  as active_today,
-                                             (SELECT COUNT(*) FROM cards)                                       as total_cards,
-                                             (SELECT COUNT(*) FROM categories)                                  as total_categories,
-                                             (SELECT COUNT(*) FROM study_sessions)                              as total_sessions
-                                      FROM users
-                                      ''')
-                stats = cursor.fetchone()
-
-                cursor = conn.execute('''
-                                      SELECT u.telegram_id,
-                                             u.first_name,
-                                             u.username,
-                                             COUNT(c.id) as cards_count
-                                      FROM users u
-                                               LEFT JOIN cards c ON u.telegram_id = c.user_id
-                                      GROUP BY u.telegram_id
-                                      ORDER BY cards_count DESC LIMIT 5
-                                      ''')
-                top_users = cursor.fetchall()
+            from database import AnalyticsUtils, quiz_session_store
+
+            # Счетчики суммируются по шардам, топ пользователей объединяется из топов шардов
+            stats = AnalyticsUtils.get_global_stats()
+            top_users = AnalyticsUtils.get_top_users(limit=5)
+            session_stats = quiz_session_store.stats()
+            forecast = AnalyticsUtils.get_global_review_forecast(days=7)
 
             stats_text = (f"*Расширенная статистика*\n\n*Общая статистика:*\n• Пользователей: {stats['total_users']}\n"
                           f"• Активных за неделю: {stats['active_week']}\n• Активных сегодня: {stats['active_today']}\n"
                           f"• Карточек: {stats['total_cards']}\n• Категорий: {stats['total_categories']}\n"
-                          f"• Сессий обучения: {stats['total_sessions']}\n\n*Топ-5 пользователей по карточкам:*")
+                          f"• Сессий обучения: {stats['total_sessions'] + stats['archived_sessions']} "
+                          f"(в архиве: {stats['archived_sessions']})\n\n"
+                          f"*Сессии тестирования ({session_stats['backend']}):*\n"
+                          f"• Активных: {session_stats['live']}\n• Вытеснено: {session_stats['evictions']}\n"
+                          f"• Истекло: {session_stats['expired']}\n\n*Топ-5 пользователей по карточкам:*")
 
             for i, user in enumerate(top_users, 1):
                 username = f"@{user['username']}" if user['username'] else user['first_name']
                 stats_text += f"{i}. {username}: {user['cards_count']} карточек\n"
 
+            # Прогноз по дням помогает заранее оценить объем рассылки напоминаний
+            if forecast:
+                peak = max(forecast, key=lambda day: day['count'])
+                stats_text += "\n*Прогноз повторений на 7 дней:*\n"
+                for day in forecast:
+                    stats_text += f"• {day['date'].strftime('%d.%m')}: {day['count']}\n"
+                stats_text += f"Пик: {peak['date'].strftime('%d.%m')} ({peak['count']} карточек)\n"
+
             bot.edit_message_text(stats_text, call.message.chat.id, call.message.message_id, parse_mode='Markdown')
 
         except Exception as e:
             logger.error(f"Error showing admin stats: {e}")
 
+# Пересчет счетчиков user_stats по фактическим данным
+    def rebuild_stats(call):
+        try:
+            from database import MaintenanceUtils
+
+            updated = sum(db_manager.map_shards(MaintenanceUtils.rebuild_user_stats))
+
+            bot.edit_message_text(f"*Пересчет статистики завершен*\n\nОбновлено пользователей: {updated}",
+                                  call.message.chat.id, call.message.message_id, parse_mode='Markdown')
+
+        except Exception as e:
+            logger.error(f"Error rebuilding stats: {e}")
+            bot.edit_message_text("Ошибка при пересчете статистики", call.message.chat.id, call.message.message_id)
+
+# Пересчет расписания повторений всех карточек по текущим правилам
+    def reschedule_cards(call):
+        try:
+            from database import SchedulerUtils
+
+            bot.edit_message_text("Пересчет расписания...", call.message.chat.id, call.message.message_id)
+
+            result = SchedulerUtils.reschedule_cards()
+
+            bot.edit_message_text(f"*Пересчет расписания завершен*\n\n"
+                                  f"Карточек проверено: {result['cards']}\nОбновлено: {result['updated']}\n"
+                                  f"Время: {result['seconds']:.1f} сек ({result['cards_per_sec']:.0f} карточек/сек, "
+                                  f"{result['backend']})",
+                                  call.message.chat.id, call.message.message_id, parse_mode='Markdown')
+
+        except Exception as e:
+            logger.error(f"Error rescheduling cards: {e}")
+            bot.edit_message_text("Ошибка при пересчете расписания", call.message.chat.id, call.message.message_id)
+
+# Показать профиль SQL-запросов: самые затратные выражения по суммарному времени
+    def show_query_profile(call):
+        try:
+            from database import query_profiler, category_cache, known_users
+
+            stats = query_profiler.snapshot(limit=10)
+
+            if not query_profiler.enabled:
+                profile_text = ("*Профиль запросов*\n\nПрофилирование отключено. Включите его кнопкой ниже "
+                                "или переменной QUERY_PROFILER_ENABLED.\n\n")
+            elif not stats:
+                profile_text = "*Профиль запросов*\n\nЗапросов пока не было.\n\n"
+            else:
+                profile_text = (f"*Профиль запросов*\n\nПорог медленного запроса: {query_profiler.slow_ms} мс\n"
+                                f"*Топ-{len(stats)} по суммарному времени:*\n\n")
+
+                for i, stat in enumerate(stats, 1):
+                    p95 = f"{stat['p95_ms']:.0f}" if stat['p95_ms'] != float('inf') else f">{query_profiler.BUCKETS[-2]}"
+                    sql = stat['sql'][:80].replace('`', "'")
+                    profile_text += (f"{i}. `{sql}`\n"
+                                     f"Вызовов: {stat['calls']}, всего: {stat['total_ms']:.0f} мс, "
+                                     f"сред.: {stat['avg_ms']:.1f} мс, p95: {p95} мс, "
+                                     f"макс.: {stat['max_ms']:.0f} мс\n"
+                                     f"Строк: {stat['rows']}, медленных: {stat['slow']}\n\n")
+
+            profile_text += "*Кэши:*\n"
+            for name, cache in (('Категории', category_cache), ('Профили пользователей', known_users)):
+                cache_stats = cache.stats()
+                profile_text += (f"{name}: попаданий {cache_stats['hit_rate']:.0%} "
+                                 f"({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']}), "
+                                 f"записей {cache_stats['size']}/{cache_stats['max_size']}\n")
+
+            markup = types.InlineKeyboardMarkup()
+            toggle_text = 'Выключить профилирование' if query_profiler.enabled else 'Включить профилирование'
+            markup.add(types.InlineKeyboardButton(toggle_text, callback_data='admin_queries_toggle'))
+            markup.add(types.InlineKeyboardButton('Сбросить статистику', callback_data='admin_queries_reset'))
+
+            bot.edit_message_text(profile_text, call.message.chat.id, call.message.message_id,
+                                  parse_mode='Markdown', reply_markup=markup)
+
+        except Exception as e:
+            logger.error(f"Error showing query profile: {e}")
+
 # Отправить логи бота
     def send_logs(call):
         try:
@@ -605,6 +681,10 @@ def main():
         logger.error(f"Bot crashed: {e}")
         sys.exit(1)
     finally:
+        quiz_session_store.close()
+        activity_tracker.close()
+        review_buffer.close()
+        db_manager.close()
         logger.info("Bot stopped")
 
 
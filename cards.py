@@ -1,7 +1,7 @@
 import logging
 from telebot import types
 from datetime import datetime, timedelta
-from database import with_connection, CardUtils, CategoryUtils, UserUtils, ExportImportUtils
+from database import db_manager, with_connection, CardUtils, CategoryUtils, UserUtils, ExportImportUtils
 
 logger = logging.getLogger(__name__)
 
@@ -17,13 +17,14 @@ def register_cards_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 # Получаем статистику
                 stats = UserUtils.get_user_stats(conn, user_id)
-                total_cards = len(CardUtils.get_user_cards(conn, user_id))
+                counts = CardUtils.get_card_counts(conn, user_id)
+                total_cards = counts['total']
 
-                # Получаем карточки для повторения сегодня
-                due_cards = len(CardUtils.get_cards_for_review(conn, user_id))
+                # Карточки для повторения сегодня
+                due_cards = counts['due']
 
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
             btn_my_cards = types.KeyboardButton('Мои карточки')
@@ -58,7 +59,7 @@ def register_cards_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 categories = CategoryUtils.get_user_categories(conn, user_id)
 
                 if not categories:
@@ -101,7 +102,7 @@ def register_cards_handlers(bot):
             user_id = call.from_user.id
             category_id = call.data.replace('add_card_category_', '')
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 category = CategoryUtils.get_category_by_id(conn, category_id)
 
             if not category:
@@ -197,30 +198,29 @@ def register_cards_handlers(bot):
 
             session_data = user_sessions[user_id]['data']
 
-            with with_connection() as conn:
-                # Сохраняем карточку в БД
-                card_id = CardUtils.create_card(conn, user_id=user_id, front=session_data['front'], back=back_text,
-                                                category_id=session_data['category_id'])
+            # Сохраняем карточку в БД через очередь записи
+            card_id = db_manager.submit_write(user_id, CardUtils.create_card, user_id, session_data['front'],
+                                              back_text, session_data['category_id']).result()
 
-                if card_id:
-                    # Очищаем сессию
-                    if user_id in user_sessions:
-                        del user_sessions[user_id]
+            if card_id:
+                # Очищаем сессию
+                if user_id in user_sessions:
+                    del user_sessions[user_id]
 
-                    markup = types.InlineKeyboardMarkup(row_width=2)
-                    btn_add_more = types.InlineKeyboardButton('Еще карточку', callback_data='add_another_card')
-                    btn_view = types.InlineKeyboardButton('Посмотреть', callback_data=f'view_card_{card_id}')
-                    btn_edit = types.InlineKeyboardButton('Редактировать', callback_data=f'edit_card_{card_id}')
+                markup = types.InlineKeyboardMarkup(row_width=2)
+                btn_add_more = types.InlineKeyboardButton('Еще карточку', callback_data='add_another_card')
+                btn_view = types.InlineKeyboardButton('Посмотреть', callback_data=f'view_card_{card_id}')
+                btn_edit = types.InlineKeyboardButton('Редактировать', callback_data=f'edit_card_{card_id}')
 
-                    markup.add(btn_add_more, btn_view, btn_edit)
+                markup.add(btn_add_more, btn_view, btn_edit)
 
-                    bot.send_message(message.chat.id, f"*Карточка создана!*\n\n*ID:* #{card_id}\n"
-                                                      f"*Категория:* {session_data.get('category_name', 'Неизвестно')}\n"
-                                                      f"*Вопрос:* {session_data['front']}\n*Ответ:* {back_text}\n\n"
-                                                      f"Карточка добавлена в систему повторений.",
-                                     parse_mode='Markdown', reply_markup=markup)
-                else:
-                    bot.send_message(message.chat.id, "Ошибка при сохранении карточки")
+                bot.send_message(message.chat.id, f"*Карточка создана!*\n\n*ID:* #{card_id}\n"
+                                                  f"*Категория:* {session_data.get('category_name', 'Неизвестно')}\n"
+                                                  f"*Вопрос:* {session_data['front']}\n*Ответ:* {back_text}\n\n"
+                                                  f"Карточка добавлена в систему повторений.",
+                                 parse_mode='Markdown', reply_markup=markup)
+            else:
+                bot.send_message(message.chat.id, "Ошибка при сохранении карточки")
 
         except Exception as e:
             logger.error(f"Error in process_back_side: {e}")
@@ -229,19 +229,19 @@ def register_cards_handlers(bot):
 # Просмотр списка карточек с пагинацией
     @bot.message_handler(commands=['mycards', 'cards_list'])
     @bot.message_handler(func=lambda message: message.text in ['📚 Мои карточки', '👁️ Мои карточки'])
-    def view_cards_list(message, page=1):
+    def view_cards_list(message, page=1, cursor=None, direction='next', user_id=None):
         try:
-            user_id = message.from_user.id
+            # Из callback приходит сообщение бота, поэтому пользователь передается явно
+            user_id = user_id or message.from_user.id
             page_size = 10
 
-            with with_connection() as conn:
-                # Получаем карточки для текущей страницы
-                offset = (page - 1) * page_size
-                cards = CardUtils.get_user_cards(
-                    conn, user_id, limit=page_size, offset=offset
+            with with_connection(telegram_id=user_id) as conn:
+                # Получаем карточки для текущей страницы по курсору
+                cards, next_cursor, prev_cursor = CardUtils.get_user_cards_page(
+                    conn, user_id, cursor=cursor, direction=direction, limit=page_size
                 )
 
-                total_cards = len(CardUtils.get_user_cards(conn, user_id))
+                total_cards = CardUtils.get_card_counts(conn, user_id)['total']
                 total_pages = (total_cards + page_size - 1) // page_size
 
             if not cards:
@@ -257,7 +257,7 @@ def register_cards_handlers(bot):
             # Формируем текст
             text = f"*Ваши карточки* (страница {page}/{total_pages})\n\n"
 
-            for i, card in enumerate(cards, start=1):
+            for i, card in enumerate(cards, start=(page - 1) * page_size + 1):
                 status_emoji = "🎯" if card['status'] == 'learning' else "✅"
                 front_preview = card['front'][:30] + "..." if len(card['front']) > 30 else card['front']
                 text += f"{i}. {status_emoji} *{front_preview}*\n"
@@ -267,17 +267,18 @@ def register_cards_handlers(bot):
             # Создаем инлайн-клавиатуру
             markup = types.InlineKeyboardMarkup(row_width=4)
 
-            # Кнопки пагинации
-            if page > 1:
-                btn_prev = types.InlineKeyboardButton('◀️', callback_data=f'cards_page_{page - 1}')
-                markup.add(btn_prev)
+            # Кнопки пагинации: cards_page_<номер>_<n|p>_<курсор>
+            btn_row = []
+            if prev_cursor:
+                btn_prev = types.InlineKeyboardButton('◀️', callback_data=f'cards_page_{page - 1}_p_{prev_cursor}')
+                btn_row.append(btn_prev)
 
-            if page < total_pages:
-                btn_next = types.InlineKeyboardButton('▶️', callback_data=f'cards_page_{page + 1}')
-                if page > 1:
-                    markup.add(btn_next)
-                else:
-                    markup.add(btn_next)
+            if next_cursor:
+                btn_next = types.InlineKeyboardButton('▶️', callback_data=f'cards_page_{page + 1}_n_{next_cursor}')
+                btn_row.append(btn_next)
+
+            if btn_row:
+                markup.add(*btn_row)
 
             btn_view_all = types.InlineKeyboardButton('Просмотреть все', callback_data='view_all_cards')
             btn_search = types.InlineKeyboardButton('Поиск', callback_data='search_cards')
@@ -294,8 +295,9 @@ def register_cards_handlers(bot):
     @bot.callback_query_handler(func=lambda call: call.data.startswith('cards_page_'))
     def cards_page_callback(call):
         try:
-            page = int(call.data.replace('cards_page_', ''))
-            view_cards_list(call.message, page)
+            page, direction, cursor = call.data.replace('cards_page_', '').split('_', 2)
+            direction = 'prev' if direction == 'p' else 'next'
+            view_cards_list(call.message, int(page), cursor, direction, user_id=call.from_user.id)
             bot.answer_callback_query(call.id)
         except Exception as e:
             logger.error(f"Error in cards_page_callback: {e}")
@@ -306,7 +308,7 @@ def register_cards_handlers(bot):
         try:
             card_id = call.data.replace('view_card_', '')
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=call.from_user.id) as conn:
                 card = CardUtils.get_card_by_id(conn, card_id)
                 if not card:
                     bot.answer_callback_query(call.id, "Карточка не найдена")
@@ -384,26 +386,28 @@ def register_cards_handlers(bot):
 
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 # Получаем или создаем категорию "По умолчанию"
                 categories = CategoryUtils.get_user_categories(conn, user_id)
                 quick_category = next((c for c in categories if c['name'] == 'По умолчанию'), None)
 
-                if not quick_category:
-                    category_id = CategoryUtils.create_category(conn, user_id, "По умолчанию",
-                                                                "Автоматически созданные карточки")
-                else:
-                    category_id = quick_category['id']
+            # Запись идет через очередь записи, уже после закрытия блока чтения
+            if not quick_category:
+                category_id = db_manager.submit_write(user_id, CategoryUtils.create_category, user_id, "По умолчанию",
+                                                      "Автоматически созданные карточки").result()
+            else:
+                category_id = quick_category['id']
 
-                # Сохраняем карточку
-                card_id = CardUtils.create_card(conn, user_id, front, back, category_id)
+            # Сохраняем карточку
+            card_id = db_manager.submit_write(user_id, CardUtils.create_card, user_id, front, back,
+                                              category_id).result()
 
-                if card_id:
-                    bot.send_message(message.chat.id, f"*Карточка добавлена!*\n\n*Вопрос:* {front}\n"
-                                                      f"*Ответ:* {back}\n*Категория:* Быстрые\n\n"
-                                                      f"Используйте /mycards для просмотра", parse_mode='Markdown')
-                else:
-                    bot.send_message(message.chat.id, "Ошибка при сохранении")
+            if card_id:
+                bot.send_message(message.chat.id, f"*Карточка добавлена!*\n\n*Вопрос:* {front}\n"
+                                                  f"*Ответ:* {back}\n*Категория:* Быстрые\n\n"
+                                                  f"Используйте /mycards для просмотра", parse_mode='Markdown')
+            else:
+                bot.send_message(message.chat.id, "Ошибка при сохранении")
 
         except Exception as e:
             logger.error(f"Error in process_quick_add: {e}")
@@ -434,7 +438,7 @@ def register_cards_handlers(bot):
                 bot.send_message(message.chat.id, "Поисковый запрос должен содержать минимум 2 символа")
                 return
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 results = CardUtils.search_cards(conn, user_id, query)
 
                 if not results:
@@ -500,7 +504,7 @@ def register_cards_handlers(bot):
         try:
             card_id = call.data.replace('delete_card_', '')
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=call.from_user.id) as conn:
                 success = CardUtils.delete_card(conn, card_id)
 
                 if success:
@@ -527,7 +531,7 @@ def register_cards_handlers(bot):
         try:
             card_id = call.data.replace('toggle_card_status_', '')
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=call.from_user.id) as conn:
                 card = CardUtils.get_card_by_id(conn, card_id)
 
                 if not card:
@@ -616,7 +620,7 @@ def register_cards_handlers(bot):
 
             card_id = user_sessions[user_id]['data']['card_id']
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 success = CardUtils.update_card(conn, card_id, front=new_front)
 
                 if success:
@@ -644,7 +648,7 @@ def register_cards_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 cards = CardUtils.get_cards_for_review(conn, user_id, limit=20)
 
                 if not cards:
@@ -17,16 +17,9 @@ def register_categories_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
-                categories = CategoryUtils.get_user_categories(conn, user_id)
-
+            with with_connection(telegram_id=user_id) as conn:
                 # Статистика по категориям
-                category_stats = []
-                for category in categories:
-                    cards = CardUtils.get_user_cards(conn, user_id, category_id=category['id'])
-                    learned = len([c for c in cards if c['status'] == 'learned'])
-                    category_stats.append({'name': category['name'], 'total': len(cards), 'learned': learned,
-                                           'id': category['id']})
+                category_stats = CategoryUtils.get_categories_summary(conn, user_id)
 
             markup = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
 
@@ -39,7 +32,7 @@ def register_categories_handlers(bot):
 
             markup.add(btn_create, btn_view, btn_edit, btn_delete, btn_stats, btn_back)
 
-            text = f"*Управление категориями*\n\nВсего категорий: *{len(categories)}*"
+            text = f"*Управление категориями*\n\nВсего категорий: *{len(category_stats)}*"
 
             if category_stats:
                 text += "\n*Ваши категории:*\n"
@@ -93,7 +86,7 @@ def register_categories_handlers(bot):
                 return
 
             # Проверяем, нет ли уже категории с таким именем
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 existing_categories = CategoryUtils.get_user_categories(conn, user_id)
                 for cat in existing_categories:
                     if cat['name'].lower() == category_name.lower():
@@ -204,7 +197,7 @@ def register_categories_handlers(bot):
             # Определяем цвет
             color = color_data if color_data != 'default' else None
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 # Создаем категорию
                 category_id = CategoryUtils.create_category(conn, user_id, category_name, description, color)
 
@@ -250,17 +243,15 @@ def register_categories_handlers(bot):
             user_id = message.from_user.id
             page_size = 8
 
-            with with_connection() as conn:
-                categories = CategoryUtils.get_user_categories(conn, user_id)
-
-                categories_with_stats = []
-                for category in categories:
-                    cards = CardUtils.get_user_cards(conn, user_id, category_id=category['id'])
-                    learned = len([c for c in cards if c['status'] == 'learned'])
+            with with_connection(telegram_id=user_id) as conn:
+                categories = CategoryUtils.get_categories_summary(conn, user_id)
 
-                    categories_with_stats.append({**category, 'total_cards': len(cards),
-                                                  'learned_cards': learned,
-                                                  'progress': (learned / len(cards)) * 100 if cards else 0})
+            categories_with_stats = []
+            for category in categories:
+                categories_with_stats.append({**category, 'total_cards': category['total'],
+                                              'learned_cards': category['learned'],
+                                              'progress': (category['learned'] / category['total']) * 100
+                                              if category['total'] else 0})
 
             if not categories_with_stats:
                 markup = types.InlineKeyboardMarkup()
@@ -331,23 +322,23 @@ def register_categories_handlers(bot):
             category_id = call.data.replace('view_category_', '')
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 category = CategoryUtils.get_category_by_id(conn, category_id)
 
                 if not category:
                     bot.answer_callback_query(call.id, "Категория не найдена")
                     return
 
-                cards = CardUtils.get_user_cards(conn, user_id, category_id=category_id)
-                learned = len([c for c in cards if c['status'] == 'learned'])
-                progress = (learned / len(cards)) * 100 if cards else 0
+                counts = CardUtils.get_card_counts(conn, user_id, category_id=category_id)
+                learned = counts['learned']
+                progress = (learned / counts['total']) * 100 if counts['total'] else 0
 
                 created_at = datetime.strptime(category['created_at'], "%Y-%m-%d %H:%M:%S").strftime("%d.%m.%Y")
 
             # Формируем текст
             text = (f"*Категория: {category['name']}*\n\n*Описание:*\n{category['description'] or 'Нет описания'}\n\n"
-                    f"*Статистика:*\n• Всего карточек: *{len(cards)}*\n• Изучено: *{learned}*\n"
-                    f"• Изучается: *{len(cards) - learned}*\n• Прогресс: *{progress:.1f}%*\n\n*Информация:*\n"
+                    f"*Статистика:*\n• Всего карточек: *{counts['total']}*\n• Изучено: *{learned}*\n"
+                    f"• Изучается: *{counts['total'] - learned}*\n• Прогресс: *{progress:.1f}%*\n\n*Информация:*\n"
                     f"• ID: #{category['id']}\n• Создана: {created_at}\n"
                     f"• Цвет: {'🎨 Настроен' if category['color'] else '⚫ По умолчанию'}")
 
@@ -378,14 +369,14 @@ def register_categories_handlers(bot):
         try:
             category_id = call.data.replace('delete_category_confirm_', '')
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=call.from_user.id) as conn:
                 category = CategoryUtils.get_category_by_id(conn, category_id)
 
                 if not category:
                     bot.answer_callback_query(call.id, "Категория не найдена")
                     return
 
-                cards = CardUtils.get_user_cards(conn, call.from_user.id, category_id=category_id)
+                cards_count = CardUtils.get_card_counts(conn, call.from_user.id, category_id=category_id)['total']
 
             markup = types.InlineKeyboardMarkup(row_width=2)
             btn_confirm = types.InlineKeyboardButton('Да, удалить',callback_data=f'delete_category_with_cards_{category_id}')
@@ -395,7 +386,7 @@ def register_categories_handlers(bot):
             markup.add(btn_confirm, btn_move, btn_cancel)
 
             bot.edit_message_text(f"🗑️ *Удаление категории*\n\nВы уверены, что хотите удалить категорию:\n"
-                                  f"*{category['name']}*?\n\nВ категории *{len(cards)}* карточек.\n"
+                                  f"*{category['name']}*?\n\nВ категории *{cards_count}* карточек.\n"
                                   f"Они будут *удалены вместе с категорией*!\n\nВы можете:\n"
                                   f"1. Удалить категорию с карточками\n2. Переместить карточки в другую категорию\n"
                                   f"3. Отменить удаление",
@@ -414,7 +405,7 @@ def register_categories_handlers(bot):
             category_id = call.data.replace('delete_category_with_cards_', '')
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 category = CategoryUtils.get_category_by_id(conn, category_id)
 
                 if not category:
@@ -440,7 +431,7 @@ def register_categories_handlers(bot):
             category_id = call.data.replace('edit_category_', '')
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 category = CategoryUtils.get_category_by_id(conn, category_id)
 
                 if not category:
@@ -506,7 +497,7 @@ def register_categories_handlers(bot):
 
             category_id = user_sessions[user_id]['data']['category_id']
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 # Проверяем, нет ли уже категории с таким именем
                 existing_categories = CategoryUtils.get_user_categories(conn, user_id)
                 for cat in existing_categories:
@@ -540,7 +531,7 @@ def register_categories_handlers(bot):
             # Сохраняем состояние для процесса добавления карточки
             user_sessions[user_id] = {'step': 'waiting_front_for_category', 'data': {'category_id': category_id}}
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 category = CategoryUtils.get_category_by_id(conn, category_id)
 
             msg = bot.send_message(call.message.chat.id, f"*Добавление карточки в категорию*\n\n" 
@@ -569,7 +560,7 @@ def register_categories_handlers(bot):
             category_id = call.data.replace('view_cards_in_category_', '')
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 category = CategoryUtils.get_category_by_id(conn, category_id)
                 cards = CardUtils.get_user_cards(conn, user_id, category_id=category_id)
 
@@ -630,37 +621,46 @@ def register_categories_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
-                categories = CategoryUtils.get_user_categories(conn, user_id)
+            with with_connection(telegram_id=user_id) as conn:
+                categories = CategoryUtils.get_categories_summary(conn, user_id)
 
-                if not categories:
-                    bot.send_message(
-                        message.chat.id,
-                        "📭 У вас пока нет категорий. Создайте первую категорию!"
-                    )
-                    return
+            if not categories:
+                bot.send_message(
+                    message.chat.id,
+                    "📭 У вас пока нет категорий. Создайте первую категорию!"
+                )
+                return
+
+            # Собираем статистику
+            stats_text = "📊 *Статистика по категориям*\n\n"
+            total_cards_all = 0
+            total_learned_all = 0
+
+            for category in categories:
+                learned = category['learned']
 
-                # Собираем статистику
-                stats_text = "📊 *Статистика по категориям*\n\n"
-                total_cards_all = 0
-                total_learned_all = 0
+                total_cards_all += category['total']
+                total_learned_all += learned
 
-                for category in categories:
-                    cards = CardUtils.get_user_cards(conn, user_id, category_id=category['id'])
-                    learned = len([c for c in cards if c['status'] == 'learned'])
+                progress = (learned / category['total']) * 100 if category['total'] else 0
+                progress_bar = "🟩" * int(progress / 20) + "⬜" * (5 - int(progress / 20))
 
-                    total_cards_all += len(cards)
-                    total_learned_all += learned
+                stats_text += f"*{category['name']}*\n"
+                stats_text += f"  {learned}/{category['total']} {progress_bar} {progress:.0f}%\n\n"
 
-                    progress = (learned / len(cards)) * 100 if cards else 0
-                    progress_bar = "🟩" * int(progress / 20) + "⬜" * (5 - int(progress / 20))
+            # Общая статистика
+            overall_progress = (total_learned_all / total_cards_all) * 100 if total_cards_all > 0 else 0
 
-                    stats_text += f"*{category['name']}*\n"
-                    stats_text += f"  {learned}/{len(cards)} {progress_bar} {progress:.0f}%\n\n"
+            stats_text += f"*Общая статистика:*\n"
+            stats_text += f"• Категорий: {len(categories)}\n"
+            stats_text += f"• Всего карточек: {total_cards_all}\n"
+            stats_text += f"• Изучено: {total_learned_all} ({overall_progress:.0f}%)"
 
-                # Общая статистика
-                overall_progress = (total_learned_all / total_cards_all) * 100 if total_cards_all > 0 else 0
+            bot.send_message(message.chat.id, stats_text, parse_mode='Markdown')
+
+        except Exception as e:
+            logger.error(f"Error in categories_stats: {e}")
+            bot.send_message(message.chat.id, "Ошибка при загрузке статистики")
 
-                stats_text += f"*Общая статистика:*\n"
-                stats_text += f"• Категорий: {len(categories)}\n"
-                stats_text += f"• Всего карточек: {total}"
+    logger.info("Categories handlers registered successfully")
+    return bot
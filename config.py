@@ -18,4 +18,45 @@ def get_bool(value: Optional[str], default: bool = False) -> bool:
     return default
 
 
-DEBUG: bool = get_bool(os.getenv('DEBUG'), False)
\ No newline at end of file
+DEBUG: bool = get_bool(os.getenv('DEBUG'), False)
+
+# Буфер отложенной записи результатов повторения
+REVIEW_BUFFER_ENABLED: bool = get_bool(os.getenv('REVIEW_BUFFER_ENABLED'), True)
+REVIEW_BUFFER_SIZE: int = int(os.getenv('REVIEW_BUFFER_SIZE', '50'))
+REVIEW_BUFFER_DELAY_MS: int = int(os.getenv('REVIEW_BUFFER_DELAY_MS', '2000'))
+
+# Профилирование SQL-запросов (по умолчанию выключено, включается здесь или в админ-панели) и порог медленного запроса
+QUERY_PROFILER_ENABLED: bool = get_bool(os.getenv('QUERY_PROFILER_ENABLED'), False)
+SLOW_QUERY_MS: int = int(os.getenv('SLOW_QUERY_MS', '100'))
+
+# Количество файлов-шардов БД (пользователь попадает в шард telegram_id % SHARD_COUNT)
+SHARD_COUNT: int = int(os.getenv('SHARD_COUNT', '1'))
+
+# Очередь записи: один поток-писатель на шард, групповой коммит пачками
+WRITE_QUEUE_ENABLED: bool = get_bool(os.getenv('WRITE_QUEUE_ENABLED'), True)
+WRITE_BATCH_SIZE: int = int(os.getenv('WRITE_BATCH_SIZE', '100'))
+WRITE_BATCH_WAIT_MS: int = int(os.getenv('WRITE_BATCH_WAIT_MS', '0'))
+
+# Период записи накопленной активности пользователей (last_active, серия дней)
+ACTIVITY_FLUSH_MS: int = int(os.getenv('ACTIVITY_FLUSH_MS', '5000'))
+
+# Размер кэша профилей пользователей, уже сохраненных в БД
+KNOWN_USERS_CACHE_SIZE: int = int(os.getenv('KNOWN_USERS_CACHE_SIZE', '10000'))
+
+# Кэш категорий пользователя: размер (число пользователей) и время жизни записи в секундах
+CATEGORY_CACHE_SIZE: int = int(os.getenv('CATEGORY_CACHE_SIZE', '5000'))
+CATEGORY_CACHE_TTL: int = int(os.getenv('CATEGORY_CACHE_TTL', '300'))
+
+# Хранилище сессий тестирования: memory (в памяти процесса) или sqlite (переживает перезапуск)
+QUIZ_SESSION_BACKEND: str = os.getenv('QUIZ_SESSION_BACKEND', 'memory').lower()
+QUIZ_SESSION_MAX: int = int(os.getenv('QUIZ_SESSION_MAX', '1000'))
+QUIZ_SESSION_TTL: int = int(os.getenv('QUIZ_SESSION_TTL', '3600'))
+
+# Индекс карточек к повторению в памяти: число пользователей в индексе и время жизни записи в секундах
+DUE_INDEX_ENABLED: bool = get_bool(os.getenv('DUE_INDEX_ENABLED'), True)
+DUE_INDEX_MAX_USERS: int = int(os.getenv('DUE_INDEX_MAX_USERS', '1000'))
+DUE_INDEX_TTL: int = int(os.getenv('DUE_INDEX_TTL', '600'))
+
+# Кэш прогнозов нагрузки повторений: число прогнозов и время жизни в секундах
+FORECAST_CACHE_SIZE: int = int(os.getenv('FORECAST_CACHE_SIZE', '5000'))
+FORECAST_CACHE_TTL: int = int(os.getenv('FORECAST_CACHE_TTL', '300'))
@@ -1,25 +1,499 @@
+import os
 import sqlite3
 import logging
 import json
+import base64
+import threading
+import time
+import re
+import random
+import heapq
+import queue
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import lru_cache
 from datetime import datetime, timedelta
 from contextlib import contextmanager
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from config import (REVIEW_BUFFER_ENABLED, REVIEW_BUFFER_SIZE, REVIEW_BUFFER_DELAY_MS,
+                    QUERY_PROFILER_ENABLED, SLOW_QUERY_MS, SHARD_COUNT,
+                    WRITE_QUEUE_ENABLED, WRITE_BATCH_SIZE, WRITE_BATCH_WAIT_MS,
+                    ACTIVITY_FLUSH_MS, KNOWN_USERS_CACHE_SIZE, CATEGORY_CACHE_SIZE, CATEGORY_CACHE_TTL,
+                    QUIZ_SESSION_BACKEND, QUIZ_SESSION_MAX, QUIZ_SESSION_TTL,
+                    DUE_INDEX_ENABLED, DUE_INDEX_MAX_USERS, DUE_INDEX_TTL,
+                    FORECAST_CACHE_SIZE, FORECAST_CACHE_TTL)
 
 logger = logging.getLogger(__name__)
 
+# Доля верных ответов карточки в SQL (NULL у карточек без ответов).
+# Запросы должны использовать это же выражение, иначе индексы миграции 9 не применяются
+SUCCESS_RATE_SQL = 'CAST(correct_answers AS REAL) / (correct_answers + wrong_answers)'
+
+
+# ПРОФИЛИРОВАНИЕ ЗАПРОСОВ
+# Статистика по каждому SQL-выражению: число вызовов, гистограмма задержек, число строк
+# Медленные выражения пишутся в лог вместе с EXPLAIN QUERY PLAN
+class QueryProfiler:
+
+    # Верхние границы корзин гистограммы в миллисекундах
+    BUCKETS = [1, 5, 10, 50, 100, 500, 1000, float('inf')]
+
+    def __init__(self, slow_ms=100, enabled=True):
+        self.slow_ms = slow_ms
+        self.enabled = enabled
+        self._stats = {}
+        self._lock = threading.Lock()
+
+# Приведение SQL к одному виду: лишние пробелы и списки IN (?, ?, ...) схлопываются
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def normalize(sql):
+        sql = re.sub(r'\s+', ' ', sql).strip()
+        return re.sub(r'\?(\s*,\s*\?)+', '?, ...', sql)
+
+# Учет одного выполнения выражения
+    def record(self, sql, elapsed_ms, rows, conn=None, parameters=None):
+        key = self.normalize(sql)
+
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                stat = {
+                    'sql': key,
+                    'calls': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'rows': 0,
+                    'slow': 0,
+                    'histogram': [0] * len(self.BUCKETS),
+                    'plan': None
+                }
+                self._stats[key] = stat
+
+            stat['calls'] += 1
+            stat['total_ms'] += elapsed_ms
+            stat['max_ms'] = max(stat['max_ms'], elapsed_ms)
+            stat['rows'] += rows
+
+            for i, bound in enumerate(self.BUCKETS):
+                if elapsed_ms <= bound:
+                    stat['histogram'][i] += 1
+                    break
+
+            is_slow = elapsed_ms >= self.slow_ms
+            if is_slow:
+                stat['slow'] += 1
+            need_plan = is_slow and stat['plan'] is None
+
+        if not is_slow:
+            return
+
+        plan = stat['plan']
+        if need_plan and conn is not None:
+            plan = self._explain(conn, sql, parameters)
+            stat['plan'] = plan
+
+        logger.warning(f"Slow query ({elapsed_ms:.1f} ms, {rows} rows): {key}"
+                       + (f"\nQuery plan:\n{plan}" if plan else ""))
+
+# Получение плана выполнения для медленного выражения
+    @staticmethod
+    def _explain(conn, sql, parameters):
+        if not re.match(r'\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', sql, re.IGNORECASE):
+            return None
+        try:
+            rows = sqlite3.Connection.execute(conn, 'EXPLAIN QUERY PLAN ' + sql, parameters or ()).fetchall()
+            return '\n'.join(row[3] for row in rows)
+        except sqlite3.Error:
+            return None
+
+# Снимок статистики, отсортированный по суммарному времени
+    def snapshot(self, limit=None, order_by='total_ms'):
+        with self._lock:
+            stats = [dict(stat, histogram=list(stat['histogram'])) for stat in self._stats.values()]
+
+        for stat in stats:
+            stat['avg_ms'] = stat['total_ms'] / stat['calls'] if stat['calls'] else 0
+            stat['p95_ms'] = self._percentile(stat['histogram'], 0.95)
+
+        stats.sort(key=lambda stat: stat[order_by], reverse=True)
+        return stats[:limit] if limit else stats
+
+# Оценка перцентиля по гистограмме (верхняя граница корзины)
+    def _percentile(self, histogram, fraction):
+        total = sum(histogram)
+        if not total:
+            return 0
+
+        threshold = total * fraction
+        seen = 0
+        for bound, count in zip(self.BUCKETS, histogram):
+            seen += count
+            if seen >= threshold:
+                return bound
+        return self.BUCKETS[-1]
+
+# Сброс накопленной статистики
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+query_profiler = QueryProfiler(SLOW_QUERY_MS, QUERY_PROFILER_ENABLED)
+
+
+# Курсор, который замеряет время выполнения и выборки строк
+# Замер завершается, когда строки выбраны до конца, курсор переиспользован или закрыт
+class ProfiledCursor(sqlite3.Cursor):
+
+    _sql = None
+
+    def _start(self, sql, parameters):
+        self._finish()
+        self._sql = sql
+        self._parameters = parameters
+        self._elapsed = 0.0
+        self._rows = 0
+
+    def _finish(self):
+        if self._sql is None:
+            return
+
+        sql, self._sql = self._sql, None
+        rows = self._rows if self.description else max(self.rowcount, 0)
+        query_profiler.record(sql, self._elapsed * 1000, rows, self.connection, self._parameters)
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._sql is not None:
+                self._elapsed += time.perf_counter() - started
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        self._timed(super().execute, sql, parameters)
+        if not self.description:
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql, None)
+        self._timed(super().executemany, sql, seq_of_parameters)
+        self._finish()
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        elif self._sql is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, size or self.arraysize)
+        if self._sql is not None:
+            self._rows += len(rows)
+        if len(rows) < (size or self.arraysize):
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        if self._sql is not None:
+            self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+# Соединение, все запросы которого идут через ProfiledCursor
+class ProfiledConnection(sqlite3.Connection):
+
+    def cursor(self, factory=ProfiledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Пул долгоживущих соединений: одно соединение на рабочий поток
+class ConnectionPool:
+
+    # PRAGMA, которые применяются к каждому новому соединению
+    PRAGMAS = [
+        'PRAGMA foreign_keys = ON',
+        'PRAGMA journal_mode = WAL',
+        'PRAGMA synchronous = NORMAL',
+        'PRAGMA busy_timeout = 5000',
+    ]
+
+    def __init__(self, db_path, max_size=8, attachments=None):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.attachments = attachments or {}
+        self._local = threading.local()
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+# Открытие нового соединения с примененными PRAGMA
+    def _open(self):
+        factory = ProfiledConnection if query_profiler.enabled else sqlite3.Connection
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=factory)
+        conn.row_factory = sqlite3.Row
+        for pragma in self.PRAGMAS:
+            conn.execute(pragma)
+        for alias, path in self.attachments.items():
+            conn.execute(f'ATTACH DATABASE ? AS {alias}', (path,))
+        return conn
+
+# Проверка, что соединение еще живое
+    @staticmethod
+    def _is_healthy(conn):
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+# Закрытие соединений потоков, которые уже завершились
+    def _evict_dead_threads(self):
+        alive = {thread.ident for thread in threading.enumerate()}
+        for ident in [ident for ident in self._connections if ident not in alive]:
+            try:
+                self._connections.pop(ident).close()
+            except sqlite3.Error:
+                pass
+
+# Получение соединения текущего потока (создается при первом обращении)
+    def acquire(self):
+        conn = getattr(self._local, 'conn', None)
+
+        # Профилирование включили или выключили - соединение потока переоткрывается с нужным классом
+        if conn is not None and isinstance(conn, ProfiledConnection) != query_profiler.enabled:
+            self._discard(conn)
+            conn = None
+
+        if conn is not None and not self._is_healthy(conn):
+            logger.warning("Pooled connection is broken, reopening")
+            self._discard(conn)
+            conn = None
+
+        if conn is not None:
+            return conn, True
+
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Connection pool is closed")
+
+            if len(self._connections) >= self.max_size:
+                self._evict_dead_threads()
+
+            # Пул заполнен живыми потоками - выдаем временное соединение
+            if len(self._connections) >= self.max_size:
+                return self._open(), False
+
+            conn = self._open()
+            self._connections[threading.get_ident()] = conn
+            self._local.conn = conn
+            return conn, True
+
+# Возврат соединения: постоянные остаются в пуле, временные закрываются
+    def release(self, conn, pooled):
+        if not pooled:
+            conn.close()
+
+# Удаление сломанного соединения из пула
+    def _discard(self, conn):
+        with self._lock:
+            self._connections.pop(threading.get_ident(), None)
+        self._local.conn = None
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+# Закрытие всех соединений при остановке бота
+    def close_all(self):
+        with self._lock:
+            self._closed = True
+            for conn in self._connections.values():
+                try:
+                    conn.close()
+                except sqlite3.Error as e:
+                    logger.error(f"Error closing pooled connection: {e}")
+            self._connections.clear()
+        self._local = threading.local()
+
+# Количество открытых постоянных соединений
+    def size(self):
+        return len(self._connections)
+
+
+# Очередь записи: один поток-писатель владеет пишущим соединением шарда
+# Операции func(conn, *args) копятся в очереди и выполняются пачками в одной транзакции (групповой коммит),
+# каждая - в своей точке сохранения, чтобы ошибка одной операции не откатывала остальные
+class WriteQueue:
+
+    def __init__(self, manager, max_batch=100, max_wait_ms=0, enabled=True):
+        self.manager = manager
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.enabled = enabled
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+# Постановка операции в очередь; результат или исключение операции - в возвращаемом Future
+# Если поток уже держит незакоммиченную запись в этой БД, писатель ждал бы ее блокировку до busy_timeout -
+# такая операция выполняется сразу в соединении вызывающего и фиксируется вместе с его транзакцией
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+
+        if self.manager.in_write_transaction():
+            future.set_running_or_notify_cancel()
+            with self.manager.get_connection() as conn:
+                conn.execute('SAVEPOINT write_queue_inline')
+                mark = self.manager._callbacks_mark()
+                try:
+                    result = func(conn, *args, **kwargs)
+                    conn.execute('RELEASE SAVEPOINT write_queue_inline')
+                    future.set_result(result)
+                except Exception as e:
+                    conn.execute('ROLLBACK TO SAVEPOINT write_queue_inline')
+                    conn.execute('RELEASE SAVEPOINT write_queue_inline')
+                    self.manager._drop_commit_callbacks(mark)
+                    future.set_exception(e)
+            return future
+
+        if not self.enabled or self._closed:
+            future.set_running_or_notify_cancel()
+            try:
+                with self.manager.get_connection() as conn:
+                    future.set_result(func(conn, *args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+            self._queue.put((func, args, kwargs, future))
+        return future
+
+# Цикл писателя: первая операция ждется без ограничения, к ней добирается все, что накопилось в очереди
+# за время предыдущего коммита (и еще до max_wait, если задано)
+    def _run(self):
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+
+            self._commit(batch)
+
+# Выполнение пачки операций в одной транзакции
+    def _commit(self, batch):
+        results = []
+        try:
+            with self.manager.get_connection() as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                for func, args, kwargs, future in batch:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+
+                    conn.execute('SAVEPOINT write_queue')
+                    mark = self.manager._callbacks_mark()
+                    try:
+                        results.append((future, func(conn, *args, **kwargs), None))
+                        conn.execute('RELEASE SAVEPOINT write_queue')
+                    except Exception as e:
+                        conn.execute('ROLLBACK TO SAVEPOINT write_queue')
+                        conn.execute('RELEASE SAVEPOINT write_queue')
+                        self.manager._drop_commit_callbacks(mark)
+                        results.append((future, None, e))
+        except Exception as e:
+            logger.error(f"Error committing write batch: {e}")
+            for _, _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Результаты отдаются только после коммита: вызывающий сразу видит свои данные
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+# Остановка писателя: уже поставленные операции выполняются до конца
+    def close(self):
+        with self._lock:
+            self._closed = True
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
 
 # Менеджер для работы с базой данных
 class DatabaseManager:
 
-    def __init__(self, db_path='flashcards.db'):
+    def __init__(self, db_path='flashcards.db', pool_size=8, archive_path=None):
         self.db_path = db_path
+        # Архив старых сессий лежит в отдельном файле и подключается к каждому соединению как archive
+        self.archive_path = archive_path or f"{os.path.splitext(db_path)[0]}_archive.db"
+        self.pool = ConnectionPool(db_path, max_size=pool_size, attachments={'archive': self.archive_path})
+        self.writer = WriteQueue(self, WRITE_BATCH_SIZE, WRITE_BATCH_WAIT_MS, WRITE_QUEUE_ENABLED)
+        self._local = threading.local()
+        # created_at самой новой сессии в архиве (загружается при первом обращении)
+        self._archive_newest = None
+        self._archive_newest_loaded = False
         self._init_database()
 
 # Инициализация базы данных
     def _init_database(self):
         try:
             with self.get_connection() as conn:
-                conn.execute('PRAGMA foreign_keys = ON')
-                conn.execute('PRAGMA journal_mode = WAL')
                 self.create_tables(conn)
             logger.info("Database initialized successfully")
         except Exception as e:
@@ -139,7 +613,9 @@ class DatabaseManager:
                 last_reviewed
                 DATETIME,
                 next_review
-                DATETIME,
+                INTEGER
+                DEFAULT
+                0,
                 review_count
                 INTEGER
                 DEFAULT
@@ -361,98 +837,1002 @@ class DatabaseManager:
             except:
                 pass
 
+        self.run_migrations(conn)
+        self.create_archive_tables(conn)
+
+# Таблицы архивной БД: те же колонки, что и в основной, чтобы объединять их через UNION ALL
+    def create_archive_tables(self, conn):
+        conn.execute('''
+                     CREATE TABLE IF NOT EXISTS archive.study_sessions
+                     (
+                         id               INTEGER PRIMARY KEY,
+                         user_id          INTEGER NOT NULL,
+                         cards_studied    INTEGER DEFAULT 0,
+                         correct_answers  INTEGER DEFAULT 0,
+                         wrong_answers    INTEGER DEFAULT 0,
+                         session_duration INTEGER DEFAULT 0,
+                         session_type     TEXT    DEFAULT 'manual',
+                         created_at       DATETIME
+                     )
+                     ''')
+        conn.execute('''
+                     CREATE INDEX IF NOT EXISTS archive.idx_archive_sessions_user_created
+                         ON study_sessions (user_id, created_at)
+                     ''')
+        conn.execute('''
+                     CREATE INDEX IF NOT EXISTS archive.idx_archive_sessions_created
+                         ON study_sessions (created_at)
+                     ''')
+
+# Версионированные миграции схемы (номер версии хранится в PRAGMA user_version)
+    MIGRATIONS = [
+        (1, '_migration_due_index'),
+        (2, '_migration_cards_fts'),
+        (3, '_migration_cards_keyset_index'),
+        (4, '_migration_user_stats_triggers'),
+        (5, '_migration_daily_stats'),
+        (6, '_migration_sessions_user_created_index'),
+        (7, '_migration_user_default_data_trigger'),
+        (8, '_migration_quiz_sessions'),
+        (9, '_migration_success_rate_index'),
+    ]
+
+# Применение миграций, которые еще не были выполнены
+    def run_migrations(self, conn):
+        current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+
+        for version, method_name in self.MIGRATIONS:
+            if version <= current_version:
+                continue
+
+            getattr(self, method_name)(conn)
+            conn.execute(f'PRAGMA user_version = {version}')
+            logger.info(f"Database migrated to version {version}")
+
+# Миграция 1: next_review хранится как unix-время, составной индекс для выборки карточек к повторению
+    def _migration_due_index(self, conn):
+        # Старые значения записывались Python'ом как локальное время в виде строки
+        conn.execute('''
+                     UPDATE cards
+                     SET next_review = CAST(strftime('%s', next_review, 'utc') AS INTEGER)
+                     WHERE typeof(next_review) = 'text'
+                     ''')
+        conn.execute('UPDATE cards SET next_review = 0 WHERE next_review IS NULL')
+        conn.execute('''
+                     CREATE INDEX IF NOT EXISTS idx_cards_due
+                         ON cards (user_id, status, next_review)
+                     ''')
+
+# Миграция 2: полнотекстовый индекс FTS5 по front/back, синхронизируется триггерами
+    def _migration_cards_fts(self, conn):
+        try:
+            conn.execute('''
+                         CREATE VIRTUAL TABLE IF NOT EXISTS cards_fts
+                             USING fts5(front, back, content='cards', content_rowid='id', tokenize='trigram')
+                         ''')
+        except sqlite3.OperationalError as e:
+            # SQLite собран без FTS5 - поиск останется на LIKE
+            logger.warning(f"FTS5 is not available, card search will use LIKE: {e}")
+            return
+
+        triggers = [
+            '''
+            CREATE TRIGGER IF NOT EXISTS cards_fts_insert AFTER INSERT ON cards
+            BEGIN
+                INSERT INTO cards_fts (rowid, front, back) VALUES (new.id, new.front, new.back);
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS cards_fts_delete AFTER DELETE ON cards
+            BEGIN
+                INSERT INTO cards_fts (cards_fts, rowid, front, back) VALUES ('delete', old.id, old.front, old.back);
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS cards_fts_update AFTER UPDATE OF front, back ON cards
+            BEGIN
+                INSERT INTO cards_fts (cards_fts, rowid, front, back) VALUES ('delete', old.id, old.front, old.back);
+                INSERT INTO cards_fts (rowid, front, back) VALUES (new.id, new.front, new.back);
+            END
+            ''',
+        ]
+
+        for trigger_sql in triggers:
+            conn.execute(trigger_sql)
+
+        conn.execute("INSERT INTO cards_fts (cards_fts) VALUES ('rebuild')")
+
+# Миграция 3: индекс для постраничного вывода карточек по (created_at, id)
+    def _migration_cards_keyset_index(self, conn):
+        conn.execute('''
+                     CREATE INDEX IF NOT EXISTS idx_cards_user_created
+                         ON cards (user_id, created_at, id)
+                     ''')
+
+# Миграция 4: счетчики user_stats поддерживаются триггерами на cards и study_sessions
+# Счетчики сессий накопительные: удаление старых сессий их не уменьшает
+    def _migration_user_stats_triggers(self, conn):
+        triggers = [
+            '''
+            CREATE TRIGGER IF NOT EXISTS user_stats_card_insert AFTER INSERT ON cards
+            BEGIN
+                UPDATE user_stats
+                SET total_cards   = total_cards + 1,
+                    learned_cards = learned_cards + (new.status = 'learned'),
+                    updated_at    = CURRENT_TIMESTAMP
+                WHERE user_id = new.user_id;
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS user_stats_card_delete AFTER DELETE ON cards
+            BEGIN
+                UPDATE user_stats
+                SET total_cards   = total_cards - 1,
+                    learned_cards = learned_cards - (old.status = 'learned'),
+                    updated_at    = CURRENT_TIMESTAMP
+                WHERE user_id = old.user_id;
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS user_stats_card_status AFTER UPDATE OF status ON cards
+                WHEN (old.status = 'learned') != (new.status = 'learned')
+            BEGIN
+                UPDATE user_stats
+                SET learned_cards = learned_cards + (new.status = 'learned') - (old.status = 'learned'),
+                    updated_at    = CURRENT_TIMESTAMP
+                WHERE user_id = new.user_id;
+            END
+            ''',
+            '''
+            CREATE TRIGGER IF NOT EXISTS user_stats_session_insert AFTER INSERT ON study_sessions
+            BEGIN
+                UPDATE user_stats
+                SET total_sessions   = total_sessions + 1,
+                    total_study_time = total_study_time + COALESCE(new.session_duration, 0),
+                    correct_answers  = correct_answers + COALESCE(new.correct_answers, 0),
+                    wrong_answers    = wrong_answers + COALESCE(new.wrong_answers, 0),
+                    updated_at       = CURRENT_TIMESTAMP
+                WHERE user_id = new.user_id;
+            END
+            ''',
+        ]
+
+        for trigger_sql in triggers:
+            conn.execute(trigger_sql)
+
+        # Счетчики карточек до миграции могли разойтись с реальными данными
+        self.rebuild_user_stats(conn)
+
+# Миграция 5: дневные итоги сессий по пользователю, помесячная статистика строится из них
+    def _migration_daily_stats(self, conn):
+        conn.execute('''
+                     CREATE TABLE IF NOT EXISTS daily_stats
+                     (
+                         user_id           INTEGER NOT NULL,
+                         date              TEXT    NOT NULL,
+                         sessions          INTEGER DEFAULT 0,
+                         cards_studied     INTEGER DEFAULT 0,
+                         correct_answers   INTEGER DEFAULT 0,
+                         wrong_answers     INTEGER DEFAULT 0,
+                         total_time        REAL    DEFAULT 0,
+                         accuracy_sum      REAL    DEFAULT 0,
+                         accuracy_sessions INTEGER DEFAULT 0,
+                         PRIMARY KEY (user_id, date),
+                         FOREIGN KEY (user_id) REFERENCES users (telegram_id) ON DELETE CASCADE
+                     ) WITHOUT ROWID
+                     ''')
+
+        # Точность сессии без ответов не определена и в среднее не входит, как и в AVG по сессиям
+        conn.execute('''
+                     CREATE TRIGGER IF NOT EXISTS daily_stats_session_insert AFTER INSERT ON study_sessions
+                     BEGIN
+                         INSERT INTO daily_stats (user_id, date, sessions, cards_studied, correct_answers,
+                                                  wrong_answers, total_time, accuracy_sum, accuracy_sessions)
+                         VALUES (new.user_id, DATE(new.created_at), 1, COALESCE(new.cards_studied, 0),
+                                 COALESCE(new.correct_answers, 0), COALESCE(new.wrong_answers, 0),
+                                 COALESCE(new.session_duration, 0),
+                                 COALESCE(new.correct_answers * 100.0 / (new.correct_answers + new.wrong_answers), 0),
+                                 (new.correct_answers + new.wrong_answers) > 0)
+                         ON CONFLICT (user_id, date) DO UPDATE
+                             SET sessions          = sessions + 1,
+                                 cards_studied     = cards_studied + excluded.cards_studied,
+                                 correct_answers   = correct_answers + excluded.correct_answers,
+                                 wrong_answers     = wrong_answers + excluded.wrong_answers,
+                                 total_time        = total_time + excluded.total_time,
+                                 accuracy_sum      = accuracy_sum + excluded.accuracy_sum,
+                                 accuracy_sessions = accuracy_sessions + excluded.accuracy_sessions;
+                     END
+                     ''')
+
+        conn.execute('''
+                     CREATE VIEW IF NOT EXISTS monthly_stats AS
+                     SELECT user_id,
+                            substr(date, 1, 7)     as month,
+                            SUM(sessions)          as sessions,
+                            SUM(cards_studied)     as cards_studied,
+                            SUM(correct_answers)   as correct_answers,
+                            SUM(wrong_answers)     as wrong_answers,
+                            SUM(total_time)        as total_time,
+                            SUM(accuracy_sum) / NULLIF(SUM(accuracy_sessions), 0) as accuracy
+                     FROM daily_stats
+                     GROUP BY user_id, substr(date, 1, 7)
+                     ''')
+
+        # Заполнение итогов по уже сохраненным сессиям
+        conn.execute('''
+                     INSERT OR REPLACE INTO daily_stats
+                     (user_id, date, sessions, cards_studied, correct_answers, wrong_answers,
+                      total_time, accuracy_sum, accuracy_sessions)
+                     SELECT user_id,
+                            DATE(created_at),
+                            COUNT(*),
+                            COALESCE(SUM(cards_studied), 0),
+                            COALESCE(SUM(correct_answers), 0),
+                            COALESCE(SUM(wrong_answers), 0),
+                            COALESCE(SUM(session_duration), 0),
+                            COALESCE(SUM(correct_answers * 100.0 / (correct_answers + wrong_answers)), 0),
+                            COUNT(correct_answers * 100.0 / (correct_answers + wrong_answers))
+                     FROM study_sessions
+                     GROUP BY user_id, DATE(created_at)
+                     ''')
+
+# Миграция 6: индекс для выборки последних сессий пользователя и переноса старых сессий в архив
+    def _migration_sessions_user_created_index(self, conn):
+        conn.execute('''
+                     CREATE INDEX IF NOT EXISTS idx_study_sessions_user_created
+                         ON study_sessions (user_id, created_at)
+                     ''')
+
+# Миграция 7: дефолтные категория, напоминание и статистика создаются триггером при вставке пользователя,
+# поэтому регистрация - это один оператор INSERT ... ON CONFLICT
+    def _migration_user_default_data_trigger(self, conn):
+        conn.execute('''
+                     CREATE TRIGGER IF NOT EXISTS users_default_data AFTER INSERT ON users
+                     BEGIN
+                         INSERT INTO categories (user_id, name, description)
+                         VALUES (new.telegram_id, 'По умолчанию', 'Основная категория для карточек');
+
+                         INSERT INTO reminders (user_id)
+                         VALUES (new.telegram_id);
+
+                         INSERT OR IGNORE INTO user_stats (user_id)
+                         VALUES (new.telegram_id);
+                     END
+                     ''')
+
+# Миграция 8: хранилище сессий тестирования (используется SQLiteSessionStore в первом шарде)
+    def _migration_quiz_sessions(self, conn):
+        conn.execute('''
+                     CREATE TABLE IF NOT EXISTS quiz_sessions
+                     (
+                         session_id TEXT PRIMARY KEY,
+                         user_id    INTEGER NOT NULL,
+                         data       BLOB    NOT NULL,
+                         updated_at INTEGER NOT NULL
+                     )
+                     ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_quiz_sessions_updated ON quiz_sessions (updated_at)')
+
+# Миграция 9: индексы по выражению доли верных ответов для выборки самых сложных/легких карточек
+    def _migration_success_rate_index(self, conn):
+        conn.execute(f'''
+                     CREATE INDEX IF NOT EXISTS idx_cards_user_success_rate
+                         ON cards (user_id, {SUCCESS_RATE_SQL})
+                     ''')
+        conn.execute(f'''
+                     CREATE INDEX IF NOT EXISTS idx_cards_category_success_rate
+                         ON cards (category_id, {SUCCESS_RATE_SQL})
+                     ''')
+
+# Пересчет счетчиков user_stats по данным таблиц, возвращает число обновленных строк
+# Счетчики сессий (include_sessions) считаются вместе с перенесенными в архив
+    @staticmethod
+    def rebuild_user_stats(conn, telegram_id=None, include_sessions=False):
+        user_filter = 'WHERE telegram_id = ?' if telegram_id else ''
+        stats_filter = 'WHERE user_id = ?' if telegram_id else ''
+        params = (telegram_id,) if telegram_id else ()
+
+        conn.execute(f'''
+                     INSERT OR IGNORE INTO user_stats (user_id)
+                     SELECT telegram_id FROM users {user_filter}
+                     ''', params)
+
+        cursor = conn.execute(f'''
+                              UPDATE user_stats
+                              SET total_cards   = (SELECT COUNT(*)
+                                                   FROM cards
+                                                   WHERE cards.user_id = user_stats.user_id),
+                                  learned_cards = (SELECT COUNT(*)
+                                                   FROM cards
+                                                   WHERE cards.user_id = user_stats.user_id
+                                                     AND cards.status = 'learned'),
+                                  updated_at    = CURRENT_TIMESTAMP
+                              {stats_filter}
+                              ''', params)
+        updated = cursor.rowcount
+
+        if include_sessions:
+            conn.execute(f'''
+                         UPDATE user_stats
+                         SET (total_sessions, total_study_time, correct_answers, wrong_answers) =
+                                 (SELECT COUNT(*),
+                                         COALESCE(SUM(session_duration), 0),
+                                         COALESCE(SUM(correct_answers), 0),
+                                         COALESCE(SUM(wrong_answers), 0)
+                                  FROM (SELECT user_id, session_duration, correct_answers, wrong_answers
+                                        FROM main.study_sessions
+                                        UNION ALL
+                                        SELECT user_id, session_duration, correct_answers, wrong_answers
+                                        FROM archive.study_sessions) sessions
+                                  WHERE sessions.user_id = user_stats.user_id)
+                         {stats_filter}
+                         ''', params)
+
+        return updated
+
 # Контекстный менеджер для соединения с БД
+# Вложенные вызовы в одном потоке используют то же соединение и одну транзакцию
     @contextmanager
     def get_connection(self):
-        conn = None
+        depth = getattr(self._local, 'depth', 0)
+
+        if depth > 0:
+            self._local.depth = depth + 1
+            try:
+                yield self._local.conn
+            finally:
+                self._local.depth = depth
+            return
+
+        conn, pooled = self.pool.acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        self._local.callbacks = []
+        committed = False
+        try:
+            yield conn
+            conn.commit()
+            committed = True
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Database error: {e}")
+            raise
+        finally:
+            callbacks, self._local.callbacks = self._local.callbacks, []
+            self._local.depth = 0
+            self._local.conn = None
+            self.pool.release(conn, pooled)
+            self._run_callbacks(callbacks, committed)
+
+# Отложенный вызов до конца открытой в потоке транзакции этой БД; False, если транзакции нет
+# always=False - только после коммита (применение записанного состояния),
+# always=True - и после отката (сброс кэшей, которые могли заполниться незакоммиченными данными)
+    def defer(self, callback, always=False):
+        if getattr(self._local, 'depth', 0) == 0:
+            return False
+        self._local.callbacks.append((callback, always))
+        return True
+
+# Отметка в списке отложенных вызовов перед операцией, которую можно откатить до точки сохранения
+    def _callbacks_mark(self):
+        return len(self._local.callbacks)
+
+# Операция откачена до точки сохранения: ее вызовы «после коммита» больше не нужны
+    def _drop_commit_callbacks(self, mark):
+        callbacks = self._local.callbacks
+        callbacks[mark:] = [entry for entry in callbacks[mark:] if entry[1]]
+
+    @staticmethod
+    def _run_callbacks(callbacks, committed):
+        for callback, always in callbacks:
+            if committed or always:
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"Error in transaction callback: {e}")
+
+# Держит ли текущий поток незакоммиченную запись в соединении этой БД
+    def in_write_transaction(self):
+        conn = getattr(self._local, 'conn', None)
+        return conn is not None and conn.in_transaction
+
+# Отдельное соединение со своей транзакцией: фиксируется само по себе, даже если поток
+# уже находится внутри get_connection. Если поток уже пишет в эту БД, второе пишущее соединение
+# ждало бы его блокировку до busy_timeout - в этом случае ошибка выдается сразу
+    @contextmanager
+    def own_transaction(self):
+        if self.in_write_transaction():
+            raise sqlite3.OperationalError("Current thread holds an uncommitted write on this database")
+
+        conn = self.pool._open()
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
+            conn.execute('BEGIN IMMEDIATE')
             yield conn
             conn.commit()
         except Exception as e:
-            if conn:
-                conn.rollback()
+            conn.rollback()
             logger.error(f"Database error: {e}")
             raise
         finally:
-            if conn:
-                conn.close()
+            conn.close()
+
+# created_at самой новой сессии в архиве шарда: все сессии новее лежат в основной БД
+    def archive_newest(self, conn):
+        if not self._archive_newest_loaded:
+            self._archive_newest = conn.execute('SELECT MAX(created_at) FROM archive.study_sessions').fetchone()[0]
+            self._archive_newest_loaded = True
+        return self._archive_newest
+
+# Учет перенесенной в архив порции сессий
+    def note_archived(self, created_at):
+        if self._archive_newest_loaded and (self._archive_newest is None or created_at > self._archive_newest):
+            self._archive_newest = created_at
+
+# Закрытие всех соединений пула (после того как писатель допишет очередь)
+    def close(self):
+        self.writer.close()
+        self.pool.close_all()
+        logger.info("Database connections closed")
+
+
+# ШАРДИРОВАНИЕ
+# Маршрутизатор шардов: данные пользователя целиком лежат в одном файле, номер шарда = telegram_id % N
+# Шард 0 - исходный flashcards.db, остальные - flashcards_shard{N}.db, у каждого свой пул и своя блокировка записи
+class ShardRouter:
+
+    # Таблицы с данными пользователя: (исходная таблица, колонка с telegram_id, таблица в целевом шарде)
+    # в порядке копирования при перебалансировке. Архивные сессии копируются в архив целевого шарда
+    # с новыми id (id в разных архивах пересекаются)
+    USER_TABLES = [
+        ('users', 'telegram_id', 'users'),
+        ('reminders', 'user_id', 'reminders'),
+        ('categories', 'user_id', 'categories'),
+        ('cards', 'user_id', 'cards'),
+        ('study_sessions', 'user_id', 'study_sessions'),
+        ('archive.study_sessions', 'user_id', 'archive.study_sessions'),
+        ('daily_stats', 'user_id', 'daily_stats'),
+        ('user_stats', 'user_id', 'user_stats'),
+    ]
+
+    # Таблицы, которые триггеры заполняют при копировании пользователя, карточек и сессий;
+    # вместо пересчитанных триггерами строк сохраняются скопированные счетчики
+    TRIGGER_TABLES = ('daily_stats', 'user_stats')
+
+    def __init__(self, db_path='flashcards.db', shard_count=1, pool_size=8):
+        self.db_path = db_path
+        self.shard_count = max(shard_count, 1)
+        self.shards = [DatabaseManager(self.shard_path(db_path, i), pool_size) for i in range(self.shard_count)]
+        self._local = threading.local()
+
+# Путь к файлу шарда (шард 0 сохраняет исходное имя)
+    @staticmethod
+    def shard_path(db_path, index):
+        if index == 0:
+            return db_path
+        base, ext = os.path.splitext(db_path)
+        return f"{base}_shard{index}{ext}"
+
+# Номер шарда пользователя
+    def shard_index(self, telegram_id):
+        return telegram_id % self.shard_count
+
+# Шард пользователя
+    def shard_for(self, telegram_id):
+        return self.shards[self.shard_index(telegram_id)]
+
+# Шард, к которому привязан текущий поток (по умолчанию - шард 0)
+    def current_shard(self):
+        telegram_id = getattr(self._local, 'telegram_id', None)
+        return self.shard_for(telegram_id) if telegram_id is not None else self.shards[0]
+
+# Соединение с шардом пользователя; пока блок открыт, вложенные вызовы без telegram_id идут в тот же шард
+    @contextmanager
+    def get_connection(self, telegram_id=None):
+        if telegram_id is None:
+            with self.current_shard().get_connection() as conn:
+                yield conn
+            return
+
+        previous = getattr(self._local, 'telegram_id', None)
+        self._local.telegram_id = telegram_id
+        try:
+            with self.shard_for(telegram_id).get_connection() as conn:
+                yield conn
+        finally:
+            self._local.telegram_id = previous
+
+# Вызов после коммита транзакции, открытой в потоке (сразу, если транзакции нет)
+    def after_commit(self, callback):
+        self._defer(callback, False)
+
+# Вызов после завершения транзакции потока коммитом или откатом (сразу, если транзакции нет)
+# Так сбрасываются кэши: сброс до коммита позволил бы другому потоку закэшировать старые данные
+    def after_transaction(self, callback):
+        self._defer(callback, True)
+
+    def _defer(self, callback, always):
+        for shard in self.shards:
+            if shard.defer(callback, always):
+                return
+        callback()
+
+# Запись через очередь писателя шарда пользователя, возвращает Future
+    def submit_write(self, telegram_id, func, *args, **kwargs):
+        return self.shard_for(telegram_id).writer.submit(func, *args, **kwargs)
+
+# Выполнение func(conn, *args) на каждом шарде, результаты возвращаются списком в порядке шардов
+    def map_shards(self, func, *args, **kwargs):
+        results = []
+        for shard in self.shards:
+            with shard.get_connection() as conn:
+                results.append(func(conn, *args, **kwargs))
+        return results
+
+# Инициализация всех шардов
+    def _init_database(self):
+        for shard in self.shards:
+            shard._init_database()
+
+# Перенос пользователей в их шарды (после изменения SHARD_COUNT или перехода с одного файла)
+# Файлы шардов с номерами >= N тоже просматриваются, чтобы уменьшение N не теряло данные
+    def rebalance(self):
+        moved = 0
+        extra = []
+        index = self.shard_count
+        while os.path.exists(self.shard_path(self.db_path, index)):
+            extra.append(DatabaseManager(self.shard_path(self.db_path, index)))
+            index += 1
+
+        try:
+            for index, shard in enumerate(self.shards + extra):
+                with shard.get_connection() as conn:
+                    user_ids = [row['telegram_id'] for row in conn.execute('SELECT telegram_id FROM users')]
+
+                for telegram_id in user_ids:
+                    if self.shard_index(telegram_id) == index:
+                        continue
+
+                    # Сначала пользователь фиксируется в целевом шарде, затем удаляется из исходного;
+                    # при сбое между шагами повторный запуск перезапишет копию в целевом шарде
+                    target_shard = self.shard_for(telegram_id)
+                    with target_shard.get_connection() as target, shard.get_connection() as source:
+                        self._delete_user(target, telegram_id)
+                        self._copy_user(source, target, telegram_id)
+                        archived = source.execute('SELECT MAX(created_at) FROM archive.study_sessions '
+                                                  'WHERE user_id = ?', (telegram_id,)).fetchone()[0]
+                    if archived:
+                        target_shard.note_archived(archived)
+
+                    with shard.get_connection() as source:
+                        self._delete_user(source, telegram_id)
+
+                    moved += 1
+        finally:
+            for shard in extra:
+                shard.close()
+
+        if moved:
+            # Категории и карточки перенесенных пользователей получили новые id
+            category_cache.clear()
+            due_index.clear()
+            forecast_cache.clear()
+            logger.info(f"Rebalanced {moved} users across {self.shard_count} shards")
+        return moved
+
+# Копирование всех данных пользователя между шардами (id категорий переназначаются)
+    def _copy_user(self, source, target, telegram_id):
+        category_ids = {}
+
+        for table, column, target_table in self.USER_TABLES:
+            schema, _, name = table.rpartition('.')
+            prefix = f"{schema}." if schema else ''
+            columns = [row['name'] for row in source.execute(f'PRAGMA {prefix}table_info({name})')
+                       if row['name'] != 'id']
+
+            rows = source.execute(f'SELECT * FROM {table} WHERE {column} = ?', (telegram_id,)).fetchall()
+            if not rows:
+                continue
+            if target_table in self.TRIGGER_TABLES:
+                target.execute(f'DELETE FROM {target_table} WHERE {column} = ?', (telegram_id,))
+
+            insert = (f'INSERT INTO {target_table} ({", ".join(columns)}) '
+                      f'VALUES ({", ".join("?" * len(columns))})')
+
+            if table == 'users':
+                target.executemany(insert, ([row[c] for c in columns] for row in rows))
+                # Дефолтные данные, созданные триггером, заменяются скопированными
+                target.execute('DELETE FROM categories WHERE user_id = ?', (telegram_id,))
+                target.execute('DELETE FROM reminders WHERE user_id = ?', (telegram_id,))
+            elif table == 'categories':
+                for row in rows:
+                    category_ids[row['id']] = target.execute(insert, [row[c] for c in columns]).lastrowid
+            elif table == 'cards':
+                target.executemany(insert, ([category_ids.get(row[c]) if c == 'category_id' else row[c]
+                                             for c in columns] for row in rows))
+            else:
+                target.executemany(insert, ([row[c] for c in columns] for row in rows))
+
+# Удаление всех данных пользователя из шарда (каскад по внешним ключам + архив)
+    @staticmethod
+    def _delete_user(conn, telegram_id):
+        conn.execute('DELETE FROM archive.study_sessions WHERE user_id = ?', (telegram_id,))
+        conn.execute('DELETE FROM users WHERE telegram_id = ?', (telegram_id,))
+
+# Закрытие соединений всех шардов
+    def close(self):
+        for shard in self.shards:
+            shard.close()
 
 
-db_manager = DatabaseManager()
+db_manager = ShardRouter(shard_count=SHARD_COUNT)
 
 
 # Декоратор для автоматического предоставления соединения с БД
-def with_connection(func):
+# Без функции работает как контекстный менеджер: with with_connection(telegram_id=user_id) as conn
+# (telegram_id выбирает шард пользователя; без него используется шард, к которому привязан поток)
+# Если первым аргументом уже передано соединение, оно используется повторно
+def with_connection(func=None, telegram_id=None):
+    if func is None:
+        return db_manager.get_connection(telegram_id)
 
     def wrapper(*args, **kwargs):
+        if args and isinstance(args[0], sqlite3.Connection):
+            return func(*args, **kwargs)
         with db_manager.get_connection() as conn:
             return func(conn, *args, **kwargs)
 
     return wrapper
 
 
+# Ограниченный LRU-кэш: при переполнении вытесняются давно не использованные ключи,
+# при заданном ttl (в секундах) записи устаревают по времени
+class LRUCache:
+
+    def __init__(self, max_size=10000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # Номер сброса: запись, прочитанная из БД до сброса, не сохраняется (см. set)
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[0] is not None and entry[0] < time.monotonic()):
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+# Сохранение значения; с epoch (взятым до чтения из БД) значение отбрасывается, если с тех пор был сброс
+    def set(self, key, value, epoch=None):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if epoch is not None and epoch != self._epoch:
+                return False
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            return True
+
+    def epoch(self):
+        return self._epoch
+
+    def pop(self, key):
+        with self._lock:
+            self._epoch += 1
+            entry = self._data.pop(key, None)
+            return entry[1] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._data.clear()
+
+# Удаление всех записей, ключи которых удовлетворяют predicate
+    def pop_where(self, predicate):
+        with self._lock:
+            self._epoch += 1
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+# Сброс записи (или всего кэша) сразу - чтобы транзакция видела свои изменения - и еще раз после ее
+# завершения: другой поток мог за это время закэшировать данные до коммита
+    def invalidate(self, key):
+        self.pop(key)
+        db_manager.after_transaction(lambda: self.pop(key))
+
+    def invalidate_all(self):
+        self.clear()
+        db_manager.after_transaction(self.clear)
+
+    def invalidate_where(self, predicate):
+        self.pop_where(predicate)
+        db_manager.after_transaction(lambda: self.pop_where(predicate))
+
+# Счетчики попаданий для админ-панели
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Профили пользователей, уже записанные в БД (telegram_id -> username, имя, фамилия, язык)
+known_users = LRUCache(KNOWN_USERS_CACHE_SIZE)
+
+# Категории пользователя (telegram_id -> список категорий), сбрасываются при любом изменении категорий
+category_cache = LRUCache(CATEGORY_CACHE_SIZE, CATEGORY_CACHE_TTL)
+
+# Прогнозы нагрузки повторений ((telegram_id или None, число дней, начало дня) -> прогноз)
+# Сбрасываются вместе с индексом повторений (invalidate_forecast) и по TTL
+forecast_cache = LRUCache(FORECAST_CACHE_SIZE, FORECAST_CACHE_TTL)
+
+
+# Сброс прогнозов пользователя и общего прогноза после изменения расписания его карточек
+def invalidate_forecast(telegram_id):
+    forecast_cache.invalidate_where(lambda key: key[0] in (telegram_id, None))
+
+
+# Карточки одного пользователя для индекса повторений: хранятся только поля расписания и приоритета (COLUMNS),
+# в кучах - только ключи
+# future - изучаемые карточки по времени повторения, due - уже наступившие в порядке get_cards_for_review
+# Устаревшие записи куч не удаляются сразу, а пропускаются по номеру версии карточки
+class UserDueCards:
+    COLUMNS = ('id', 'status', 'next_review', 'difficulty', 'review_count', 'correct_answers', 'wrong_answers')
+
+    def __init__(self, rows):
+        self.cards = {}
+        self.future = []
+        self.due = []
+        self.version = 0
+        for row in rows:
+            self.put(row)
+
+    @staticmethod
+    def priority(card):
+        difficulty = card['difficulty'] or 0
+        review_count = card['review_count'] or 0
+        group = 1 if difficulty >= 4 else 2 if difficulty >= 2 else 3
+        # В SQL доля верных ответов при review_count = 0 равна NULL и идет первой
+        rate = (1, card['correct_answers'] / review_count) if review_count else (0, 0)
+        return group, review_count, rate, card['id']
+
+    def put(self, card):
+        self.version += 1
+        self.cards[card['id']] = (self.version, card)
+        if card['status'] == 'learning':
+            heapq.heappush(self.future, (card['next_review'] or 0, self.version, card['id']))
+        self._compact()
+
+    def remove(self, card_id):
+        self.cards.pop(card_id, None)
+
+    def _valid(self, version, card_id):
+        entry = self.cards.get(card_id)
+        return entry is not None and entry[0] == version
+
+# Перенос наступивших карточек в due и выбор limit первых: O(k log n)
+    def take(self, now, limit):
+        while self.future and self.future[0][0] <= now:
+            _, version, card_id = heapq.heappop(self.future)
+            if self._valid(version, card_id):
+                heapq.heappush(self.due, (self.priority(self.cards[card_id][1]), version, card_id))
+
+        taken = []
+        while self.due and len(taken) < limit:
+            entry = heapq.heappop(self.due)
+            if self._valid(entry[1], entry[2]):
+                taken.append(entry)
+
+        for entry in taken:
+            heapq.heappush(self.due, entry)
+
+        return [self.cards[card_id][1] for _, _, card_id in taken]
+
+# Пересборка куч, когда устаревших записей становится больше, чем живых
+    def _compact(self):
+        if len(self.future) + len(self.due) <= 2 * len(self.cards) + 64:
+            return
+
+        self.future = [entry for entry in self.future if self._valid(entry[1], entry[2])]
+        self.due = [entry for entry in self.due if self._valid(entry[1], entry[2])]
+        heapq.heapify(self.future)
+        heapq.heapify(self.due)
+
+
+# Индекс карточек к повторению в памяти процесса: прогревается из БД при первом запросе пользователя,
+# записанные ответы и удаления применяются на месте, остальные изменения карточек сбрасывают индекс пользователя.
+# Сбросы выполняются сразу (транзакция видит свои изменения) и повторяются после ее завершения: иначе другой
+# поток мог бы прогреть индекс из данных до коммита и держать его до истечения ttl. Записанное состояние
+# карточки после ответа применяется только после коммита
+class DueIndex:
+
+    def __init__(self, max_users=1000, ttl=600, enabled=True):
+        self.enabled = enabled
+        self._users = LRUCache(max_users, ttl)
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self.warmups = 0
+
+    def get_due(self, conn, telegram_id, now, limit):
+        with self._lock:
+            user_cards = self._users.get(telegram_id)
+            if user_cards is not None:
+                due = user_cards.take(now, limit)
+            epoch = self._epoch
+
+        if user_cards is not None:
+            return self._load_cards(conn, due)
+
+        cursor = conn.execute(f'''
+                              SELECT {', '.join(UserDueCards.COLUMNS)}
+                              FROM cards
+                              WHERE user_id = ?
+                              ''', (telegram_id,))
+        user_cards = UserDueCards(dict(row) for row in cursor.fetchall())
+        due = user_cards.take(now, limit)
+
+        # Пока ответы пользователя лежат в буфере, БД отстает от них - такой снимок не сохраняем
+        if not review_buffer.has_pending(telegram_id):
+            with self._lock:
+                if self._epoch == epoch:
+                    self._users.set(telegram_id, user_cards)
+                    self.warmups += 1
+        return self._load_cards(conn, due)
+
+# Полные строки выбранных карточек (по первичному ключу) в порядке индекса;
+# поля расписания берутся из индекса - он уже учитывает ответы из буфера
+    @staticmethod
+    def _load_cards(conn, due):
+        if not due:
+            return []
+
+        placeholders = ','.join('?' * len(due))
+        cursor = conn.execute(f'''
+                              SELECT c.*, cat.name as category_name
+                              FROM cards c
+                                       LEFT JOIN categories cat ON c.category_id = cat.id
+                              WHERE c.id IN ({placeholders})
+                              ''', [card['id'] for card in due])
+        rows = {row['id']: dict(row) for row in cursor.fetchall()}
+
+        cards = []
+        for card in due:
+            row = rows.get(card['id'])
+            if row is not None:
+                row.update(card)
+                cards.append(row)
+        return cards
+
+# Ответ из буфера отложенной записи: применяется к индексу сразу, до записи в БД
+    def apply_review(self, telegram_id, card_id, is_correct):
+        with self._lock:
+            user_cards = self._users.get(telegram_id)
+            entry = user_cards.cards.get(card_id) if user_cards is not None else None
+            if entry is None:
+                self._epoch += 1
+                return
+
+            card = dict(entry[1])
+            card.update(CardUtils._apply_review(card, is_correct))
+            user_cards.put(card)
+
+# Записанное состояние карточки (поля из COLUMNS) - после коммита
+    def update_card(self, telegram_id, card):
+        db_manager.after_commit(lambda: self._update_card(telegram_id, card))
+
+    def _update_card(self, telegram_id, card):
+        with self._lock:
+            self._epoch += 1
+            user_cards = self._users.get(telegram_id)
+            entry = user_cards.cards.get(card['id']) if user_cards is not None else None
+            if entry is not None:
+                merged = dict(entry[1])
+                merged.update((key, card[key]) for key in UserDueCards.COLUMNS if key in card)
+                user_cards.put(merged)
+
+    def remove(self, telegram_id, card_id):
+        self._remove(telegram_id, card_id)
+        db_manager.after_transaction(lambda: self._remove(telegram_id, card_id))
+
+    def _remove(self, telegram_id, card_id):
+        with self._lock:
+            self._epoch += 1
+            user_cards = self._users.get(telegram_id)
+            if user_cards is not None:
+                user_cards.remove(card_id)
+
+    def invalidate(self, telegram_id):
+        self._invalidate(telegram_id)
+        db_manager.after_transaction(lambda: self._invalidate(telegram_id))
+
+    def _invalidate(self, telegram_id):
+        with self._lock:
+            self._epoch += 1
+            self._users.pop(telegram_id)
+
+    def clear(self):
+        self._clear()
+        db_manager.after_transaction(self._clear)
+
+    def _clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._users.clear()
+
+    def stats(self):
+        stats = self._users.stats()
+        stats['warmups'] = self.warmups
+        return stats
+
+
+due_index = DueIndex(DUE_INDEX_MAX_USERS, DUE_INDEX_TTL, DUE_INDEX_ENABLED)
+
+
 # УТИЛИТЫ ДЛЯ РАБОТЫ С ПОЛЬЗОВАТЕЛЯМИ
 class UserUtils:
 
-# Создание или обновление пользователя
+# Создание или обновление пользователя одним оператором; неизмененный профиль не пишется вовсе
     @staticmethod
     @with_connection
     def create_or_update_user(conn, telegram_id, username=None, first_name=None, last_name=None, language_code='ru'):
         try:
-            cursor = conn.execute(
-                'SELECT id FROM users WHERE telegram_id = ?',
-                (telegram_id,)
-            )
-            user_exists = cursor.fetchone()
-
-            if user_exists:
-                conn.execute('''
-                             UPDATE users
-                             SET username      = ?,
-                                 first_name    = ?,
-                                 last_name     = ?,
-                                 language_code = ?,
-                                 last_active   = CURRENT_TIMESTAMP
-                             WHERE telegram_id = ?
-                             ''', (username, first_name, last_name, language_code, telegram_id))
-            else:
-                conn.execute('''
-                             INSERT INTO users
-                                 (telegram_id, username, first_name, last_name, language_code)
-                             VALUES (?, ?, ?, ?, ?)
-                             ''', (telegram_id, username, first_name, last_name, language_code))
-
-                UserUtils._create_default_user_data(conn, telegram_id)
+            profile = (username, first_name, last_name, language_code)
+            if known_users.get(telegram_id) == profile:
+                activity_tracker.touch(telegram_id)
+                return True
 
+            # Дефолтные данные нового пользователя создает триггер users_default_data;
+            # строка существующего пользователя переписывается, только если профиль изменился
+            cursor = conn.execute('''
+                                  INSERT INTO users
+                                      (telegram_id, username, first_name, last_name, language_code)
+                                  VALUES (?, ?, ?, ?, ?)
+                                  ON CONFLICT (telegram_id) DO UPDATE
+                                      SET username      = excluded.username,
+                                          first_name    = excluded.first_name,
+                                          last_name     = excluded.last_name,
+                                          language_code = excluded.language_code,
+                                          last_active   = CURRENT_TIMESTAMP
+                                      WHERE users.username IS NOT excluded.username
+                                         OR users.first_name IS NOT excluded.first_name
+                                         OR users.last_name IS NOT excluded.last_name
+                                         OR users.language_code IS NOT excluded.language_code
+                                  ''', (telegram_id, username, first_name, last_name, language_code))
+            if cursor.rowcount == 0:
+                activity_tracker.touch(telegram_id)
+
+            # Профиль запоминается только после коммита: при откате пользователь должен записаться снова
+            epoch = known_users.epoch()
+            db_manager.after_commit(lambda: known_users.set(telegram_id, profile, epoch))
+            category_cache.invalidate(telegram_id)
             return True
         except Exception as e:
             logger.error(f"Error creating/updating user: {e}")
             return False
 
-# Создание дефолтных данных для пользователя
-    @staticmethod
-    def _create_default_user_data(conn, telegram_id):
-        try:
-            conn.execute('''
-                         INSERT INTO categories (user_id, name, description)
-                         VALUES (?, 'По умолчанию', 'Основная категория для карточек')
-                         ''', (telegram_id,))
-
-            conn.execute('''
-                         INSERT INTO reminders (user_id)
-                         VALUES (?)
-                         ''', (telegram_id,))
-
-            conn.execute('''
-                         INSERT INTO user_stats (user_id)
-                         VALUES (?)
-                         ''', (telegram_id,))
-
-        except Exception as e:
-            logger.error(f"Error creating default user data: {e}")
-
 # Получение статистики пользователя
     @staticmethod
     @with_connection
@@ -491,66 +1871,113 @@ class UserUtils:
 # Обновление счетчика дней подряд
     @staticmethod
     def _update_streak(conn, telegram_id):
-        try:
-            cursor = conn.execute('''
-                                  SELECT last_study_date
-                                  FROM user_stats
-                                  WHERE user_id = ?
-                                  ''', (telegram_id,))
-
-            result = cursor.fetchone()
-            last_study_date = result['last_study_date'] if result else None
+        UserUtils._update_streaks(conn, [telegram_id])
 
+# Обновление счетчиков дней подряд для группы пользователей: одно чтение и один executemany
+    @staticmethod
+    def _update_streaks(conn, telegram_ids):
+        try:
             today = datetime.now().date()
-
-            if last_study_date:
-                last_date = datetime.strptime(last_study_date, '%Y-%m-%d').date()
-                days_diff = (today - last_date).days
-
-                if days_diff == 1:
-                    conn.execute('''
-                                 UPDATE user_stats
-                                 SET streak_days     = streak_days + 1,
-                                     last_study_date = DATE ('now')
-                                 WHERE user_id = ?
-                                 ''', (telegram_id,))
-                elif days_diff > 1:
-                    conn.execute('''
+            updates = []
+
+            for start in range(0, len(telegram_ids), 500):
+                chunk = telegram_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor = conn.execute(f'''
+                                      SELECT user_id, streak_days, last_study_date
+                                      FROM user_stats
+                                      WHERE user_id IN ({placeholders})
+                                      ''', chunk)
+
+                for row in cursor.fetchall():
+                    if row['last_study_date']:
+                        last_date = datetime.strptime(row['last_study_date'], '%Y-%m-%d').date()
+                        days_diff = (today - last_date).days
+
+                        if days_diff == 1:
+                            updates.append(((row['streak_days'] or 0) + 1, row['user_id']))
+                        elif days_diff > 1:
+                            updates.append((1, row['user_id']))
+                    else:
+                        updates.append((1, row['user_id']))
+
+            if updates:
+                conn.executemany('''
                                  UPDATE user_stats
-                                 SET streak_days     = 1,
+                                 SET streak_days     = ?,
                                      last_study_date = DATE ('now')
                                  WHERE user_id = ?
-                                 ''', (telegram_id,))
-            else:
-                conn.execute('''
-                             UPDATE user_stats
-                             SET streak_days     = 1,
-                                 last_study_date = DATE ('now')
-                             WHERE user_id = ?
-                             ''', (telegram_id,))
+                                 ''', updates)
 
         except Exception as e:
             logger.error(f"Error updating streak: {e}")
 
+# Telegram ID всех пользователей со всех шардов (для рассылки и выгрузки)
+    @staticmethod
+    def get_all_user_ids():
+        try:
+            return [telegram_id for user_ids in db_manager.map_shards(UserUtils._get_user_ids)
+                    for telegram_id in user_ids]
+        except Exception as e:
+            logger.error(f"Error getting user ids: {e}")
+            return []
+
+    @staticmethod
+    def _get_user_ids(conn):
+        return [row['telegram_id'] for row in conn.execute('SELECT telegram_id FROM users')]
+
 
 # УТИЛИТЫ ДЛЯ РАБОТЫ С КАТЕГОРИЯМИ
 class CategoryUtils:
 
-# Получение всех категорий пользователя
+# Получение всех категорий пользователя (через кэш; вызывающий получает свои копии словарей)
     @staticmethod
     @with_connection
     def get_user_categories(conn, telegram_id):
+        try:
+            categories = category_cache.get(telegram_id)
+            if categories is None:
+                epoch = category_cache.epoch()
+                cursor = conn.execute('''
+                                      SELECT id, name, description, color, created_at
+                                      FROM categories
+                                      WHERE user_id = ?
+                                      ORDER BY name
+                                      ''', (telegram_id,))
+
+                categories = [dict(row) for row in cursor.fetchall()]
+                category_cache.set(telegram_id, categories, epoch)
+
+            return [dict(category) for category in categories]
+        except Exception as e:
+            logger.error(f"Error getting user categories: {e}")
+            return []
+
+# Сводка по всем категориям пользователя одним запросом: карточки, изучено, к повторению, средняя сложность
+    @staticmethod
+    @with_connection
+    def get_categories_summary(conn, telegram_id):
         try:
             cursor = conn.execute('''
-                                  SELECT id, name, description, color, created_at
-                                  FROM categories
-                                  WHERE user_id = ?
-                                  ORDER BY name
-                                  ''', (telegram_id,))
+                                  SELECT cat.id,
+                                         cat.name,
+                                         cat.description,
+                                         cat.color,
+                                         cat.created_at,
+                                         COUNT(c.id)                                                    as total,
+                                         COALESCE(SUM(c.status = 'learned'), 0)                         as learned,
+                                         COALESCE(SUM(c.status = 'learning' AND c.next_review <= ?), 0) as due,
+                                         AVG(c.difficulty)                                              as avg_difficulty
+                                  FROM categories cat
+                                           LEFT JOIN cards c ON c.category_id = cat.id
+                                  WHERE cat.user_id = ?
+                                  GROUP BY cat.id
+                                  ORDER BY cat.name
+                                  ''', (to_epoch(datetime.now()), telegram_id))
 
             return [dict(row) for row in cursor.fetchall()]
         except Exception as e:
-            logger.error(f"Error getting user categories: {e}")
+            logger.error(f"Error getting categories summary: {e}")
             return []
 
 # Создание новой категории
@@ -563,6 +1990,7 @@ class CategoryUtils:
                                   VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
                                   ''', (telegram_id, name, description, color))
 
+            category_cache.invalidate(telegram_id)
             category_id = cursor.lastrowid
             return category_id
         except Exception as e:
@@ -593,8 +2021,9 @@ class CategoryUtils:
             update_fields.append("updated_at = CURRENT_TIMESTAMP")
             params.append(category_id)
 
-            query = f"UPDATE categories SET {', '.join(update_fields)} WHERE id = ?"
-            conn.execute(query, params)
+            query = f"UPDATE categories SET {', '.join(update_fields)} WHERE id = ? RETURNING user_id"
+            for row in conn.execute(query, params).fetchall():
+                category_cache.invalidate(row['user_id'])
             return True
         except Exception as e:
             logger.error(f"Error updating category: {e}")
@@ -605,7 +2034,10 @@ class CategoryUtils:
     @with_connection
     def delete_category(conn, category_id):
         try:
-            conn.execute('DELETE FROM categories WHERE id = ?', (category_id,))
+            for row in conn.execute('DELETE FROM categories WHERE id = ? RETURNING user_id', (category_id,)).fetchall():
+                category_cache.invalidate(row['user_id'])
+                due_index.invalidate(row['user_id'])
+                invalidate_forecast(row['user_id'])
             return True
         except Exception as e:
             logger.error(f"Error deleting category: {e}")
@@ -632,12 +2064,26 @@ class CategoryUtils:
 # УТИЛИТЫ ДЛЯ РАБОТЫ С КАРТОЧКАМИ
 class CardUtils:
 
+    # Пороги доли верных ответов для сложности 1-4 (ниже последнего порога - сложность 5)
+    DIFFICULTY_THRESHOLDS = (0.9, 0.7, 0.5, 0.3)
+    # Базовые интервалы в днях в зависимости от сложности и предельный интервал
+    BASE_INTERVALS = {1: 7, 2: 5, 3: 3, 4: 2, 5: 1}
+    MAX_INTERVAL_DAYS = 90
+    # Повтор после неверного ответа
+    RETRY_SECONDS = 600
+    # Карточка считается изученной после LEARNED_MIN_CORRECT верных ответов при доле не ниже LEARNED_MIN_RATE
+    LEARNED_MIN_CORRECT = 5
+    LEARNED_MIN_RATE = 0.8
+    # Границы доли верных ответов для выборок «только сложные» и «только легкие» (сложность 5 и 1-2)
+    HARD_MAX_RATE = 0.3
+    EASY_MIN_RATE = 0.7
+
 # Создание новой карточки
     @staticmethod
     @with_connection
     def create_card(conn, telegram_id, front, back, category_id, status='learning'):
         try:
-            next_review = datetime.now() + timedelta(hours=12)
+            next_review = to_epoch(datetime.now() + timedelta(hours=12))
 
             cursor = conn.execute('''
                                   INSERT INTO cards
@@ -646,27 +2092,79 @@ class CardUtils:
                                   VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
                                   ''', (telegram_id, front, back, category_id, status, next_review))
 
-            card_id = cursor.lastrowid
-
-            CardUtils._update_user_stats_after_card_creation(conn, telegram_id)
-
-            return card_id
+            due_index.invalidate(telegram_id)
+            invalidate_forecast(telegram_id)
+            return cursor.lastrowid
         except Exception as e:
             logger.error(f"Error creating card: {e}")
             return None
 
-# Обновление статистики после создания карточки
+# Массовое создание карточек одной транзакцией (импорт)
+# cards - итерируемый набор словарей с ключами front, back и необязательными category_id или category (название)
+# Возвращает количество добавленных карточек
     @staticmethod
-    def _update_user_stats_after_card_creation(conn, telegram_id):
+    @with_connection
+    def bulk_create_cards(conn, telegram_id, cards, default_category_id=None, status='learning'):
+        # Точка сохранения: при ошибке откатывается весь импорт, а не часть строк
+        conn.execute('SAVEPOINT bulk_create_cards')
         try:
-            conn.execute('''
-                         UPDATE user_stats
-                         SET total_cards = total_cards + 1,
-                             updated_at  = CURRENT_TIMESTAMP
-                         WHERE user_id = ?
-                         ''', (telegram_id,))
+            # Категории пользователя загружаются один раз и дополняются по ходу импорта
+            category_map = {}
+            for row in conn.execute('SELECT id, name FROM categories WHERE user_id = ?', (telegram_id,)):
+                category_map.setdefault(row['name'].lower(), row['id'])
+
+            next_review = to_epoch(datetime.now() + timedelta(hours=12))
+            inserted = [0]
+
+            def resolve_category(card):
+                if card.get('category_id'):
+                    return card['category_id']
+
+                name = (card.get('category') or '').strip()
+                if not name:
+                    return default_category_id
+
+                category_id = category_map.get(name.lower())
+                if category_id is None:
+                    cursor = conn.execute('''
+                                          INSERT INTO categories (user_id, name, updated_at)
+                                          VALUES (?, ?, CURRENT_TIMESTAMP)
+                                          ''', (telegram_id, name))
+                    category_id = cursor.lastrowid
+                    category_map[name.lower()] = category_id
+                    category_cache.invalidate(telegram_id)
+                return category_id
+
+            def rows():
+                for card in cards:
+                    front = (card.get('front') or '').strip()
+                    back = (card.get('back') or '').strip()
+                    # Пропущенная строка не должна создавать категорию
+                    if not front or not back:
+                        continue
+
+                    category_id = resolve_category(card)
+                    if not category_id:
+                        continue
+
+                    inserted[0] += 1
+                    yield telegram_id, front, back, category_id, card.get('status') or status, next_review
+
+            conn.executemany('''
+                             INSERT INTO cards
+                             (user_id, front, back, category_id, status, next_review, created_at, updated_at)
+                             VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                             ''', rows())
+
+            conn.execute('RELEASE SAVEPOINT bulk_create_cards')
+            due_index.invalidate(telegram_id)
+            invalidate_forecast(telegram_id)
+            return inserted[0]
         except Exception as e:
-            logger.error(f"Error updating stats after card creation: {e}")
+            conn.execute('ROLLBACK TO SAVEPOINT bulk_create_cards')
+            conn.execute('RELEASE SAVEPOINT bulk_create_cards')
+            logger.error(f"Error bulk creating cards: {e}")
+            return 0
 
 # Получение карточек пользователя с фильтрами
     @staticmethod
@@ -701,86 +2199,340 @@ class CardUtils:
             logger.error(f"Error getting user cards: {e}")
             return []
 
-# Получение карточки по ID
+# Количество карточек пользователя одним запросом: всего, изучено, изучается, к повторению
     @staticmethod
     @with_connection
-    def get_card_by_id(conn, card_id):
+    def get_card_counts(conn, telegram_id, category_id=None):
         try:
-            cursor = conn.execute('''
-                                  SELECT c.*, cat.name as category_name
-                                  FROM cards c
-                                           LEFT JOIN categories cat ON c.category_id = cat.id
-                                  WHERE c.id = ?
-                                  ''', (card_id,))
+            query = '''
+                    SELECT COUNT(*)                                                              as total,
+                           COALESCE(SUM(status = 'learned'), 0)                                  as learned,
+                           COALESCE(SUM(status = 'learning'), 0)                                 as learning,
+                           COALESCE(SUM(status = 'learning' AND next_review <= ?), 0)            as due
+                    FROM cards
+                    WHERE user_id = ? \
+                    '''
+            params = [to_epoch(datetime.now()), telegram_id]
 
-            result = cursor.fetchone()
-            return dict(result) if result else None
+            if category_id:
+                query += ' AND category_id = ?'
+                params.append(category_id)
+
+            return dict(conn.execute(query, params).fetchone())
         except Exception as e:
-            logger.error(f"Error getting card: {e}")
-            return None
+            logger.error(f"Error getting card counts: {e}")
+            return {'total': 0, 'learned': 0, 'learning': 0, 'due': 0}
 
-# Обновление карточки
+# Постраничное получение карточек по курсору (created_at, id), без OFFSET
+# direction='next' - более старые карточки после курсора, 'prev' - более новые перед ним
+# Возвращает (карточки, курсор следующей страницы, курсор предыдущей страницы)
     @staticmethod
     @with_connection
-    def update_card(conn, card_id, front=None, back=None, category_id=None, status=None):
+    def get_user_cards_page(conn, telegram_id, cursor=None, direction='next', limit=10,
+                            category_id=None, status=None):
         try:
-            update_fields = []
-            params = []
+            query = '''
+                    SELECT c.*, cat.name as category_name
+                    FROM cards c
+                             LEFT JOIN categories cat ON c.category_id = cat.id
+                    WHERE c.user_id = ? \
+                    '''
+            params = [telegram_id]
 
-            if front:
-                update_fields.append("front = ?")
-                params.append(front)
-            if back:
-                update_fields.append("back = ?")
-                params.append(back)
             if category_id:
-                update_fields.append("category_id = ?")
+                query += ' AND c.category_id = ?'
                 params.append(category_id)
+
             if status:
-                update_fields.append("status = ?")
+                query += ' AND c.status = ?'
                 params.append(status)
 
-            if not update_fields:
-                return False
+            position = CardUtils._decode_cursor(cursor) if cursor else None
 
-            update_fields.append("updated_at = CURRENT_TIMESTAMP")
-            params.append(card_id)
+            if position and direction == 'prev':
+                query += ' AND (c.created_at, c.id) > (?, ?) ORDER BY c.created_at ASC, c.id ASC'
+                params.extend(position)
+            elif position:
+                query += ' AND (c.created_at, c.id) < (?, ?) ORDER BY c.created_at DESC, c.id DESC'
+                params.extend(position)
+            else:
+                query += ' ORDER BY c.created_at DESC, c.id DESC'
 
-            query = f"UPDATE cards SET {', '.join(update_fields)} WHERE id = ?"
-            conn.execute(query, params)
-            return True
+            # Берем на одну запись больше, чтобы узнать, есть ли еще страница
+            query += ' LIMIT ?'
+            params.append(limit + 1)
+
+            cards = [dict(row) for row in conn.execute(query, params).fetchall()]
+            has_more = len(cards) > limit
+            cards = cards[:limit]
+
+            if position and direction == 'prev':
+                cards.reverse()
+                has_newer, has_older = has_more, True
+            else:
+                has_newer, has_older = position is not None, has_more
+
+            if not cards:
+                return [], None, None
+
+            next_cursor = CardUtils._encode_cursor(cards[-1]) if has_older else None
+            prev_cursor = CardUtils._encode_cursor(cards[0]) if has_newer else None
+
+            return cards, next_cursor, prev_cursor
         except Exception as e:
-            logger.error(f"Error updating card: {e}")
-            return False
+            logger.error(f"Error getting user cards page: {e}")
+            return [], None, None
 
-# Удаление карточки
+# Кодирование позиции карточки в непрозрачный курсор (помещается в callback_data)
+    @staticmethod
+    def _encode_cursor(card):
+        raw = f"{card['created_at']}|{card['id']}".encode('utf-8')
+        return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+# Декодирование курсора обратно в (created_at, id)
+    @staticmethod
+    def _decode_cursor(cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+            created_at, card_id = raw.rsplit('|', 1)
+            return created_at, int(card_id)
+        except (ValueError, UnicodeDecodeError):
+            logger.warning(f"Invalid cards cursor: {cursor}")
+            return None
+
+# Получение карточки по ID
     @staticmethod
     @with_connection
-    def delete_card(conn, card_id):
+    def get_card_by_id(conn, card_id):
         try:
-            cursor = conn.execute('SELECT user_id FROM cards WHERE id = ?', (card_id,))
+            cursor = conn.execute('''
+                                  SELECT c.*, cat.name as category_name
+                                  FROM cards c
+                                           LEFT JOIN categories cat ON c.category_id = cat.id
+                                  WHERE c.id = ?
+                                  ''', (card_id,))
+
             result = cursor.fetchone()
+            return dict(result) if result else None
+        except Exception as e:
+            logger.error(f"Error getting card: {e}")
+            return None
+
+# Загрузка набора карточек одним запросом (колода сессии тестирования): {id: карточка}
+    @staticmethod
+    @with_connection
+    def get_cards_by_ids(conn, card_ids):
+        try:
+            cards = {}
+            card_ids = list(card_ids)
+
+            for start in range(0, len(card_ids), 500):
+                chunk = card_ids[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                cursor = conn.execute(f'''
+                                      SELECT c.id,
+                                             c.front,
+                                             c.back,
+                                             c.difficulty,
+                                             c.status,
+                                             c.next_review,
+                                             c.review_count,
+                                             c.correct_answers,
+                                             c.wrong_answers,
+                                             cat.name as category_name
+                                      FROM cards c
+                                               LEFT JOIN categories cat ON c.category_id = cat.id
+                                      WHERE c.id IN ({placeholders})
+                                      ''', chunk)
+
+                for row in cursor.fetchall():
+                    cards[row['id']] = dict(row)
+
+            return cards
+        except Exception as e:
+            logger.error(f"Error getting cards by ids: {e}")
+            return {}
+
+# Карточки, ранжированные по доле верных ответов: hardest=True — самые сложные первыми, иначе самые легкие.
+# Карточки без ответов не участвуют; сортировка и LIMIT выполняются по индексу миграции 9
+    @staticmethod
+    @with_connection
+    def get_ranked_cards(conn, telegram_id, limit=20, hardest=True, category_id=None,
+                         min_rate=None, max_rate=None, due_only=False):
+        try:
+            rate = SUCCESS_RATE_SQL
+            conditions, params = CardUtils._ranked_conditions(telegram_id, category_id, min_rate, max_rate, due_only)
+
+            order = 'ASC' if hardest else 'DESC'
+            cursor = conn.execute(f'''
+                                  SELECT *, {rate} as success_rate
+                                  FROM cards
+                                  WHERE {conditions}
+                                  ORDER BY {rate} {order}, id {order}
+                                  LIMIT ?
+                                  ''', params + [limit])
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"Error getting ranked cards: {e}")
+            return []
+
+# Число карточек, которые выберет get_ranked_cards для «только легких» (доля >= EASY_MIN_RATE)
+# и «только сложных» (доля < HARD_MAX_RATE), и всех карточек с ответами - одним запросом с теми же условиями
+    @staticmethod
+    @with_connection
+    def get_ranked_counts(conn, telegram_id, category_id=None, due_only=False):
+        try:
+            rate = SUCCESS_RATE_SQL
+            conditions, params = CardUtils._ranked_conditions(telegram_id, category_id, None, None, due_only)
+
+            cursor = conn.execute(f'''
+                                  SELECT COUNT(*)                        as rated,
+                                         COALESCE(SUM({rate} >= ?), 0)   as easy,
+                                         COALESCE(SUM({rate} < ?), 0)    as hard
+                                  FROM cards
+                                  WHERE {conditions}
+                                  ''', [CardUtils.EASY_MIN_RATE, CardUtils.HARD_MAX_RATE] + params)
+            return dict(cursor.fetchone())
+        except Exception as e:
+            logger.error(f"Error getting ranked counts: {e}")
+            return {'rated': 0, 'easy': 0, 'hard': 0}
+
+# Условия выборки карточек по доле верных ответов (общие для get_ranked_cards и get_ranked_counts)
+    @staticmethod
+    def _ranked_conditions(telegram_id, category_id, min_rate, max_rate, due_only):
+        rate = SUCCESS_RATE_SQL
+        conditions = f'user_id = ? AND {rate} IS NOT NULL'
+        params = [telegram_id]
+
+        if category_id:
+            conditions += ' AND category_id = ?'
+            params.append(category_id)
+
+        if min_rate is not None:
+            conditions += f' AND {rate} >= ?'
+            params.append(min_rate)
+
+        if max_rate is not None:
+            conditions += f' AND {rate} < ?'
+            params.append(max_rate)
+
+        if due_only:
+            conditions += " AND status = 'learning' AND next_review <= ?"
+            params.append(to_epoch(datetime.now()))
+
+        return conditions, params
+
+# Случайная выборка k карточек без загрузки всей колоды в Python: число подходящих карточек пользователя
+# считается по индексу, выбираются k случайных позиций, и карточки на них читаются по (user_id, id)
+# по возрастанию позиций: каждый запрос продолжает от id предыдущей найденной (LIMIT 1 OFFSET разница позиций).
+# Стоимость остается O(колода пользователя): OFFSET в SQLite перебирает пропускаемые записи индекса, поэтому
+# COUNT и k запросов вместе проходят записи индекса пользователя до последней выбранной позиции (в худшем
+# случае все). От ORDER BY random() выигрыш только в постоянном множителе - нет сортировки и чтения строк
+# таблицы. Выборка по случайному id из диапазона была бы O(k log n), но неравномерной из-за пропусков в id
+# (удаленные карточки, id других пользователей), а плотная нумерация карточек пользователя потребовала бы
+# перенумерации при каждом удалении. Выборка равномерная и не зависит от того, как id пользователя
+# перемешаны с чужими
+    @staticmethod
+    @with_connection
+    def sample_cards(conn, telegram_id, k=10, category_id=None, status=None):
+        try:
+            if k <= 0:
+                return []
+
+            conditions = 'user_id = ?'
+            params = [telegram_id]
+
+            if category_id:
+                conditions += ' AND category_id = ?'
+                params.append(category_id)
+
+            if status:
+                conditions += ' AND status = ?'
+                params.append(status)
+
+            count = conn.execute(f'SELECT COUNT(*) FROM cards WHERE {conditions}', params).fetchone()[0]
+
+            sampled = []
+            last_id, last_position = 0, -1
+            for position in sorted(random.sample(range(count), min(k, count))):
+                row = conn.execute(f'''
+                                   SELECT id FROM cards
+                                   WHERE {conditions} AND id > ?
+                                   ORDER BY id
+                                   LIMIT 1 OFFSET ?
+                                   ''', params + [last_id, position - last_position - 1]).fetchone()
+                # Карточки могли удалить после подсчета
+                if row is None:
+                    break
+                sampled.append(row[0])
+                last_id, last_position = row[0], position
+
+            random.shuffle(sampled)
+            return sampled
+        except Exception as e:
+            logger.error(f"Error sampling cards: {e}")
+            return []
+
+# Обновление карточки
+    @staticmethod
+    @with_connection
+    def update_card(conn, card_id, front=None, back=None, category_id=None, status=None):
+        try:
+            update_fields = []
+            params = []
+
+            if front:
+                update_fields.append("front = ?")
+                params.append(front)
+            if back:
+                update_fields.append("back = ?")
+                params.append(back)
+            if category_id:
+                update_fields.append("category_id = ?")
+                params.append(category_id)
+            if status:
+                update_fields.append("status = ?")
+                params.append(status)
 
-            if result:
-                user_id = result['user_id']
-                conn.execute('DELETE FROM cards WHERE id = ?', (card_id,))
+            if not update_fields:
+                return False
 
-                conn.execute('''
-                             UPDATE user_stats
-                             SET total_cards = total_cards - 1,
-                                 updated_at  = CURRENT_TIMESTAMP
-                             WHERE user_id = ?
-                             ''', (user_id,))
+            update_fields.append("updated_at = CURRENT_TIMESTAMP")
+            params.append(card_id)
+
+            query = f"UPDATE cards SET {', '.join(update_fields)} WHERE id = ? RETURNING user_id"
+            for row in conn.execute(query, params).fetchall():
+                due_index.invalidate(row['user_id'])
+                invalidate_forecast(row['user_id'])
+            return True
+        except Exception as e:
+            logger.error(f"Error updating card: {e}")
+            return False
 
+# Удаление карточки
+    @staticmethod
+    @with_connection
+    def delete_card(conn, card_id):
+        try:
+            for row in conn.execute('DELETE FROM cards WHERE id = ? RETURNING user_id', (card_id,)).fetchall():
+                due_index.remove(row['user_id'], card_id)
+                invalidate_forecast(row['user_id'])
             return True
         except Exception as e:
             logger.error(f"Error deleting card: {e}")
             return False
 
-# Поиск карточек по запросу
+# Поиск карточек по запросу (FTS5, результаты отсортированы по релевантности)
     @staticmethod
     @with_connection
-    def search_cards(conn, telegram_id, search_query, category_id=None):
+    def search_cards(conn, telegram_id, search_query, category_id=None, limit=None, offset=0):
+        # Триграммный индекс не умеет искать строки короче 3 символов
+        if len(search_query) >= 3:
+            try:
+                return CardUtils._search_cards_fts(conn, telegram_id, search_query, category_id, limit, offset)
+            except sqlite3.OperationalError as e:
+                logger.warning(f"FTS search failed, falling back to LIKE: {e}")
+
         try:
             query = '''
                     SELECT c.id, c.front, c.back, c.status, cat.name as category_name
@@ -797,32 +2549,69 @@ class CardUtils:
 
             query += ' ORDER BY c.front'
 
+            if limit:
+                query += ' LIMIT ? OFFSET ?'
+                params.extend([limit, offset])
+
             cursor = conn.execute(query, params)
             return [dict(row) for row in cursor.fetchall()]
         except Exception as e:
             logger.error(f"Error searching cards: {e}")
             return []
 
+# Поиск по полнотекстовому индексу cards_fts
+    @staticmethod
+    def _search_cards_fts(conn, telegram_id, search_query, category_id=None, limit=None, offset=0):
+        # Запрос берется в кавычки, чтобы искать его как подстроку, а не как выражение FTS
+        match = '"' + search_query.replace('"', '""') + '"'
+
+        query = '''
+                SELECT c.id, c.front, c.back, c.status, cat.name as category_name
+                FROM cards_fts
+                         JOIN cards c ON c.id = cards_fts.rowid
+                         LEFT JOIN categories cat ON c.category_id = cat.id
+                WHERE cards_fts MATCH ?
+                  AND c.user_id = ? \
+                '''
+        params = [match, telegram_id]
+
+        if category_id:
+            query += ' AND c.category_id = ?'
+            params.append(category_id)
+
+        query += ' ORDER BY bm25(cards_fts), c.front'
+
+        if limit:
+            query += ' LIMIT ? OFFSET ?'
+            params.extend([limit, offset])
+
+        cursor = conn.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+
 # Получение карточек для повторения (система интервальных повторений)
     @staticmethod
     @with_connection
     def get_cards_for_review(conn, telegram_id, limit=20):
         try:
+            if due_index.enabled:
+                return due_index.get_due(conn, telegram_id, to_epoch(datetime.now()), limit)
+
             cursor = conn.execute('''
                                   SELECT c.*, cat.name as category_name
                                   FROM cards c
                                            LEFT JOIN categories cat ON c.category_id = cat.id
                                   WHERE c.user_id = ?
-                                    AND (c.next_review IS NULL OR c.next_review <= CURRENT_TIMESTAMP)
                                     AND c.status = 'learning'
+                                    AND c.next_review <= ?
                                   ORDER BY CASE
                                                WHEN c.difficulty >= 4 THEN 1
                                                WHEN c.difficulty >= 2 THEN 2
                                                ELSE 3
                                                END,
                                            c.review_count ASC,
-                                           c.correct_answers / CAST(c.review_count AS REAL) ASC LIMIT ?
-                                  ''', (telegram_id, limit))
+                                           c.correct_answers / CAST(c.review_count AS REAL) ASC,
+                                           c.id LIMIT ?
+                                  ''', (telegram_id, to_epoch(datetime.now()), limit))
 
             return [dict(row) for row in cursor.fetchall()]
         except Exception as e:
@@ -835,7 +2624,8 @@ class CardUtils:
     def update_card_after_review(conn, card_id, is_correct):
         try:
             cursor = conn.execute('''
-                                  SELECT review_count,
+                                  SELECT user_id,
+                                         review_count,
                                          correct_answers,
                                          wrong_answers,
                                          difficulty,
@@ -848,39 +2638,8 @@ class CardUtils:
             if not card:
                 return False
 
-            review_count = card['review_count'] + 1
-
-            if is_correct:
-                correct_answers = card['correct_answers'] + 1
-                wrong_answers = card['wrong_answers']
-            else:
-                correct_answers = card['correct_answers']
-                wrong_answers = card['wrong_answers'] + 1
-
-            total_answers = correct_answers + wrong_answers
-            success_rate = correct_answers / total_answers if total_answers > 0 else 0
-
-            # Преобразуем успешность в сложность 1-5
-            if success_rate >= 0.9:
-                difficulty = 1
-            elif success_rate >= 0.7:
-                difficulty = 2
-            elif success_rate >= 0.5:
-                difficulty = 3
-            elif success_rate >= 0.3:
-                difficulty = 4
-            else:
-                difficulty = 5
-
-            status = card['status']
-            if correct_answers >= 5 and success_rate >= 0.8:
-                status = 'learned'
-            elif status == 'learned' and not is_correct:
-                status = 'learning'
-
-            next_review = CardUtils._calculate_next_review(
-                difficulty, review_count, is_correct
-            )
+            now = datetime.now()
+            state = CardUtils._apply_review(card, is_correct, now)
 
             conn.execute('''
                          UPDATE cards
@@ -889,37 +2648,691 @@ class CardUtils:
                              wrong_answers   = ?,
                              difficulty      = ?,
                              status          = ?,
-                             last_reviewed   = CURRENT_TIMESTAMP,
+                             last_reviewed   = datetime(?, 'unixepoch'),
                              next_review     = ?,
                              updated_at      = CURRENT_TIMESTAMP
                          WHERE id = ?
-                         ''', (review_count, correct_answers, wrong_answers,
-                               difficulty, status, next_review, card_id))
+                         ''', (state['review_count'], state['correct_answers'], state['wrong_answers'],
+                               state['difficulty'], state['status'], to_epoch(now), state['next_review'], card_id))
 
+            due_index.update_card(card['user_id'], dict(state, id=card_id))
+            invalidate_forecast(card['user_id'])
             return True
         except Exception as e:
             logger.error(f"Error updating card after review: {e}")
             return False
 
-# Расчет следующей даты повторения по алгоритму SM-2
+# Расчет нового состояния карточки после ответа (без записи в БД)
     @staticmethod
-    def _calculate_next_review(difficulty, review_count, is_correct):
-        now = datetime.now()
+    def _apply_review(card, is_correct, now=None):
+        review_count = card['review_count'] + 1
+
+        if is_correct:
+            correct_answers = card['correct_answers'] + 1
+            wrong_answers = card['wrong_answers']
+        else:
+            correct_answers = card['correct_answers']
+            wrong_answers = card['wrong_answers'] + 1
+
+        total_answers = correct_answers + wrong_answers
+        success_rate = correct_answers / total_answers if total_answers > 0 else 0
+
+        difficulty = CardUtils._difficulty_for_rate(success_rate)
+
+        status = card['status']
+        if correct_answers >= CardUtils.LEARNED_MIN_CORRECT and success_rate >= CardUtils.LEARNED_MIN_RATE:
+            status = 'learned'
+        elif status == 'learned' and not is_correct:
+            status = 'learning'
+
+        next_review = CardUtils._calculate_next_review(
+            difficulty, review_count, is_correct, now
+        )
+
+        return {
+            'review_count': review_count,
+            'correct_answers': correct_answers,
+            'wrong_answers': wrong_answers,
+            'difficulty': difficulty,
+            'status': status,
+            'next_review': next_review
+        }
+
+# Преобразование доли верных ответов в сложность 1-5
+    @staticmethod
+    def _difficulty_for_rate(success_rate):
+        for difficulty, threshold in enumerate(CardUtils.DIFFICULTY_THRESHOLDS, 1):
+            if success_rate >= threshold:
+                return difficulty
+        return len(CardUtils.DIFFICULTY_THRESHOLDS) + 1
+
+# Запись результата повторения: через буфер отложенной записи или сразу
+# Переданная копия карточки (например, из колоды сессии) пересчитывается так же, как строка в БД
+    @staticmethod
+    def record_review(telegram_id, card_id, is_correct, card=None):
+        if card is not None:
+            card.update(CardUtils._apply_review(card, is_correct))
+
+        if review_buffer.enabled:
+            due_index.apply_review(telegram_id, card_id, is_correct)
+            return review_buffer.add(telegram_id, card_id, is_correct)
+        return db_manager.submit_write(
+            telegram_id, CardUtils.update_card_after_review, card_id, is_correct
+        ).result()
+
+# Расчет следующей даты повторения по алгоритму SM-2 (unix-время)
+# Отсчет идет от целой секунды ответа - той же, что пишется в last_reviewed, - поэтому пакетный
+# пересчет (SchedulerUtils) по неизменным правилам получает то же значение
+    @staticmethod
+    def _calculate_next_review(difficulty, review_count, is_correct, now=None):
+        reviewed_at = to_epoch(now or datetime.now())
 
         if not is_correct:
-            return now + timedelta(minutes=10)
+            return reviewed_at + CardUtils.RETRY_SECONDS
+
+        return reviewed_at + CardUtils._interval_seconds(difficulty, review_count)
+
+# Интервал после верного ответа в секундах: базовый интервал сложности, растущий в 1.5 раза с каждым повторением
+    @staticmethod
+    def _interval_seconds(difficulty, review_count):
+        days = CardUtils.BASE_INTERVALS.get(difficulty, 1) * 1.5 ** (review_count - 1)
+        return int(min(days, CardUtils.MAX_INTERVAL_DAYS) * 86400)
+
+
+# ПАКЕТНЫЙ ПЕРЕСЧЕТ РАСПИСАНИЯ
+# Пересчитывает сложность, статус и next_review всех повторявшихся карточек по текущим правилам CardUtils
+# (после изменения порогов или таблицы интервалов). Карточки читаются порциями по id, порция считается
+# одним векторным проходом NumPy (без NumPy - тем же расчетом в цикле) и записывается executemany через
+# очередь записи шарда. Интервал считается той же функцией, что и после ответа (CardUtils._interval_seconds),
+# от last_reviewed, и может как приблизить, так и отодвинуть повторение. Карточки, на которые последний раз
+# ответили неверно (next_review = last_reviewed + RETRY_SECONDS), сохраняют повтор через RETRY_SECONDS.
+# Статус следует правилам _apply_review: learned при выполнении порогов, а изученная карточка теряет
+# статус, только если последний ответ был неверным. При неизменных правилах пересчет ничего не меняет
+class SchedulerUtils:
+
+# Пересчет по всем шардам (или по шарду пользователя); возвращает счетчики и достигнутую скорость
+    @staticmethod
+    def reschedule_cards(telegram_id=None, batch_size=50000):
+        started = time.perf_counter()
+        result = {'cards': 0, 'updated': 0, 'backend': 'numpy' if np is not None else 'python'}
+        shards = [db_manager.shard_for(telegram_id)] if telegram_id else db_manager.shards
+        user_filter = 'AND user_id = ?' if telegram_id else ''
+
+        try:
+            for shard in shards:
+                last_id = 0
+                while True:
+                    with shard.get_connection() as conn:
+                        params = [last_id] + ([telegram_id] if telegram_id else []) + [batch_size]
+                        rows = conn.execute(f'''
+                                            SELECT id,
+                                                   difficulty,
+                                                   review_count,
+                                                   COALESCE(correct_answers, 0)                   as correct_answers,
+                                                   COALESCE(wrong_answers, 0)                     as wrong_answers,
+                                                   status = 'learned'                              as learned,
+                                                   CAST(strftime('%s', last_reviewed) AS INTEGER) as last_reviewed,
+                                                   next_review
+                                            FROM cards
+                                            WHERE id > ?
+                                              AND review_count > 0 {user_filter}
+                                            ORDER BY id LIMIT ?
+                                            ''', params).fetchall()
+
+                    if not rows:
+                        break
+
+                    columns = [list(column) for column in zip(*rows)]
+                    compute = SchedulerUtils._compute_numpy if np is not None else SchedulerUtils._compute_python
+                    updates = compute(*columns)
+
+                    if updates:
+                        shard.writer.submit(SchedulerUtils._write, updates).result()
+
+                    result['cards'] += len(rows)
+                    result['updated'] += len(updates)
+                    last_id = rows[-1]['id']
+
+                    if len(rows) < batch_size:
+                        break
+
+            if result['updated']:
+                due_index.clear()
+                forecast_cache.invalidate_all()
+        except Exception as e:
+            logger.error(f"Error rescheduling cards: {e}")
+
+        result['seconds'] = time.perf_counter() - started
+        result['cards_per_sec'] = result['cards'] / result['seconds'] if result['seconds'] else 0.0
+        logger.info(f"Rescheduled {result['updated']} of {result['cards']} cards in {result['seconds']:.2f} s "
+                    f"({result['cards_per_sec']:.0f} cards/s, {result['backend']})")
+        return result
+
+# Векторный расчет порции; возвращает только изменившиеся строки для UPDATE
+    @staticmethod
+    def _compute_numpy(ids, difficulty, review_count, correct, wrong, learned, last_reviewed, next_review):
+        ids = np.asarray(ids, dtype=np.int64)
+        old_difficulty = np.asarray(difficulty, dtype=np.float64)
+        review_count = np.asarray(review_count, dtype=np.int64)
+        correct = np.asarray(correct, dtype=np.int64)
+        wrong = np.asarray(wrong, dtype=np.int64)
+        total = correct + wrong
+        learned = np.asarray(learned, dtype=bool)
+        has_last = np.array([value is not None for value in last_reviewed])
+        last_reviewed = np.array([value or 0 for value in last_reviewed], dtype=np.int64)
+        old_next = np.array([value or 0 for value in next_review], dtype=np.int64)
+
+        rate = np.divide(correct, total, out=np.zeros(len(ids)), where=total > 0)
+
+        thresholds = CardUtils.DIFFICULTY_THRESHOLDS
+        new_difficulty = np.select([rate >= threshold for threshold in thresholds],
+                                   list(range(1, len(thresholds) + 1)), len(thresholds) + 1)
+
+        last_wrong = has_last & (wrong > 0) & (old_next == last_reviewed + CardUtils.RETRY_SECONDS)
+        new_learned = ((learned & ~last_wrong)
+                       | ((correct >= CardUtils.LEARNED_MIN_CORRECT) & (rate >= CardUtils.LEARNED_MIN_RATE)))
+
+        # Интервал считается один раз на каждую пару (сложность, число повторений) в порции
+        pairs, inverse = np.unique(np.stack([new_difficulty, review_count]), axis=1, return_inverse=True)
+        seconds = np.array([CardUtils._interval_seconds(int(level), int(count)) for level, count in pairs.T],
+                           dtype=np.int64)
+        recomputed = last_reviewed + seconds[inverse.reshape(-1)]
+        new_next = np.where(has_last & ~last_wrong, recomputed, old_next)
+
+        changed = (new_difficulty != old_difficulty) | (new_learned != learned) | (new_next != old_next)
+        statuses = np.where(new_learned, 'learned', 'learning')
+
+        return list(zip(new_difficulty[changed].tolist(), statuses[changed].tolist(),
+                        new_next[changed].tolist(), ids[changed].tolist(), review_count[changed].tolist()))
+
+# Тот же расчет без NumPy
+    @staticmethod
+    def _compute_python(ids, difficulty, review_count, correct, wrong, learned, last_reviewed, next_review):
+        updates = []
+
+        for i, card_id in enumerate(ids):
+            total = correct[i] + wrong[i]
+            rate = correct[i] / total if total > 0 else 0.0
+
+            old_next = next_review[i] or 0
+            last_wrong = SchedulerUtils._last_answer_wrong(wrong[i], last_reviewed[i], old_next)
+
+            new_difficulty = CardUtils._difficulty_for_rate(rate)
+            new_learned = (bool(learned[i]) and not last_wrong) or (correct[i] >= CardUtils.LEARNED_MIN_CORRECT
+                                                                    and rate >= CardUtils.LEARNED_MIN_RATE)
+
+            new_next = old_next
+            if last_reviewed[i] is not None and not last_wrong:
+                new_next = last_reviewed[i] + CardUtils._interval_seconds(new_difficulty, review_count[i])
+
+            if new_difficulty != difficulty[i] or new_learned != bool(learned[i]) or new_next != old_next:
+                updates.append((new_difficulty, 'learned' if new_learned else 'learning', new_next,
+                                card_id, review_count[i]))
+
+        return updates
+
+# Последний ответ был неверным: после него next_review назначается ровно через RETRY_SECONDS от last_reviewed
+# (интервал после верного ответа не короче суток)
+    @staticmethod
+    def _last_answer_wrong(wrong, last_reviewed, next_review):
+        return last_reviewed is not None and wrong > 0 and next_review == last_reviewed + CardUtils.RETRY_SECONDS
+
+# Запись порции; карточка, на которую успели ответить после чтения, не перезаписывается
+    @staticmethod
+    def _write(conn, updates):
+        conn.executemany('''
+                         UPDATE cards
+                         SET difficulty  = ?,
+                             status      = ?,
+                             next_review = ?,
+                             updated_at  = CURRENT_TIMESTAMP
+                         WHERE id = ?
+                           AND review_count = ?
+                         ''', updates)
+
+
+# БУФЕР ОТЛОЖЕННОЙ ЗАПИСИ РЕЗУЛЬТАТОВ ПОВТОРЕНИЯ
+# Ответы копятся в памяти и записываются одним executemany каждые max_items ответов
+# или каждые max_delay_ms миллисекунд; повторные ответы по одной карточке применяются по порядку
+class ReviewBuffer:
+
+    def __init__(self, max_items=50, max_delay_ms=2000, enabled=True):
+        self.max_items = max_items
+        self.max_delay = max_delay_ms / 1000
+        self.enabled = enabled
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+# Добавление ответа в буфер
+    def add(self, telegram_id, card_id, is_correct):
+        with self._lock:
+            self._pending.append((telegram_id, card_id, bool(is_correct), time.time()))
+            size = len(self._pending)
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='review-buffer', daemon=True)
+                self._thread.start()
+
+        if size >= self.max_items:
+            self.flush()
+        return True
+
+# Фоновая запись по таймеру
+    def _run(self):
+        while not self._stop.wait(self.max_delay):
+            self.flush()
+
+# Количество ответов, ожидающих записи
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+# Есть ли в буфере ответы пользователя
+    def has_pending(self, telegram_id):
+        with self._lock:
+            return any(entry[0] == telegram_id for entry in self._pending)
+
+# Запись накопленных ответов в БД (ответы группируются по шардам пользователей)
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+
+            if not pending:
+                return 0
+
+            groups = {}
+            for entry in pending:
+                groups.setdefault(db_manager.shard_index(entry[0]), []).append(entry)
+
+            written = 0
+            for index, entries in groups.items():
+                try:
+                    db_manager.shards[index].writer.submit(self._write, entries).result()
+                    written += len(entries)
+                except Exception as e:
+                    logger.error(f"Error flushing review buffer: {e}")
+                    # Возвращаем ответы в начало очереди, чтобы не потерять их
+                    with self._lock:
+                        self._pending[:0] = entries
+
+            return written
+
+# Применение ответов одного шарда: состояние карточек читается одним запросом и пишется одним executemany
+    @staticmethod
+    def _write(conn, entries):
+        card_ids = list({card_id for _, card_id, _, _ in entries})
+        states = {}
+
+        for start in range(0, len(card_ids), 500):
+            chunk = card_ids[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            cursor = conn.execute(f'''
+                                  SELECT id,
+                                         user_id,
+                                         review_count,
+                                         correct_answers,
+                                         wrong_answers,
+                                         difficulty,
+                                         status
+                                  FROM cards
+                                  WHERE id IN ({placeholders})
+                                  ''', chunk)
+            for row in cursor.fetchall():
+                states[row['id']] = dict(row)
+
+        reviewed_at = {}
+        for _, card_id, is_correct, timestamp in entries:
+            card = states.get(card_id)
+            if card is None:
+                continue
+
+            card.update(CardUtils._apply_review(
+                card, is_correct, datetime.fromtimestamp(timestamp)
+            ))
+            reviewed_at[card_id] = int(timestamp)
+
+        conn.executemany('''
+                         UPDATE cards
+                         SET review_count    = ?,
+                             correct_answers = ?,
+                             wrong_answers   = ?,
+                             difficulty      = ?,
+                             status          = ?,
+                             last_reviewed   = datetime(?, 'unixepoch'),
+                             next_review     = ?,
+                             updated_at      = CURRENT_TIMESTAMP
+                         WHERE id = ?
+                         ''', ((card['review_count'], card['correct_answers'], card['wrong_answers'],
+                                card['difficulty'], card['status'], reviewed_at[card_id],
+                                card['next_review'], card_id)
+                               for card_id, card in states.items() if card_id in reviewed_at))
+
+        for card_id in reviewed_at:
+            due_index.update_card(states[card_id]['user_id'], states[card_id])
+        for telegram_id in {states[card_id]['user_id'] for card_id in reviewed_at}:
+            invalidate_forecast(telegram_id)
+
+# Остановка фоновой записи и финальный сброс буфера
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.flush()
+
+
+review_buffer = ReviewBuffer(REVIEW_BUFFER_SIZE, REVIEW_BUFFER_DELAY_MS, REVIEW_BUFFER_ENABLED)
+
+
+# Трекер активности: время последнего обращения копится в памяти и пишется в БД пачками
+class ActivityTracker:
+
+    def __init__(self, flush_interval_ms=5000, max_streak_cache=100000):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_streak_cache = max_streak_cache
+        self._seen = {}
+        self._streak_days = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+# Отметка активности пользователя (без обращения к БД)
+    def touch(self, telegram_id):
+        with self._lock:
+            self._seen[telegram_id] = time.time()
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='activity-tracker', daemon=True)
+                self._thread.start()
+
+# Фоновая запись по таймеру
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+# Количество пользователей, ожидающих записи
+    def pending(self):
+        with self._lock:
+            return len(self._seen)
+
+# Запись накопленной активности; серия дней пересчитывается не чаще раза в день на пользователя
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                seen, self._seen = self._seen, {}
+
+            if not seen:
+                return 0
+
+            today = datetime.now().date()
+            if len(self._streak_days) > self.max_streak_cache:
+                self._streak_days = {telegram_id: day for telegram_id, day in self._streak_days.items()
+                                     if day == today}
+
+            groups = {}
+            for telegram_id, timestamp in seen.items():
+                groups.setdefault(db_manager.shard_index(telegram_id), []).append((telegram_id, timestamp))
+
+            written = 0
+            for index, users in groups.items():
+                streak_ids = [telegram_id for telegram_id, _ in users
+                              if self._streak_days.get(telegram_id) != today]
+                try:
+                    db_manager.shards[index].writer.submit(self._write, users, streak_ids).result()
+                    for telegram_id in streak_ids:
+                        self._streak_days[telegram_id] = today
+                    written += len(users)
+                except Exception as e:
+                    logger.error(f"Error flushing user activity: {e}")
+                    # Возвращаем отметки обратно, не затирая более свежие
+                    with self._lock:
+                        for telegram_id, timestamp in users:
+                            if self._seen.get(telegram_id, 0) < timestamp:
+                                self._seen[telegram_id] = timestamp
+
+            return written
+
+    @staticmethod
+    def _write(conn, users, streak_ids):
+        conn.executemany('''
+                         UPDATE users
+                         SET last_active = datetime(?, 'unixepoch')
+                         WHERE telegram_id = ?
+                         ''', ((int(timestamp), telegram_id) for telegram_id, timestamp in users))
+
+        if streak_ids:
+            UserUtils._update_streaks(conn, streak_ids)
+
+# Остановка фоновой записи и финальный сброс
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.flush()
+
+
+activity_tracker = ActivityTracker(ACTIVITY_FLUSH_MS)
+
+
+# ХРАНИЛИЩА СЕССИЙ ТЕСТИРОВАНИЯ
+# Сессия - словарь, который quiz.py получает через get и сохраняет через save после каждого изменения
+# Сессии без обращений дольше ttl секунд удаляются фоновой очисткой
+class SessionStore:
+
+    def __init__(self, ttl=3600, sweep_interval=60):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.evictions = 0
+        self.expired = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def _start_sweeper(self):
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='session-sweeper', daemon=True)
+                self._thread.start()
+
+# Фоновая очистка по таймеру
+    def _run(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping quiz sessions: {e}")
+
+# Метрики для админ-панели
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'live': self.count(),
+            'evictions': self.evictions,
+            'expired': self.expired,
+        }
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# Сессии в памяти процесса: LRU с ограничением размера
+class MemorySessionStore(SessionStore):
+    backend = 'memory'
+
+    def __init__(self, max_size=1000, ttl=3600, sweep_interval=60):
+        super().__init__(ttl, sweep_interval)
+        self.max_size = max_size
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+
+            if entry[0] < time.monotonic() - self.ttl:
+                del self._sessions[session_id]
+                self.expired += 1
+                return None
+
+            self._sessions[session_id] = (time.monotonic(), entry[1])
+            self._sessions.move_to_end(session_id)
+            return entry[1]
+
+    def save(self, session_id, session):
+        with self._lock:
+            self._sessions[session_id] = (time.monotonic(), session)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+        self._start_sweeper()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def count(self):
+        return len(self._sessions)
+
+# Сессии упорядочены по последнему обращению, устаревшие всегда в начале
+    def sweep(self):
+        deadline = time.monotonic() - self.ttl
+        removed = 0
+        with self._lock:
+            while self._sessions:
+                session_id, (last_access, _) = next(iter(self._sessions.items()))
+                if last_access >= deadline:
+                    break
+                del self._sessions[session_id]
+                removed += 1
+            self.expired += removed
+        return removed
+
+
+# Сессии в таблице quiz_sessions первого шарда: переживают перезапуск и общие для процессов бота
+class SQLiteSessionStore(SessionStore):
+    backend = 'sqlite'
+
+    def __init__(self, max_size=1000, ttl=3600, sweep_interval=60):
+        super().__init__(ttl, sweep_interval)
+        self.max_size = max_size
+
+    @property
+    def shard(self):
+        return db_manager.shards[0]
+
+    def get(self, session_id):
+        with self.shard.get_connection() as conn:
+            row = conn.execute('SELECT data, updated_at FROM quiz_sessions WHERE session_id = ?',
+                               (session_id,)).fetchone()
+
+        if row is None:
+            return None
 
-        # Базовые интервалы в днях в зависимости от сложности
-        base_intervals = {1: 7,  2: 5,  3: 3,  4: 2,   5: 1  }
+        if row['updated_at'] < time.time() - self.ttl:
+            self.delete(session_id)
+            self.expired += 1
+            return None
 
-        base_interval = base_intervals.get(difficulty, 1)
+        try:
+            return self._loads(row['data'])
+        except ValueError as e:
+            logger.error(f"Error decoding quiz session {session_id}: {e}")
+            self.delete(session_id)
+            return None
 
-        multiplier = 1.5 ** (review_count - 1)
-        days = base_interval * multiplier
+    def save(self, session_id, session):
+        data = self._dumps(session)
+        self.shard.writer.submit(self._write, session_id, session.get('user_id'), data, int(time.time())).result()
+        self._start_sweeper()
 
-        days = min(days, 90)
+# Сессия хранится в JSON: cards (словарь с int-ключами) - списком пар, datetime - в ISO-формате
+    @staticmethod
+    def _dumps(session):
+        data = dict(session)
+        if 'cards' in data:
+            data['cards'] = list(data['cards'].items())
+        return json.dumps(data, ensure_ascii=False, default=SQLiteSessionStore._encode_value)
 
-        return now + timedelta(days=days)
+    @staticmethod
+    def _loads(data):
+        session = json.loads(data, object_hook=SQLiteSessionStore._decode_value)
+        if 'cards' in session:
+            session['cards'] = dict(session['cards'])
+        return session
+
+    @staticmethod
+    def _encode_value(value):
+        if isinstance(value, datetime):
+            return {'__datetime__': value.isoformat()}
+        raise TypeError(f"Unsupported quiz session value: {type(value).__name__}")
+
+    @staticmethod
+    def _decode_value(value):
+        if '__datetime__' in value:
+            return datetime.fromisoformat(value['__datetime__'])
+        return value
+
+    @staticmethod
+    def _write(conn, session_id, user_id, data, updated_at):
+        conn.execute('''
+                     INSERT INTO quiz_sessions (session_id, user_id, data, updated_at)
+                     VALUES (?, ?, ?, ?)
+                     ON CONFLICT (session_id) DO UPDATE
+                         SET data       = excluded.data,
+                             updated_at = excluded.updated_at
+                     ''', (session_id, user_id, data, updated_at))
+
+    def delete(self, session_id):
+        self.shard.writer.submit(self._delete, session_id).result()
+
+    @staticmethod
+    def _delete(conn, session_id):
+        conn.execute('DELETE FROM quiz_sessions WHERE session_id = ?', (session_id,))
+
+    def count(self):
+        with self.shard.get_connection() as conn:
+            return conn.execute('SELECT COUNT(*) FROM quiz_sessions').fetchone()[0]
+
+# Удаление устаревших сессий и самых старых сверх max_size
+    def sweep(self):
+        expired, evicted = self.shard.writer.submit(self._sweep, int(time.time()) - self.ttl, self.max_size).result()
+        self.expired += expired
+        self.evictions += evicted
+        return expired + evicted
+
+    @staticmethod
+    def _sweep(conn, deadline, max_size):
+        expired = conn.execute('DELETE FROM quiz_sessions WHERE updated_at < ?', (deadline,)).rowcount
+        evicted = conn.execute('''
+                               DELETE
+                               FROM quiz_sessions
+                               WHERE session_id IN (SELECT session_id
+                                                    FROM quiz_sessions
+                                                    ORDER BY updated_at DESC
+                                                    LIMIT -1 OFFSET ?)
+                               ''', (max_size,)).rowcount
+        return expired, evicted
+
+
+SESSION_STORES = {
+    'memory': MemorySessionStore,
+    'sqlite': SQLiteSessionStore,
+}
+
+quiz_session_store = SESSION_STORES.get(QUIZ_SESSION_BACKEND, MemorySessionStore)(QUIZ_SESSION_MAX, QUIZ_SESSION_TTL)
 
 
 # УТИЛИТЫ ДЛЯ РАБОТЫ С НАПОМИНАНИЯМИ
@@ -1065,48 +3478,210 @@ class ExportImportUtils:
             logger.error(f"Error converting to CSV: {e}")
             return None
 
-# Импорт данных пользователя
+# Потоковый экспорт в файл: карточки читаются порциями через fetchmany и сразу пишутся в output
+# output - текстовый файловый объект, format - json, ndjson или csv
+# Все чтения выполняются в одной транзакции, поэтому экспорт видит согласованный снимок БД
     @staticmethod
     @with_connection
-    def import_user_data(conn, telegram_id, data, format='json'):
+    def write_user_export(conn, telegram_id, output, format='json', batch_size=500):
+        own_transaction = not conn.in_transaction
+        if own_transaction:
+            conn.execute('BEGIN')
+
         try:
-            imported_count = 0
+            categories = CategoryUtils.get_user_categories(conn, telegram_id)
+            reminder = ReminderUtils.get_user_reminder(conn, telegram_id)
+            user_stats = UserUtils.get_user_stats(conn, telegram_id)
+
+            meta = {
+                'user_id': telegram_id,
+                'export_date': datetime.now().isoformat(),
+                'format_version': '1.0',
+            }
 
+            cursor = conn.execute('''
+                                  SELECT c.*, cat.name as category_name
+                                  FROM cards c
+                                           LEFT JOIN categories cat ON c.category_id = cat.id
+                                  WHERE c.user_id = ?
+                                  ORDER BY c.created_at DESC, c.id DESC
+                                  ''', (telegram_id,))
+
+            def card_batches():
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield [dict(row) for row in rows]
+
+            def dump(value):
+                return json.dumps(value, ensure_ascii=False, default=str)
+
+            cards_count = 0
+
+            if format == 'json':
+                output.write('{\n')
+                for key, value in meta.items():
+                    output.write(f'  {dump(key)}: {dump(value)},\n')
+                output.write(f'  "categories": {dump(categories)},\n')
+                output.write('  "cards": [')
+
+                for batch in card_batches():
+                    for card in batch:
+                        output.write(',\n    ' if cards_count else '\n    ')
+                        output.write(dump(card))
+                        cards_count += 1
+
+                output.write('\n  ],\n' if cards_count else '],\n')
+                output.write(f'  "reminder": {dump(reminder)},\n')
+                output.write(f'  "user_stats": {dump(user_stats)}\n')
+                output.write('}\n')
+
+            elif format == 'ndjson':
+                output.write(dump({'type': 'meta', **meta, 'reminder': reminder, 'user_stats': user_stats}) + '\n')
+                for category in categories:
+                    output.write(dump({'type': 'category', **category}) + '\n')
+
+                for batch in card_batches():
+                    for card in batch:
+                        output.write(dump({'type': 'card', **card}) + '\n')
+                        cards_count += 1
+
+            elif format == 'csv':
+                import csv
+
+                writer = csv.writer(output)
+                writer.writerow(['Front', 'Back', 'Category', 'Status', 'Difficulty',
+                                 'Review Count', 'Correct Answers', 'Wrong Answers'])
+
+                for batch in card_batches():
+                    writer.writerows([card['front'], card['back'], card.get('category_name', ''), card['status'],
+                                      card['difficulty'], card['review_count'], card['correct_answers'],
+                                      card['wrong_answers']] for card in batch)
+                    cards_count += len(batch)
+
+            else:
+                raise ValueError(f"Unsupported export format: {format}")
+
+            return cards_count
+        finally:
+            if own_transaction:
+                conn.execute('ROLLBACK')
+
+# Экспорт во временный файл (небольшие экспорты остаются в памяти, большие уходят на диск)
+# Возвращает бинарный файловый объект, готовый к отправке, или None при ошибке
+    @staticmethod
+    @with_connection
+    def export_user_data_to_file(conn, telegram_id, format='json'):
+        import io
+        import tempfile
+
+        file_data = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        try:
+            # utf-8-sig для корректного открытия CSV в Excel
+            encoding = 'utf-8-sig' if format == 'csv' else 'utf-8'
+            output = io.TextIOWrapper(file_data, encoding=encoding, newline='')
+
+            ExportImportUtils.write_user_export(conn, telegram_id, output, format=format)
+
+            output.flush()
+            output.detach()
+            file_data.seek(0)
+            return file_data
+        except Exception as e:
+            logger.error(f"Error exporting data to file: {e}")
+            file_data.close()
+            return None
+
+# Импорт данных пользователя (категории и карточки из JSON-экспорта, CSV или TXT)
+# Возвращает число созданных категорий и карточек: {'categories': ..., 'cards': ...}
+    @staticmethod
+    @with_connection
+    def import_user_data(conn, telegram_id, data, format='json', default_category_id=None):
+        imported = {'categories': 0, 'cards': 0}
+        try:
             if format == 'json':
                 try:
                     import_data = json.loads(data)
                 except json.JSONDecodeError as e:
                     logger.error(f"Invalid JSON: {e}")
-                    return 0
+                    return imported
 
+                # Существующие категории загружаются один раз
+                existing_categories = {c['name'].lower(): c['id']
+                                       for c in CategoryUtils.get_user_categories(conn, telegram_id)}
                 category_map = {}
 
                 if 'categories' in import_data:
                     for category in import_data['categories']:
+                        existing_id = existing_categories.get(category['name'].lower())
+
+                        if existing_id:
+                            category_map[category.get('id')] = existing_id
+                            continue
+
                         if category['name'] in ['Общее', 'По умолчанию']:
                             continue
 
-                        existing_categories = CategoryUtils.get_user_categories(conn, telegram_id)
-                        exists = any(c['name'].lower() == category['name'].lower()
-                                     for c in existing_categories)
+                        new_category_id = CategoryUtils.create_category(
+                            conn, telegram_id,
+                            category['name'],
+                            category.get('description'),
+                            category.get('color')
+                        )
+
+                        if new_category_id:
+                            existing_categories[category['name'].lower()] = new_category_id
+                            category_map[category.get('id')] = new_category_id
+                            imported['categories'] += 1
+
+                if 'cards' in import_data:
+                    cards = ({'front': card.get('front'), 'back': card.get('back'),
+                              'category_id': category_map.get(card.get('category_id')),
+                              'category': card.get('category_name')}
+                             for card in import_data['cards'])
 
-                        if not exists:
-                            new_category_id = CategoryUtils.create_category(
-                                conn, telegram_id,
-                                category['name'],
-                                category.get('description'),
-                                category.get('color')
-                            )
+                    imported['cards'] = CardUtils.bulk_create_cards(conn, telegram_id, cards,
+                                                                    default_category_id=default_category_id)
+
+            elif format == 'csv':
+                imported['cards'] = CardUtils.bulk_create_cards(conn, telegram_id, ExportImportUtils._parse_csv(data),
+                                                                default_category_id=default_category_id)
 
-                            if new_category_id:
-                                category_map[category['id']] = new_category_id
-                                imported_count += 1
+            elif format == 'txt':
+                imported['cards'] = CardUtils.bulk_create_cards(conn, telegram_id, ExportImportUtils._parse_txt(data),
+                                                                default_category_id=default_category_id)
 
-            return imported_count
+            category_cache.invalidate(telegram_id)
+            return imported
 
         except Exception as e:
             logger.error(f"Error importing data: {e}")
-            return 0
+            return imported
+
+# Разбор CSV: столбцы Вопрос, Ответ, Категория (необязательно), строка заголовка пропускается
+    @staticmethod
+    def _parse_csv(data):
+        import io
+        import csv
+
+        for row in csv.reader(io.StringIO(data)):
+            if len(row) < 2:
+                continue
+            if row[0].strip().lower() in ('front', 'вопрос'):
+                continue
+
+            yield {'front': row[0], 'back': row[1], 'category': row[2] if len(row) > 2 else None}
+
+# Разбор текстового файла: одна карточка на строку в формате "Вопрос - Ответ"
+    @staticmethod
+    def _parse_txt(data):
+        for line in data.splitlines():
+            if ' - ' not in line:
+                continue
+
+            front, back = line.split(' - ', 1)
+            yield {'front': front, 'back': back}
 
 
 # УТИЛИТЫ ДЛЯ СТАТИСТИКИ И АНАЛИТИКИ
@@ -1118,11 +3693,14 @@ class AnalyticsUtils:
     def get_daily_stats(conn, telegram_id, days=30):
         try:
             cursor = conn.execute('''
-                                  SELECT
-                                      DATE (created_at) as date, COUNT (*) as cards_studied, SUM (correct_answers) as correct, SUM (wrong_answers) as wrong, SUM (session_duration) as total_time
-                                  FROM study_sessions
-                                  WHERE user_id = ? AND created_at >= DATE ('now', ?)
-                                  GROUP BY DATE (created_at)
+                                  SELECT date,
+                                         sessions,
+                                         cards_studied,
+                                         correct_answers  as correct,
+                                         wrong_answers    as wrong,
+                                         total_time
+                                  FROM daily_stats
+                                  WHERE user_id = ? AND date >= DATE ('now', ?)
                                   ORDER BY date DESC
                                   ''', (telegram_id, f'-{days} days'))
 
@@ -1131,6 +3709,173 @@ class AnalyticsUtils:
             logger.error(f"Error getting daily stats: {e}")
             return []
 
+# Получение сессий пользователя (новые первыми) за последние days дней или последних limit сессий
+# В архиве лежат только сессии старше всех оставшихся в основной БД, поэтому архив читается
+# после основной БД, только если ее не хватило и окно days доходит до архивных сессий;
+# запрос к архиву идет по индексу (user_id, created_at)
+    @staticmethod
+    @with_connection
+    def get_sessions(conn, telegram_id, days=None, limit=None):
+        try:
+            sessions = []
+            tables = ['main.study_sessions']
+
+            # Архив нужен, только если окно уходит раньше самой новой архивной сессии (created_at - время UTC)
+            newest = db_manager.shard_for(telegram_id).archive_newest(conn)
+            since = None
+            if days is not None:
+                since = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - days * 86400))
+            if newest is not None and (since is None or newest >= since):
+                tables.append('archive.study_sessions')
+
+            for table in tables:
+                query = f'SELECT * FROM {table} WHERE user_id = ?'
+                params = [telegram_id]
+
+                if days is not None:
+                    query += " AND created_at >= DATETIME('now', ?)"
+                    params.append(f'-{days} days')
+
+                query += ' ORDER BY created_at DESC'
+
+                if limit is not None:
+                    query += ' LIMIT ?'
+                    params.append(limit - len(sessions))
+
+                cursor = conn.execute(query, params)
+                sessions.extend(dict(row) for row in cursor.fetchall())
+
+                # Основной БД хватило на весь лимит - архив не читается
+                if limit is not None and len(sessions) >= limit:
+                    break
+
+            return sessions
+        except Exception as e:
+            logger.error(f"Error getting sessions: {e}")
+            return []
+
+# Общая статистика бота по всем шардам: счетчики каждого шарда суммируются
+    @staticmethod
+    def get_global_stats():
+        totals = {}
+        try:
+            for stats in db_manager.map_shards(AnalyticsUtils._get_shard_stats):
+                for key, value in stats.items():
+                    totals[key] = totals.get(key, 0) + (value or 0)
+        except Exception as e:
+            logger.error(f"Error getting global stats: {e}")
+        return totals
+
+    @staticmethod
+    def _get_shard_stats(conn):
+        cursor = conn.execute('''
+                              SELECT COUNT(*)                                                           as total_users,
+                                     COUNT(CASE WHEN last_active >= DATE ('now', '-7 days') THEN 1 END) as active_week,
+                                     COUNT(CASE WHEN last_active >= DATE ('now', '-1 day') THEN 1 END)  as active_today,
+                                     (SELECT COUNT(*) FROM cards)                                       as total_cards,
+                                     (SELECT COUNT(*) FROM categories)                                  as total_categories,
+                                     (SELECT COUNT(*) FROM main.study_sessions)                         as total_sessions,
+                                     (SELECT COUNT(*) FROM archive.study_sessions)                      as archived_sessions
+                              FROM users
+                              ''')
+        return dict(cursor.fetchone())
+
+# Пользователи с наибольшим числом карточек: топ каждого шарда объединяется в общий топ
+    @staticmethod
+    def get_top_users(limit=5):
+        try:
+            users = [user for shard_users in db_manager.map_shards(AnalyticsUtils._get_shard_top_users, limit)
+                     for user in shard_users]
+            return heapq.nlargest(limit, users, key=lambda user: user['cards_count'])
+        except Exception as e:
+            logger.error(f"Error getting top users: {e}")
+            return []
+
+    @staticmethod
+    def _get_shard_top_users(conn, limit):
+        cursor = conn.execute('''
+                              SELECT u.telegram_id,
+                                     u.first_name,
+                                     u.username,
+                                     COALESCE(s.total_cards, 0) as cards_count
+                              FROM users u
+                                       LEFT JOIN user_stats s ON s.user_id = u.telegram_id
+                              ORDER BY cards_count DESC LIMIT ?
+                              ''', (limit,))
+        return [dict(row) for row in cursor.fetchall()]
+
+# Прогноз нагрузки пользователя: [{'date', 'count'}] на days дней вперед, день 0 - сегодня вместе с просроченными
+    @staticmethod
+    @with_connection
+    def get_review_forecast(conn, telegram_id, days=7):
+        start = AnalyticsUtils._forecast_start()
+        key = (telegram_id, days, start)
+
+        forecast = forecast_cache.get(key)
+        if forecast is None:
+            epoch = forecast_cache.epoch()
+            try:
+                counts = AnalyticsUtils._get_forecast_counts(conn, start, days, telegram_id)
+            except Exception as e:
+                logger.error(f"Error getting review forecast: {e}")
+                return []
+
+            forecast = AnalyticsUtils._build_forecast(start, counts)
+            forecast_cache.set(key, forecast, epoch)
+
+        return [dict(day) for day in forecast]
+
+# Прогноз нагрузки по всем пользователям: счетчики шардов складываются по дням
+    @staticmethod
+    def get_global_review_forecast(days=7):
+        start = AnalyticsUtils._forecast_start()
+        key = (None, days, start)
+
+        forecast = forecast_cache.get(key)
+        if forecast is None:
+            epoch = forecast_cache.epoch()
+            try:
+                counts = [sum(day_counts) for day_counts in
+                          zip(*db_manager.map_shards(AnalyticsUtils._get_forecast_counts, start, days))]
+            except Exception as e:
+                logger.error(f"Error getting global review forecast: {e}")
+                return []
+
+            forecast = AnalyticsUtils._build_forecast(start, counts)
+            forecast_cache.set(key, forecast, epoch)
+
+        return [dict(day) for day in forecast]
+
+# Полночь текущего дня (unix-время) - начало отсчета дней прогноза
+    @staticmethod
+    def _forecast_start():
+        return to_epoch(datetime.now().replace(hour=0, minute=0, second=0, microsecond=0))
+
+# Число изучаемых карточек по дням повторения одним сгруппированным запросом
+    @staticmethod
+    def _get_forecast_counts(conn, start, days, telegram_id=None):
+        user_filter = 'user_id = ? AND' if telegram_id else ''
+        params = [start, start] + ([telegram_id] if telegram_id else []) + [start + days * 86400]
+
+        cursor = conn.execute(f'''
+                              SELECT CASE WHEN next_review < ? THEN 0 ELSE (next_review - ?) / 86400 END as day,
+                                     COUNT(*)                                                           as count
+                              FROM cards
+                              WHERE {user_filter} status = 'learning'
+                                AND next_review < ?
+                              GROUP BY day
+                              ''', params)
+
+        counts = [0] * days
+        for row in cursor.fetchall():
+            counts[row['day']] += row['count']
+        return counts
+
+    @staticmethod
+    def _build_forecast(start, counts):
+        first_day = datetime.fromtimestamp(start)
+        return [{'date': (first_day + timedelta(days=i)).date(), 'count': count} for i, count in enumerate(counts)]
+
 # Получение статистики по категориям
     @staticmethod
     @with_connection
@@ -1160,13 +3905,12 @@ class AnalyticsUtils:
     def get_learning_progress(conn, telegram_id):
         try:
             cursor = conn.execute('''
-                                  SELECT strftime('%Y-%m', created_at) as month,
-                    COUNT(*) as sessions,
-                    SUM(cards_studied) as cards_studied,
-                    AVG(correct_answers * 100.0 / (correct_answers + wrong_answers)) as accuracy
-                                  FROM study_sessions
+                                  SELECT month,
+                                         sessions,
+                                         cards_studied,
+                                         accuracy
+                                  FROM monthly_stats
                                   WHERE user_id = ?
-                                  GROUP BY strftime('%Y-%m', created_at)
                                   ORDER BY month DESC
                                       LIMIT 12
                                   ''', (telegram_id,))
@@ -1180,29 +3924,106 @@ class AnalyticsUtils:
 # УТИЛИТЫ ДЛЯ ОЧИСТКИ И ОПТИМИЗАЦИИ
 class MaintenanceUtils:
 
-# Очистка старых данных"
+# Очистка старых данных: сессии старше days_old дней переносятся в архив
     @staticmethod
     @with_connection
     def cleanup_old_data(conn, telegram_id, days_old=180):
         try:
-            # Удаляем старые сессии
-            cursor = conn.execute('''
-                                  DELETE
-                                  FROM study_sessions
-                                  WHERE user_id = ?
-                                    AND created_at < DATE ('now'
-                                      , ?)
-                                  ''', (telegram_id, f'-{days_old} days'))
-
-            deleted_sessions = cursor.rowcount
+            archived_sessions = MaintenanceUtils.archive_old_sessions(days_old, telegram_id)
 
             return {
-                'deleted_sessions': deleted_sessions,
-                'total_deleted': deleted_sessions
+                'archived_sessions': archived_sessions,
+                'deleted_sessions': 0,
+                'total_deleted': 0
             }
         except Exception as e:
             logger.error(f"Error cleaning up old data: {e}")
-            return {'deleted_sessions': 0, 'total_deleted': 0}
+            return {'archived_sessions': 0, 'deleted_sessions': 0, 'total_deleted': 0}
+
+# Перенос сессий старше days_old дней в архивную БД порциями по batch_size
+# Каждая порция - отдельная короткая транзакция в своем соединении (не зависит от транзакции вызывающего);
+# повторный запуск после сбоя безопасен (INSERT OR IGNORE)
+    @staticmethod
+    def archive_old_sessions(days_old=180, telegram_id=None, batch_size=1000):
+        archived = 0
+        user_filter = 'AND user_id = ?' if telegram_id else ''
+        shards = [db_manager.shard_for(telegram_id)] if telegram_id else db_manager.shards
+
+        try:
+            for shard in shards:
+                while True:
+                    with shard.own_transaction() as conn:
+                        params = [f'-{days_old} days'] + ([telegram_id] if telegram_id else []) + [batch_size]
+                        cursor = conn.execute(f'''
+                                              SELECT id, created_at
+                                              FROM main.study_sessions
+                                              WHERE created_at < DATETIME('now', ?) {user_filter}
+                                              ORDER BY created_at LIMIT ?
+                                              ''', params)
+                        rows = cursor.fetchall()
+                        ids = [row['id'] for row in rows]
+
+                        if not ids:
+                            break
+
+                        placeholders = ','.join('?' * len(ids))
+                        conn.execute(f'''
+                                     INSERT OR IGNORE INTO archive.study_sessions
+                                     SELECT id, user_id, cards_studied, correct_answers, wrong_answers,
+                                            session_duration, session_type, created_at
+                                     FROM main.study_sessions
+                                     WHERE id IN ({placeholders})
+                                     ''', ids)
+                        conn.execute(f'DELETE FROM main.study_sessions WHERE id IN ({placeholders})', ids)
+
+                    shard.note_archived(rows[-1]['created_at'])
+                    archived += len(ids)
+
+                    if len(ids) < batch_size:
+                        break
+
+            if archived:
+                logger.info(f"Archived {archived} study sessions older than {days_old} days")
+            return archived
+        except Exception as e:
+            logger.error(f"Error archiving old sessions: {e}")
+            return archived
+
+# Удаление пользователей, неактивных больше days_inactive дней (данные удаляются каскадом)
+    @staticmethod
+    @with_connection
+    def delete_inactive_users(conn, days_inactive=30):
+        try:
+            cursor = conn.execute('''
+                                  DELETE
+                                  FROM users
+                                  WHERE last_active < DATE ('now', ?)
+                                  ''', (f'-{days_inactive} days',))
+            if cursor.rowcount:
+                known_users.invalidate_all()
+                category_cache.invalidate_all()
+                due_index.clear()
+                forecast_cache.invalidate_all()
+            return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Error deleting inactive users: {e}")
+            return 0
+
+# Удаление архивных сессий пользователей, которых больше нет в основной БД
+# (внешние ключи между файлами не работают, каскад до архива не доходит)
+    @staticmethod
+    @with_connection
+    def delete_orphan_archived_sessions(conn):
+        try:
+            cursor = conn.execute('''
+                                  DELETE
+                                  FROM archive.study_sessions
+                                  WHERE user_id NOT IN (SELECT telegram_id FROM main.users)
+                                  ''')
+            return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Error deleting orphan archived sessions: {e}")
+            return 0
 
 # Удаление пустых категорий
     @staticmethod
@@ -1218,6 +4039,7 @@ class MaintenanceUtils:
                                                    WHERE user_id = ?)
                                   ''', (telegram_id, telegram_id))
 
+            category_cache.invalidate(telegram_id)
             return cursor.rowcount
         except Exception as e:
             logger.error(f"Error deleting empty categories: {e}")
@@ -1245,8 +4067,29 @@ class MaintenanceUtils:
             logger.error(f"Error resetting user stats: {e}")
             return False
 
+# Пересчет счетчиков user_stats по данным таблиц (для всех пользователей или одного)
+# Счетчики сессий пересчитываются только по запросу: удаленные сессии в них уже учтены
+    @staticmethod
+    @with_connection
+    def rebuild_user_stats(conn, telegram_id=None, include_sessions=False):
+        try:
+            return DatabaseManager.rebuild_user_stats(conn, telegram_id, include_sessions)
+        except Exception as e:
+            logger.error(f"Error rebuilding user stats: {e}")
+            return 0
+
 
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
+# Перевод datetime в unix-время для хранения в next_review
+def to_epoch(value):
+    return int(value.timestamp())
+
+
+# Перевод unix-времени из next_review обратно в datetime (0 - карточка уже к повторению)
+def from_epoch(value):
+    return datetime.fromtimestamp(value) if value else None
+
+
 # Получение количества карточек пользователя
 @with_connection
 def get_user_cards_count(conn, telegram_id):
@@ -2,12 +2,12 @@ import logging
 import random
 from datetime import datetime, timedelta
 from telebot import types
-from database import with_connection, CardUtils, CategoryUtils, UserUtils, with_connection
+from database import with_connection, CardUtils, CategoryUtils, UserUtils, AnalyticsUtils, with_connection, from_epoch, review_buffer, quiz_session_store
 
 logger = logging.getLogger(__name__)
 
-# Словарь для хранения активных сессий тестирования
-quiz_sessions = {}
+# Хранилище активных сессий тестирования (память или SQLite, см. QUIZ_SESSION_BACKEND)
+quiz_sessions = quiz_session_store
 
 
 # Регистрация всех обработчиков для тестирования и повторений
@@ -20,10 +20,10 @@ def register_quiz_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
-                all_cards = CardUtils.get_user_cards(conn, user_id)
+            with with_connection(telegram_id=user_id) as conn:
+                counts = CardUtils.get_card_counts(conn, user_id)
 
-                if not all_cards:
+                if not counts['total']:
                     markup = types.InlineKeyboardMarkup()
                     btn_add = types.InlineKeyboardButton('➕ Добавить карточки', callback_data='add_cards_first')
                     markup.add(btn_add)
@@ -33,12 +33,10 @@ def register_quiz_handlers(bot):
                                      parse_mode='Markdown', reply_markup=markup)
                     return
 
-                due_cards = CardUtils.get_cards_for_review(conn, user_id)
-
                 categories = CategoryUtils.get_user_categories(conn, user_id)
 
-            text = (f"*Режимы тестирования*\n\nВаша статистика:\n• Всего карточек: *{len(all_cards)}*\n"
-                    f"• Для повторения сегодня: *{len(due_cards)}*\n\n*Выберите режим:*")
+            text = (f"*Режимы тестирования*\n\nВаша статистика:\n• Всего карточек: *{counts['total']}*\n"
+                    f"• Для повторения сегодня: *{counts['due']}*\n\n*Выберите режим:*")
 
             markup = types.InlineKeyboardMarkup(row_width=2)
 
@@ -73,20 +71,26 @@ def register_quiz_handlers(bot):
             logger.error(f"Error in start_quiz_command: {e}")
             bot.send_message(message.chat.id, "Ошибка при запуске тестирования")
 
-# Запуск сессии тестирования
+# Запуск сессии тестирования: вся колода загружается одним запросом и хранится в сессии
     def start_quiz_session(user_id, card_ids, session_type='review'):
         try:
             if not card_ids:
                 return None
 
+            with with_connection(telegram_id=user_id) as conn:
+                cards = CardUtils.get_cards_by_ids(conn, card_ids)
+
+            card_ids = [card_id for card_id in card_ids if card_id in cards]
+            if not card_ids:
+                return None
+
             random.shuffle(card_ids)
 
             session_id = f"{user_id}_{datetime.now().timestamp()}"
 
-            quiz_sessions[session_id] = {'user_id': user_id, 'card_ids': card_ids, 'current_index': 0,
-                                         'correct_answers': 0, 'wrong_answers': 0,'start_time': datetime.now(),
-                                         'session_type': session_type, 'current_card_id': card_ids[0]
-                if card_ids else None}
+            quiz_sessions.save(session_id, {'user_id': user_id, 'card_ids': card_ids, 'cards': cards, 'current_index': 0,
+                                            'correct_answers': 0, 'wrong_answers': 0, 'start_time': datetime.now(),
+                                            'session_type': session_type, 'current_card_id': card_ids[0]})
 
             return session_id
 
@@ -100,7 +104,7 @@ def register_quiz_handlers(bot):
         try:
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 cards = CardUtils.get_cards_for_review(conn, user_id, limit=20)
 
                 if not cards:
@@ -127,18 +131,14 @@ def register_quiz_handlers(bot):
         try:
             user_id = call.from_user.id
 
-            with with_connection() as conn:
-                all_cards = CardUtils.get_user_cards(conn, user_id)
+            with with_connection(telegram_id=user_id) as conn:
+                # Выбираем случайные карточки (макс 10) без загрузки всей колоды
+                selected_ids = CardUtils.sample_cards(conn, user_id, 10)
 
-                if not all_cards:
+                if not selected_ids:
                     bot.answer_callback_query(call.id, "Нет карточек для тестирования")
                     return
 
-                # Выбираем случайные карточки (макс 10)
-                card_ids = [card['id'] for card in all_cards]
-                random.shuffle(card_ids)
-                selected_ids = card_ids[:10]
-
                 session_id = start_quiz_session(user_id, selected_ids, 'random')
 
                 if session_id:
@@ -158,7 +158,7 @@ def register_quiz_handlers(bot):
             user_id = call.from_user.id
             category_id = call.data.replace('quiz_category_', '')
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 category = CategoryUtils.get_category_by_id(conn, category_id)
 
                 if not category:
@@ -188,27 +188,27 @@ def register_quiz_handlers(bot):
 # Показать следующую карточку в сессии
     def show_next_card(bot_instance, chat_id, session_id):
         try:
-            if session_id not in quiz_sessions:
+            session = quiz_sessions.get(session_id)
+            if session is None:
                 bot_instance.send_message(chat_id, "Сессия завершена или не найдена")
                 return
 
-            session = quiz_sessions[session_id]
-
             if session['current_index'] >= len(session['card_ids']):
                 # Сессия завершена
                 finish_quiz_session(bot_instance, chat_id, session_id)
                 return
 
             current_card_id = session['card_ids'][session['current_index']]
-            session['current_card_id'] = current_card_id
+            card = session['cards'].get(current_card_id)
 
-            with with_connection() as conn:
-                card = CardUtils.get_card_by_id(conn, current_card_id)
+            if not card:
+                session['current_index'] += 1
+                quiz_sessions.save(session_id, session)
+                show_next_card(bot_instance, chat_id, session_id)
+                return
 
-                if not card:
-                    session['current_index'] += 1
-                    show_next_card(bot_instance, chat_id, session_id)
-                    return
+            session['current_card_id'] = current_card_id
+            quiz_sessions.save(session_id, session)
 
             card_number = session['current_index'] + 1
             total_cards = len(session['card_ids'])
@@ -246,12 +246,11 @@ def register_quiz_handlers(bot):
 # Обработка ответа пользователя
     def process_user_answer(message, bot_instance, session_id):
         try:
-            if session_id not in quiz_sessions:
+            session = quiz_sessions.get(session_id)
+            if session is None:
                 bot_instance.send_message(message.chat.id, "Сессия завершена")
                 return
 
-            session = quiz_sessions[session_id]
-            user_id = message.from_user.id
             user_answer = message.text.strip()
 
             if user_answer == 'Показать ответ':
@@ -264,26 +263,24 @@ def register_quiz_handlers(bot):
                 finish_quiz_session(bot_instance, message.chat.id, session_id)
                 return
 
-            with with_connection() as conn:
-                card = CardUtils.get_card_by_id(conn, session['current_card_id'])
+            card = session['cards'].get(session['current_card_id'])
 
-                if not card:
-                    bot_instance.send_message(message.chat.id, "Ошибка: карточка не найдена")
-                    return
+            if not card:
+                bot_instance.send_message(message.chat.id, "Ошибка: карточка не найдена")
+                return
 
-                correct_answer = card['back'].lower().strip()
-                user_answer_clean = user_answer.lower().strip()
+            correct_answer = card['back'].lower().strip()
+            user_answer_clean = user_answer.lower().strip()
 
-                is_correct = user_answer_clean == correct_answer
+            is_correct = user_answer_clean == correct_answer
 
-                CardUtils.update_card_after_review(
-                    conn, session['current_card_id'], is_correct
-                )
+            CardUtils.record_review(session['user_id'], session['current_card_id'], is_correct, card)
 
-                if is_correct:
-                    session['correct_answers'] += 1
-                else:
-                    session['wrong_answers'] += 1
+            if is_correct:
+                session['correct_answers'] += 1
+            else:
+                session['wrong_answers'] += 1
+            quiz_sessions.save(session_id, session)
 
             show_answer_result(
                 bot_instance, message.chat.id, session_id,
@@ -297,21 +294,21 @@ def register_quiz_handlers(bot):
 # Показать правильный ответ
     def show_answer(bot_instance, chat_id, session_id, was_shown=False):
         try:
-            if session_id not in quiz_sessions:
+            session = quiz_sessions.get(session_id)
+            if session is None:
                 return
 
-            session = quiz_sessions[session_id]
+            card = session['cards'].get(session['current_card_id'])
 
-            with with_connection() as conn:
-                card = CardUtils.get_card_by_id(conn, session['current_card_id'])
+            if not card:
+                return
 
-                if not card:
-                    return
+            next_review = from_epoch(card['next_review'])
 
             text = (f"*Правильный ответ:*\n\n`{card['back']}`\n\n"
                     f"*Объяснение:* {card.get('explanation', 'Нет дополнительного объяснения')}\n\n"
                     f"Статус: {"Изучено" if card['status'] == 'learned' else "Изучается"}\n"
-                    f"Следующее повторение: *{card['next_review'][:10] if card['next_review'] else 'скоро'}*")
+                    f"Следующее повторение: *{next_review.strftime('%Y-%m-%d') if next_review else 'скоро'}*")
 
             markup = types.InlineKeyboardMarkup(row_width=2)
 
@@ -350,12 +347,12 @@ def register_quiz_handlers(bot):
 # Пропустить текущую карточку
     def skip_card(bot_instance, chat_id, session_id):
         try:
-            if session_id not in quiz_sessions:
+            session = quiz_sessions.get(session_id)
+            if session is None:
                 return
 
-            session = quiz_sessions[session_id]
-
             session['current_index'] += 1
+            quiz_sessions.save(session_id, session)
 
             remove_keyboard = types.ReplyKeyboardRemove()
             bot_instance.send_message(chat_id, "Карточка пропущена", reply_markup=remove_keyboard)
@@ -371,12 +368,13 @@ def register_quiz_handlers(bot):
         try:
             session_id = call.data.replace('next_card_', '')
 
-            if session_id not in quiz_sessions:
+            session = quiz_sessions.get(session_id)
+            if session is None:
                 bot.answer_callback_query(call.id, "Сессия завершена")
                 return
 
-            session = quiz_sessions[session_id]
             session['current_index'] += 1
+            quiz_sessions.save(session_id, session)
 
             remove_keyboard = types.ReplyKeyboardRemove()
             bot.send_message(call.message.chat.id, "", reply_markup=remove_keyboard)
@@ -394,19 +392,17 @@ def register_quiz_handlers(bot):
         try:
             session_id = call.data.replace('remember_', '')
 
-            if session_id not in quiz_sessions:
+            session = quiz_sessions.get(session_id)
+            if session is None:
                 bot.answer_callback_query(call.id, "Сессия завершена")
                 return
 
-            session = quiz_sessions[session_id]
-
-            with with_connection() as conn:
-                CardUtils.update_card_after_review(
-                    conn, session['current_card_id'], True
-                )
-                session['correct_answers'] += 1
+            CardUtils.record_review(session['user_id'], session['current_card_id'], True,
+                                    session['cards'].get(session['current_card_id']))
+            session['correct_answers'] += 1
 
             session['current_index'] += 1
+            quiz_sessions.save(session_id, session)
             remove_keyboard = types.ReplyKeyboardRemove()
             bot.send_message(call.message.chat.id, "", reply_markup=remove_keyboard)
 
@@ -423,19 +419,17 @@ def register_quiz_handlers(bot):
         try:
             session_id = call.data.replace('forgot_', '')
 
-            if session_id not in quiz_sessions:
+            session = quiz_sessions.get(session_id)
+            if session is None:
                 bot.answer_callback_query(call.id, "Сессия завершена")
                 return
 
-            session = quiz_sessions[session_id]
-
-            with with_connection() as conn:
-                CardUtils.update_card_after_review(
-                    conn, session['current_card_id'], False
-                )
-                session['wrong_answers'] += 1
+            CardUtils.record_review(session['user_id'], session['current_card_id'], False,
+                                    session['cards'].get(session['current_card_id']))
+            session['wrong_answers'] += 1
 
             session['current_index'] += 1
+            quiz_sessions.save(session_id, session)
             remove_keyboard = types.ReplyKeyboardRemove()
             bot.send_message(call.message.chat.id, "", reply_markup=remove_keyboard)
 
@@ -449,11 +443,11 @@ def register_quiz_handlers(bot):
 # Завершение сессии тестирования
     def finish_quiz_session(bot_instance, chat_id, session_id):
         try:
-            if session_id not in quiz_sessions:
+            session = quiz_sessions.get(session_id)
+            if session is None:
                 bot_instance.send_message(chat_id, "Сессия не найдена")
                 return
 
-            session = quiz_sessions[session_id]
             user_id = session['user_id']
 
             total_answered = session['correct_answers'] + session['wrong_answers']
@@ -480,7 +474,9 @@ def register_quiz_handlers(bot):
             else:
                 text += "Нужно больше практики. Попробуйте повторить сложные карточки."
 
-            with with_connection() as conn:
+            review_buffer.flush()
+
+            with with_connection(telegram_id=user_id) as conn:
                 cursor = conn.execute('''
                                       INSERT INTO study_sessions
                                       (user_id, cards_studied, correct_answers, wrong_answers, session_duration,
@@ -489,16 +485,6 @@ def register_quiz_handlers(bot):
                                       ''', (user_id, total_answered, session['correct_answers'],
                                             session['wrong_answers'], duration, session['session_type']))
 
-                conn.execute('''
-                             UPDATE user_stats
-                             SET total_sessions   = total_sessions + 1,
-                                 total_study_time = total_study_time + ?,
-                                 correct_answers  = correct_answers + ?,
-                                 wrong_answers    = wrong_answers + ?,
-                                 updated_at       = CURRENT_TIMESTAMP
-                             WHERE user_id = ?
-                             ''', (duration, session['correct_answers'], session['wrong_answers'], user_id))
-
             markup = types.InlineKeyboardMarkup(row_width=2)
 
             btn_repeat = types.InlineKeyboardButton('Повторить сессию', callback_data='repeat_session')
@@ -511,8 +497,7 @@ def register_quiz_handlers(bot):
 
             bot_instance.send_message(chat_id, text, parse_mode='Markdown', reply_markup=markup)
 
-            if session_id in quiz_sessions:
-                del quiz_sessions[session_id]
+            quiz_sessions.delete(session_id)
 
         except Exception as e:
             logger.error(f"Error in finish_quiz_session: {e}")
@@ -525,8 +510,8 @@ def register_quiz_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
-                cards = CardUtils.get_cards_for_review(conn, user_id, limit=50)
+            with with_connection(telegram_id=user_id) as conn:
+                cards = CardUtils.get_cards_for_review(conn, user_id, limit=5)
 
                 if not cards:
                     markup = types.InlineKeyboardMarkup()
@@ -543,23 +528,30 @@ def register_quiz_handlers(bot):
                                      parse_mode='Markdown', reply_markup=markup)
                     return
 
-                easy_cards = [c for c in cards if c['difficulty'] <= 2]
-                medium_cards = [c for c in cards if 3 <= c['difficulty'] <= 4]
-                hard_cards = [c for c in cards if c['difficulty'] == 5]
-
-                text = (f"*Карточки на сегодня*\n\nВсего для повторения: *{len(cards)}*\n\n*По сложности:*\n"
-                        f"• 🟢 Легкие: {len(easy_cards)}\n• 🟡 Средние: {len(medium_cards)}\n"
-                        f"• 🔴 Сложные: {len(hard_cards)}\n\n*Примеры карточек:*")
-
-                for i, card in enumerate(cards[:5], 1):
-                    difficulty_emoji = "🟢" if card['difficulty'] <= 2 else "🟡" if card['difficulty'] <= 4 else "🔴"
+                # Счетчики считаются тем же условием по доле верных ответов, что и выборка кнопок
+                # «Только легкие» и «Только сложные»; карточки без ответов считаются новыми
+                due = CardUtils.get_card_counts(conn, user_id)['due']
+                counts = CardUtils.get_ranked_counts(conn, user_id, due_only=True)
+                medium = counts['rated'] - counts['easy'] - counts['hard']
+
+                text = (f"*Карточки на сегодня*\n\nВсего для повторения: *{due}*\n\n*По сложности:*\n"
+                        f"• 🟢 Легкие: {counts['easy']}\n• 🟡 Средние: {medium}\n"
+                        f"• 🔴 Сложные: {counts['hard']}\n• ⚪ Новые: {due - counts['rated']}\n\n*Примеры карточек:*")
+
+                for i, card in enumerate(cards, 1):
+                    answers = card['correct_answers'] + card['wrong_answers']
+                    rate = card['correct_answers'] / answers if answers else None
+                    difficulty_emoji = ("⚪" if rate is None else "🟢" if rate >= CardUtils.EASY_MIN_RATE
+                                        else "🔴" if rate < CardUtils.HARD_MAX_RATE else "🟡")
                     text += f"{i}. {difficulty_emoji} {card['front'][:30]}...\n"
 
                 markup = types.InlineKeyboardMarkup(row_width=2)
 
                 btn_start = types.InlineKeyboardButton('Начать повторение', callback_data='start_review_session')
-                btn_easy = types.InlineKeyboardButton('Только легкие', callback_data='review_easy_only')
-                btn_hard = types.InlineKeyboardButton('Только сложные', callback_data='review_hard_only')
+                btn_easy = types.InlineKeyboardButton(f"Только легкие ({counts['easy']})",
+                                                      callback_data='review_easy_only')
+                btn_hard = types.InlineKeyboardButton(f"Только сложные ({counts['hard']})",
+                                                      callback_data='review_hard_only')
                 btn_all = types.InlineKeyboardButton('Все карточки', callback_data='review_all_today')
 
                 markup.add(btn_start, btn_easy, btn_hard, btn_all)
@@ -576,27 +568,18 @@ def register_quiz_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
-                all_cards = CardUtils.get_user_cards(conn, user_id)
-
-                if not all_cards:
-                    bot.send_message(message.chat.id, "Нет карточек для повторения")
-                    return
-
-                difficult_cards = []
-                for card in all_cards:
-                    total_answers = card['correct_answers'] + card['wrong_answers']
-                    if total_answers > 0:
-                        success_rate = card['correct_answers'] / total_answers
-                        if success_rate < 0.5:
-                            difficult_cards.append(card)
+            with with_connection(telegram_id=user_id) as conn:
+                # 20 самых сложных карточек с долей верных ответов ниже 50% (сортировка по индексу в SQL)
+                difficult_cards = CardUtils.get_ranked_cards(conn, user_id, limit=20, max_rate=0.5)
 
                 if not difficult_cards:
-                    bot.send_message(message.chat.id,
-                                     "*Отлично!*\n\nУ вас нет сложных карточек. Все карточки усвоены хорошо!")
+                    if not CardUtils.get_card_counts(conn, user_id)['total']:
+                        bot.send_message(message.chat.id, "Нет карточек для повторения")
+                    else:
+                        bot.send_message(message.chat.id,
+                                         "*Отлично!*\n\nУ вас нет сложных карточек. Все карточки усвоены хорошо!")
                     return
 
-                difficult_cards = difficult_cards[:20]
                 card_ids = [card['id'] for card in difficult_cards]
 
                 session_id = start_quiz_session(user_id, card_ids, 'difficult_review')
@@ -610,25 +593,50 @@ def register_quiz_handlers(bot):
             logger.error(f"Error in review_difficult_command: {e}")
             bot.send_message(message.chat.id, "Ошибка")
 
+# Повторение только сложных или только легких карточек из карточек на сегодня
+    @bot.callback_query_handler(func=lambda call: call.data in ['review_hard_only', 'review_easy_only'])
+    def review_by_difficulty(call):
+        try:
+            user_id = call.from_user.id
+            hardest = call.data == 'review_hard_only'
+
+            with with_connection(telegram_id=user_id) as conn:
+                if hardest:
+                    cards = CardUtils.get_ranked_cards(conn, user_id, limit=20, hardest=True,
+                                                       max_rate=CardUtils.HARD_MAX_RATE, due_only=True)
+                else:
+                    cards = CardUtils.get_ranked_cards(conn, user_id, limit=20, hardest=False,
+                                                       min_rate=CardUtils.EASY_MIN_RATE, due_only=True)
+
+                if not cards:
+                    bot.answer_callback_query(call.id, "Нет подходящих карточек на сегодня", show_alert=True)
+                    return
+
+                card_ids = [card['id'] for card in cards]
+                session_id = start_quiz_session(user_id, card_ids, 'hard_review' if hardest else 'easy_review')
+
+                if session_id:
+                    show_next_card(bot, call.message.chat.id, session_id)
+                    bot.answer_callback_query(call.id)
+                else:
+                    bot.answer_callback_query(call.id, "Ошибка при запуске сессии")
+
+        except Exception as e:
+            logger.error(f"Error in review_by_difficulty: {e}")
+            bot.answer_callback_query(call.id, "Ошибка")
+
 # Статистика обучения
     @bot.message_handler(commands=['stats', 'progress'])
     def quiz_stats_command(message):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 user_stats = UserUtils.get_user_stats(conn, user_id)
 
-                cursor = conn.execute('''
-                                      SELECT *
-                                      FROM study_sessions
-                                      WHERE user_id = ?
-                                      ORDER BY created_at DESC LIMIT 5
-                                      ''', (user_id,))
-
-                recent_sessions = cursor.fetchall()
+                recent_sessions = AnalyticsUtils.get_sessions(conn, user_id, limit=5)
 
-                due_cards = CardUtils.get_cards_for_review(conn, user_id, limit=100)
+                due_count = CardUtils.get_card_counts(conn, user_id)['due']
 
             if not user_stats:
                 bot.send_message(message.chat.id, "Статистика недоступна")
@@ -645,7 +653,7 @@ def register_quiz_handlers(bot):
                     f"• Общее время: {user_stats['total_study_time'] // 60} мин\n"
                     f"• Правильных ответов: {user_stats['correct_answers']}\n• Ошибок: {user_stats['wrong_answers']}\n"
                     f"• Точность: {accuracy:.1f}%\n• Средняя сессия: {avg_minutes} мин\n\n*Текущий статус:*\n"
-                    f"• Карточек для повторения: {len(due_cards)}\n• Дней подряд: {user_stats['streak_days']}\n"
+                    f"• Карточек для повторения: {due_count}\n• Дней подряд: {user_stats['streak_days']}\n"
                     f"• Последнее занятие: {user_stats['last_study_date'] or 'никогда'}\n\n*Последние сессии:*")
 
             for i, session in enumerate(recent_sessions[:3], 1):
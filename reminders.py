@@ -4,7 +4,7 @@ import schedule
 import time
 from datetime import datetime, time as dt_time, timedelta
 from telebot import types
-from database import with_connection, ReminderUtils, CardUtils, UserUtils, with_connection
+from database import db_manager, with_connection, ReminderUtils, CardUtils, UserUtils, AnalyticsUtils, with_connection
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +18,7 @@ def register_reminders_handlers(bot):
 # Отправка напоминания пользователю
     def send_reminder(user_id, bot_instance):
         try:
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 cards_for_review = CardUtils.get_cards_for_review(conn, user_id, limit=5)
 
                 if not cards_for_review:
@@ -59,30 +59,32 @@ def register_reminders_handlers(bot):
 
             logger.debug(f"Checking reminders at {current_time}, weekday {current_weekday}")
 
-            with with_connection() as conn:
-                reminders = ReminderUtils.get_active_reminders(conn)
+            # Активные напоминания собираются со всех шардов
+            reminders = [reminder for shard_reminders in db_manager.map_shards(ReminderUtils.get_active_reminders)
+                         for reminder in shard_reminders]
 
-                for reminder in reminders:
-                    try:
-                        user_id = reminder['user_id']
-                        reminder_time = reminder['reminder_time']
-                        days_of_week = reminder['days_of_week']
-
-                        if days_of_week:
-                            days_list = [int(d.strip()) for d in days_of_week.split(',') if d.strip()]
-                            if current_weekday not in days_list:
-                                continue
+            for reminder in reminders:
+                try:
+                    user_id = reminder['user_id']
+                    reminder_time = reminder['reminder_time']
+                    days_of_week = reminder['days_of_week']
 
-                        if reminder_time != current_time:
+                    if days_of_week:
+                        days_list = [int(d.strip()) for d in days_of_week.split(',') if d.strip()]
+                        if current_weekday not in days_list:
                             continue
 
-                        send_reminder(user_id, bot_instance)
+                    if reminder_time != current_time:
+                        continue
+
+                    send_reminder(user_id, bot_instance)
 
+                    with with_connection(telegram_id=user_id) as conn:
                         conn.execute('UPDATE reminders SET last_sent = CURRENT_TIMESTAMP WHERE user_id = ?', (user_id,))
 
-                    except Exception as e:
-                        logger.error(f"Error processing reminder for user {reminder.get('user_id')}: {e}")
-                        continue
+                except Exception as e:
+                    logger.error(f"Error processing reminder for user {reminder.get('user_id')}: {e}")
+                    continue
 
         except Exception as e:
             logger.error(f"Error in check_and_send_reminders: {e}")
@@ -117,7 +119,7 @@ def register_reminders_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 reminder = ReminderUtils.get_user_reminder(conn, user_id)
 
                 if not reminder:
@@ -178,7 +180,7 @@ def register_reminders_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 reminder = ReminderUtils.get_user_reminder(conn, user_id)
 
                 if not reminder:
@@ -244,7 +246,7 @@ def register_reminders_handlers(bot):
                 bot.answer_callback_query(call.id, "Неверный формат времени")
                 return
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 success = ReminderUtils.update_reminder(conn, user_id, reminder_time=time_str)
 
                 if success:
@@ -305,7 +307,7 @@ def register_reminders_handlers(bot):
                 bot.register_next_step_handler(msg, process_custom_time)
                 return
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 success = ReminderUtils.update_reminder(conn, user_id, reminder_time=time_str)
 
                 if success:
@@ -323,7 +325,7 @@ def register_reminders_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 reminder = ReminderUtils.get_user_reminder(conn, user_id)
 
                 current_days = []
@@ -415,7 +417,7 @@ def register_reminders_handlers(bot):
             selected_days.sort()
             days_str = ','.join(str(d) for d in selected_days)
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 success = ReminderUtils.update_reminder(conn, user_id, days_of_week=days_str)
 
                 if success:
@@ -456,7 +458,7 @@ def register_reminders_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 reminder = ReminderUtils.get_user_reminder(conn, user_id)
 
                 if not reminder:
@@ -475,6 +477,7 @@ def register_reminders_handlers(bot):
                 stats = cursor.fetchone()
 
                 cards_for_review = CardUtils.get_cards_for_review(conn, user_id, limit=50)
+                forecast = AnalyticsUtils.get_review_forecast(conn, user_id, days=7)
 
             status_emoji = "🔔" if reminder['enabled'] else "🔕"
             status_text = "Включены" if reminder['enabled'] else "Выключены"
@@ -497,6 +500,12 @@ def register_reminders_handlers(bot):
                 if len(cards_for_review) > 5:
                     text += f"... и еще {len(cards_for_review) - 5}\n"
 
+            if forecast:
+                text += "\n*Прогноз повторений на неделю:*\n"
+                for i, day in enumerate(forecast):
+                    label = 'сегодня' if i == 0 else 'завтра' if i == 1 else day['date'].strftime('%d.%m')
+                    text += f"• {label}: {day['count']}\n"
+
             bot.send_message(
                 message.chat.id,
                 text,
@@ -513,7 +522,7 @@ def register_reminders_handlers(bot):
         try:
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 success = ReminderUtils.update_reminder(
                     conn, user_id, enabled=True
                 )
@@ -539,7 +548,7 @@ def register_reminders_handlers(bot):
         try:
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 success = ReminderUtils.update_reminder(
                     conn, user_id, enabled=False
                 )
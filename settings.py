@@ -4,7 +4,7 @@ import csv
 import io
 from datetime import datetime
 from telebot import types
-from database import with_connection, UserUtils, CategoryUtils, CardUtils, ReminderUtils, ExportImportUtils
+from database import with_connection, UserUtils, CategoryUtils, CardUtils, ReminderUtils, ExportImportUtils, due_index, invalidate_forecast
 
 logger = logging.getLogger(__name__)
 
@@ -18,13 +18,13 @@ def register_settings_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 user_stats = UserUtils.get_user_stats(conn, user_id)
                 reminder = ReminderUtils.get_user_reminder(conn, user_id)
                 categories = CategoryUtils.get_user_categories(conn, user_id)
-                cards = CardUtils.get_user_cards(conn, user_id)
+                cards_count = CardUtils.get_card_counts(conn, user_id)['total']
 
-            text = (f"*Настройки бота*\n\n*Ваша статистика:*\n• Карточек: {len(cards)}\n• Категорий: {len(categories)}\n"
+            text = (f"*Настройки бота*\n\n*Ваша статистика:*\n• Карточек: {cards_count}\n• Категорий: {len(categories)}\n"
                     f"• Сессий обучения: {user_stats['total_sessions'] if user_stats else 0}\n"
                     f"• Напоминания: {'🔔 Вкл' if reminder and reminder['enabled'] else '🔕 Выкл'}\n\n"
                     f"*Управление данными:*\nЗдесь вы можете управлять своими карточками,\t"
@@ -68,11 +68,11 @@ def register_settings_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 categories = CategoryUtils.get_user_categories(conn, user_id)
-                cards = CardUtils.get_user_cards(conn, user_id)
+                cards_count = CardUtils.get_card_counts(conn, user_id)['total']
 
-            text = (f"*Экспорт данных*\n\n*Доступные данные:*\n• Карточки: {len(cards)}\n• Категории: {len(categories)}\n"
+            text = (f"*Экспорт данных*\n\n*Доступные данные:*\n• Карточки: {cards_count}\n• Категории: {len(categories)}\n"
                     f"• Настройки и статистика\n\n*Выберите формат экспорта:*")
 
             markup = types.InlineKeyboardMarkup(row_width=2)
@@ -98,22 +98,22 @@ def register_settings_handlers(bot):
         try:
             user_id = call.from_user.id
 
-            with with_connection() as conn:
-                json_data = ExportImportUtils.export_user_data(conn, user_id, format='json')
+            with with_connection(telegram_id=user_id) as conn:
+                file_data = ExportImportUtils.export_user_data_to_file(conn, user_id, format='json')
 
-                if not json_data:
+                if not file_data:
                     bot.answer_callback_query(call.id, "Ошибка при экспорте данных")
                     return
 
             file_name = f"flashcards_backup_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-            file_data = io.BytesIO(json_data.encode('utf-8'))
-            file_data.name = file_name
 
-            bot.send_document(call.message.chat.id, file_data, caption=f"📄 *Экспорт данных в JSON*\n\n"
-                                                                       f"Файл: `{file_name}`\n"
-                                                                       f"Содержит все ваши карточки и категории.\n\n"
-                                                                       f"*Для импорта:* используйте команду /import",
-                              parse_mode='Markdown')
+            with file_data:
+                bot.send_document(call.message.chat.id, file_data, visible_file_name=file_name,
+                                  caption=f"📄 *Экспорт данных в JSON*\n\n"
+                                          f"Файл: `{file_name}`\n"
+                                          f"Содержит все ваши карточки и категории.\n\n"
+                                          f"*Для импорта:* используйте команду /import",
+                                  parse_mode='Markdown')
 
             bot.answer_callback_query(call.id, "Файл отправлен")
 
@@ -127,22 +127,22 @@ def register_settings_handlers(bot):
         try:
             user_id = call.from_user.id
 
-            with with_connection() as conn:
-                csv_data = ExportImportUtils.export_user_data(conn, user_id, format='csv')
+            with with_connection(telegram_id=user_id) as conn:
+                file_data = ExportImportUtils.export_user_data_to_file(conn, user_id, format='csv')
 
-                if not csv_data:
+                if not file_data:
                     bot.answer_callback_query(call.id, "Ошибка при экспорте данных")
                     return
 
             file_name = f"flashcards_export_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-            file_data = io.BytesIO(csv_data.encode('utf-8-sig'))  # utf-8-sig для Excel
-            file_data.name = file_name
 
-            bot.send_document(call.message.chat.id, file_data, caption=f"*Экспорт данных в CSV*\n\n"
-                                                                       f"Файл: `{file_name}`\n"
-                                                                       f"Формат: Вопрос, Ответ, Категория, Статус\n\n"
-                                                                       f"*Можно открыть в:* Excel, Google Sheets, Numbers",
-                              parse_mode='Markdown')
+            with file_data:
+                bot.send_document(call.message.chat.id, file_data, visible_file_name=file_name,
+                                  caption=f"*Экспорт данных в CSV*\n\n"
+                                          f"Файл: `{file_name}`\n"
+                                          f"Формат: Вопрос, Ответ, Категория, Статус\n\n"
+                                          f"*Можно открыть в:* Excel, Google Sheets, Numbers",
+                                  parse_mode='Markdown')
 
             bot.answer_callback_query(call.id, "Файл отправлен")
 
@@ -156,7 +156,7 @@ def register_settings_handlers(bot):
         try:
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 categories = CategoryUtils.get_user_categories(conn, user_id)
                 cards = CardUtils.get_user_cards(conn, user_id)
 
@@ -201,7 +201,7 @@ def register_settings_handlers(bot):
         try:
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 categories = CategoryUtils.get_user_categories(conn, user_id)
 
             text = "*Выборочный экспорт*\n\nВыберите категории для экспорта:"
@@ -275,6 +275,29 @@ def register_settings_handlers(bot):
             logger.error(f"Error in import_json_callback: {e}")
             bot.answer_callback_query(call.id, "Ошибка")
 
+# Начало импорта из CSV или текстового файла
+    @bot.callback_query_handler(func=lambda call: call.data in ['import_csv', 'import_txt'])
+    def import_file_callback(call):
+        try:
+            import_type = call.data.replace('import_', '')
+
+            if import_type == 'csv':
+                text = ("*Импорт из CSV*\n\nОтправьте CSV файл со столбцами:\n`Вопрос, Ответ, Категория`\n\n"
+                        "Столбец категории необязателен.")
+            else:
+                text = "*Импорт из текста*\n\nОтправьте TXT файл, по одной карточке в строке:\n`Вопрос - Ответ`"
+
+            bot.send_message(call.message.chat.id, text, parse_mode='Markdown')
+
+            user_sessions[call.from_user.id] = {'step': f'waiting_{import_type}_file',
+                                                'data': {'import_type': import_type}}
+
+            bot.answer_callback_query(call.id)
+
+        except Exception as e:
+            logger.error(f"Error in import_file_callback: {e}")
+            bot.answer_callback_query(call.id, "Ошибка")
+
 # Обработка загруженных файлов
     @bot.message_handler(content_types=['document'])
     def handle_document(message):
@@ -310,9 +333,10 @@ def register_settings_handlers(bot):
 
             user_sessions[user_id]['data']['file_content'] = content
             user_sessions[user_id]['data']['file_name'] = file_name
+            user_sessions[user_id]['data']['import_type'] = import_type
             user_sessions[user_id]['step'] = 'select_import_category'
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 categories = CategoryUtils.get_user_categories(conn, user_id)
 
             markup = types.InlineKeyboardMarkup(row_width=2)
@@ -336,13 +360,46 @@ def register_settings_handlers(bot):
             logger.error(f"Error in handle_document: {e}")
             bot.send_message(message.chat.id, "Ошибка при обработке файла")
 
+# Импорт загруженного файла в выбранную категорию
+    @bot.callback_query_handler(func=lambda call: call.data.startswith('import_to_category_'))
+    def import_to_category_callback(call):
+        try:
+            user_id = call.from_user.id
+            category_id = int(call.data.replace('import_to_category_', ''))
+
+            if (user_id not in user_sessions or
+                    user_sessions[user_id].get('step') != 'select_import_category' or
+                    'file_content' not in user_sessions[user_id]['data']):
+                bot.answer_callback_query(call.id, "Сессия устарела")
+                return
+
+            session_data = user_sessions[user_id]['data']
+
+            with with_connection(telegram_id=user_id) as conn:
+                imported = ExportImportUtils.import_user_data(conn, user_id, session_data['file_content'],
+                                                              format=session_data['import_type'],
+                                                              default_category_id=category_id)
+
+            del user_sessions[user_id]
+
+            bot.edit_message_text(f"*Импорт завершен*\n\nФайл: {session_data['file_name']}\n"
+                                  f"Импортировано карточек: *{imported['cards']}*\n"
+                                  f"Новых категорий: *{imported['categories']}*",
+                                  call.message.chat.id, call.message.message_id, parse_mode='Markdown')
+
+            bot.answer_callback_query(call.id)
+
+        except Exception as e:
+            logger.error(f"Error in import_to_category_callback: {e}")
+            bot.answer_callback_query(call.id, "Ошибка при импорте")
+
 # Настройки уведомлений
     @bot.message_handler(func=lambda message: message.text == 'Уведомления')
     def notifications_settings(message):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 reminder = ReminderUtils.get_user_reminder(conn, user_id)
 
                 if not reminder:
@@ -381,7 +438,7 @@ def register_settings_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 cursor = conn.execute('''
                                       SELECT username, first_name, last_name, language_code, created_at, last_active
                                       FROM users
@@ -454,7 +511,7 @@ def register_settings_handlers(bot):
         try:
             user_id = message.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 cursor = conn.execute('SELECT COUNT(*) as count FROM cards WHERE user_id = ?', (user_id,))
                 cards_count = cursor.fetchone()['count']
 
@@ -545,7 +602,7 @@ def register_settings_handlers(bot):
         try:
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 cursor = conn.execute('''
                                       SELECT c.id, c.name
                                       FROM categories c
@@ -614,7 +671,7 @@ def register_settings_handlers(bot):
         try:
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 cursor = conn.execute('SELECT COUNT(*) as count FROM cards WHERE user_id = ?', (user_id,))
                 cards_count = cursor.fetchone()['count']
 
@@ -643,7 +700,7 @@ def register_settings_handlers(bot):
         try:
             user_id = call.from_user.id
 
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 conn.execute('''
                              UPDATE cards
                              SET status          = 'learning',
@@ -652,9 +709,11 @@ def register_settings_handlers(bot):
                                  wrong_answers   = 0,
                                  difficulty      = 1,
                                  last_reviewed   = NULL,
-                                 next_review     = NULL
+                                 next_review     = 0
                              WHERE user_id = ?
                              ''', (user_id,))
+                due_index.invalidate(user_id)
+                invalidate_forecast(user_id)
 
             bot.edit_message_text("✅ Прогресс карточек сброшен!\n\n"
                                   "Все карточки теперь помечены как 'изучается'.",
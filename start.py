@@ -17,7 +17,7 @@ def register_start_handlers(bot):
             logger.info(f"User {user_id} (@{username}) started bot")
 
             # Сохраняем/обновляем пользователя в БД
-            with with_connection() as conn:
+            with with_connection(telegram_id=user_id) as conn:
                 UserUtils.create_or_update_user(conn, telegram_id=user_id, username=username, first_name=first_name)
 
             # Создаем клавиатуру главного меню
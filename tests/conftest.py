@@ -0,0 +1,113 @@
+import itertools
+import os
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Модуль database открывает flashcards.db в текущем каталоге при импорте - тесты работают во временном
+os.chdir(tempfile.mkdtemp(prefix='flashcards-tests-'))
+os.environ.setdefault('QUERY_PROFILER_ENABLED', 'false')
+
+_user_ids = itertools.count(1000)
+
+
+# Соединение, которое запоминает выполненные выражения (для проверки планов запросов)
+class RecordingConnection(sqlite3.Connection):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = []
+
+    def execute(self, sql, parameters=()):
+        self.statements.append((sql, parameters))
+        return super().execute(sql, parameters)
+
+    # План выполнения выражения одной строкой
+    def explain(self, sql, parameters=()):
+        rows = super().execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+        return '\n'.join(row[3] for row in rows)
+
+
+# Новый пользователь с дефолтной категорией в своем шарде
+@pytest.fixture
+def user_id():
+    from database import with_connection, UserUtils
+
+    telegram_id = next(_user_ids)
+    with with_connection(telegram_id=telegram_id) as conn:
+        UserUtils.create_or_update_user(conn, telegram_id, f'user{telegram_id}', 'Test')
+    return telegram_id
+
+
+# Быстрое добавление карточек пользователю: make_cards(user_id, count, **колонки) -> список id
+@pytest.fixture
+def make_cards():
+    from database import with_connection, CategoryUtils
+
+    def make(telegram_id, count, category_id=None, **fields):
+        with with_connection(telegram_id=telegram_id) as conn:
+            if category_id is None:
+                category_id = CategoryUtils.get_user_categories(conn, telegram_id)[0]['id']
+
+            columns = ['user_id', 'category_id', 'front', 'back'] + list(fields)
+            rows = [[telegram_id, category_id, f'front {telegram_id} {i}', f'back {i}']
+                    + [value(i) if callable(value) else value for value in fields.values()]
+                    for i in range(count)]
+
+            first = conn.execute('SELECT COALESCE(MAX(id), 0) FROM cards').fetchone()[0]
+            conn.executemany(f'INSERT INTO cards ({", ".join(columns)}) '
+                             f'VALUES ({", ".join("?" * len(columns))})', rows)
+            return [row[0] for row in conn.execute('SELECT id FROM cards WHERE user_id = ? AND id > ? ORDER BY id',
+                                                   (telegram_id, first))]
+
+    return make
+
+
+# Отдельная БД со схемой и всеми миграциями; соединение записывает выполненные запросы
+@pytest.fixture
+def plan_db(tmp_path):
+    from database import DatabaseManager
+
+    path = str(tmp_path / 'plan.db')
+    manager = DatabaseManager(path)
+    manager.close()
+
+    conn = sqlite3.connect(path, factory=RecordingConnection)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute('ATTACH DATABASE ? AS archive', (manager.archive_path,))
+    yield conn
+    conn.close()
+
+
+# Заполнение plan_db: fill_plan_db(conn, users, cards_per_user), одним INSERT ... SELECT на таблицу
+@pytest.fixture
+def fill_plan_db():
+    return _fill_plan_db
+
+
+def _fill_plan_db(conn, users=10, cards_per_user=1000):
+    conn.execute('''
+                 WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                 INSERT INTO users (telegram_id, username) SELECT i, 'user' || i FROM n
+                 ''', (users,))
+    conn.execute('''
+                 WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                 INSERT INTO cards (user_id, category_id, front, back, status, next_review, created_at)
+                 SELECT 1 + i % ?,
+                        (SELECT id FROM categories WHERE user_id = 1 + i % ? LIMIT 1),
+                        'слово ' || i,
+                        'перевод ' || i,
+                        CASE WHEN i % 3 = 0 THEN 'learned' ELSE 'learning' END,
+                        strftime('%s', 'now') + (i % 200 - 100) * 3600,
+                        datetime('now', '-' || (i % 1000) || ' minutes')
+                 FROM n
+                 ''', (users * cards_per_user - 1, users, users))
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.statements.clear()
@@ -0,0 +1,95 @@
+from datetime import date, timedelta
+
+import pytest
+
+from database import ActivityTracker, with_connection
+
+
+@pytest.fixture
+def tracker():
+    tracker = ActivityTracker(flush_interval_ms=60000)
+    yield tracker
+    tracker.close()
+
+
+def activity(telegram_id):
+    with with_connection(telegram_id=telegram_id) as conn:
+        return dict(conn.execute('''
+                                 SELECT CAST(strftime('%s', users.last_active) AS INTEGER) as last_active,
+                                        user_stats.streak_days,
+                                        user_stats.last_study_date
+                                 FROM users
+                                          JOIN user_stats ON user_stats.user_id = users.telegram_id
+                                 WHERE users.telegram_id = ?
+                                 ''', (telegram_id,)).fetchone())
+
+
+def set_streak(telegram_id, streak_days, last_study_date):
+    with with_connection(telegram_id=telegram_id) as conn:
+        conn.execute('UPDATE user_stats SET streak_days = ?, last_study_date = ? WHERE user_id = ?',
+                     (streak_days, last_study_date, telegram_id))
+
+
+# Много обращений одного пользователя между сбросами дают одну запись с последним временем
+def test_touches_coalesce_into_one_write(user_id, tracker):
+    other = user_id + 100000
+    writes = []
+    write = tracker._write
+
+    def record(conn, users, streak_ids):
+        writes.append((users, streak_ids))
+        write(conn, users, streak_ids)
+
+    tracker._write = record
+
+    for _ in range(50):
+        tracker.touch(user_id)
+        tracker.touch(other)
+    last_seen = tracker._seen[user_id]
+    assert tracker.pending() == 2
+
+    assert tracker.flush() == 2
+    assert tracker.pending() == 0
+    assert len(writes) == 1
+    assert sorted(telegram_id for telegram_id, _ in writes[0][0]) == [user_id, other]
+    assert activity(user_id)['last_active'] == int(last_seen)
+    assert tracker.flush() == 0 and len(writes) == 1
+
+
+# Серия дней продлевается при первой записи за день, повторные записи в тот же день ее не трогают
+def test_streak_updated_once_per_day(user_id, tracker):
+    today = date.today()
+    set_streak(user_id, 3, str(today - timedelta(days=1)))
+
+    tracker.touch(user_id)
+    tracker.flush()
+    assert activity(user_id)['streak_days'] == 4
+
+    set_streak(user_id, 3, str(today - timedelta(days=1)))
+    tracker.touch(user_id)
+    tracker.flush()
+    assert activity(user_id)['streak_days'] == 3
+
+    # Перерыв больше дня начинает серию заново
+    fresh = ActivityTracker(flush_interval_ms=60000)
+    set_streak(user_id, 7, str(today - timedelta(days=3)))
+    fresh.touch(user_id)
+    fresh.close()
+    assert activity(user_id)['streak_days'] == 1
+
+
+# Если запись не удалась, отметки возвращаются и уходят при следующем сбросе
+def test_failed_flush_keeps_activity(user_id, tracker, monkeypatch):
+    tracker.touch(user_id)
+    last_seen = tracker._seen[user_id]
+
+    def fail(conn, users, streak_ids):
+        raise RuntimeError('disk I/O error')
+
+    monkeypatch.setattr(tracker, '_write', fail)
+    assert tracker.flush() == 0
+    assert tracker.pending() == 1
+
+    monkeypatch.undo()
+    assert tracker.flush() == 1
+    assert activity(user_id)['last_active'] == int(last_seen)
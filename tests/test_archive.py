@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from database import AnalyticsUtils, MaintenanceUtils, with_connection
+
+
+# Сессии пользователя: по одной на каждое значение days_ago (дней назад)
+def add_sessions(telegram_id, *days_ago):
+    with with_connection(telegram_id=telegram_id) as conn:
+        conn.executemany('''
+                         INSERT INTO study_sessions (user_id, cards_studied, correct_answers, created_at)
+                         VALUES (?, 1, 1, DATETIME('now', ?))
+                         ''', [(telegram_id, f'-{days} days') for days in days_ago])
+
+
+def count_sessions(telegram_id, table):
+    with with_connection(telegram_id=telegram_id) as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM {table} WHERE user_id = ?', (telegram_id,)).fetchone()[0]
+
+
+# Перенос в архив фиксируется сам по себе, даже если вызывающий откатывает свою транзакцию
+def test_archive_commits_independently_of_caller(user_id):
+    add_sessions(user_id, 1, 200, 300)
+
+    with pytest.raises(RuntimeError):
+        with with_connection(telegram_id=user_id) as conn:
+            conn.execute('SELECT COUNT(*) FROM study_sessions').fetchone()
+            result = MaintenanceUtils.cleanup_old_data(conn, user_id, days_old=180)
+            raise RuntimeError
+
+    assert result['archived_sessions'] == 2
+    assert count_sessions(user_id, 'main.study_sessions') == 1
+    assert count_sessions(user_id, 'archive.study_sessions') == 2
+
+
+# Если вызывающий сам пишет в этот шард, перенос сразу отказывается, а не ждет блокировку до busy_timeout
+def test_archive_inside_write_transaction_fails_fast(user_id):
+    add_sessions(user_id, 200)
+
+    with with_connection(telegram_id=user_id) as conn:
+        conn.execute("UPDATE users SET username = 'changed' WHERE telegram_id = ?", (user_id,))
+        started = time.monotonic()
+        result = MaintenanceUtils.cleanup_old_data(conn, user_id, days_old=180)
+        elapsed = time.monotonic() - started
+
+    assert result['archived_sessions'] == 0 and elapsed < 1
+    assert count_sessions(user_id, 'main.study_sessions') == 1
+
+
+# Архив читается только тогда, когда окно days доходит до архивных сессий
+def test_sessions_read_archive_only_when_window_reaches_it(user_id):
+    add_sessions(user_id, 1, 2, 200, 300)
+    assert MaintenanceUtils.archive_old_sessions(days_old=180, telegram_id=user_id) == 2
+
+    statements = []
+    with with_connection(telegram_id=user_id) as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            recent = AnalyticsUtils.get_sessions(conn, user_id, days=30)
+            recent_reads_archive = any('FROM archive.study_sessions WHERE user_id' in sql for sql in statements)
+
+            statements.clear()
+            year = AnalyticsUtils.get_sessions(conn, user_id, days=365)
+            year_reads_archive = any('FROM archive.study_sessions WHERE user_id' in sql for sql in statements)
+
+            everything = AnalyticsUtils.get_sessions(conn, user_id)
+        finally:
+            conn.set_trace_callback(None)
+
+    assert len(recent) == 2 and not recent_reads_archive
+    assert len(year) == 4 and year_reads_archive
+    assert len(everything) == 4
+    assert [session['created_at'] for session in everything] == sorted(
+        (session['created_at'] for session in everything), reverse=True)
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+
+import pytest
+
+from database import CardUtils, CategoryUtils, category_cache, with_connection
+
+benchmark = pytest.mark.skipif(not os.getenv('RUN_BENCHMARKS'), reason='set RUN_BENCHMARKS=1 to run benchmarks')
+
+
+# Пользователь 1 в plan_db с categories категориями (включая созданную триггером) по cards_per_category карточек
+def fill_categories(conn, categories, cards_per_category):
+    conn.execute("INSERT INTO users (telegram_id) VALUES (1)")
+    conn.execute('''
+                 WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                 INSERT INTO categories (user_id, name) SELECT 1, 'Категория ' || i FROM n WHERE i < ?
+                 ''', (categories, categories))
+    conn.execute('''
+                 INSERT INTO cards (user_id, category_id, front, back, status, difficulty, next_review)
+                 SELECT 1, cat.id, 'слово', 'перевод',
+                        CASE WHEN n.i % 2 THEN 'learned' ELSE 'learning' END, 1 + n.i % 5,
+                        strftime('%s', 'now') + (n.i % 3 - 1) * 3600
+                 FROM categories cat,
+                      (WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+                       SELECT i FROM n) n
+                 ''', (cards_per_category,))
+    conn.commit()
+    conn.statements.clear()
+
+
+# Сводка по категориям - одно выражение при любом числе категорий, счетчики совпадают с подсчетом по карточкам
+@pytest.mark.parametrize('categories', [1, 150])
+def test_summary_is_one_query(plan_db, categories):
+    fill_categories(plan_db, categories, 6)
+
+    summary = CategoryUtils.get_categories_summary(plan_db, 1)
+
+    assert len(plan_db.statements) == 1
+    assert len(summary) == categories
+    now = time.time()
+    for category in summary:
+        cards = CardUtils.get_user_cards(plan_db, 1, category_id=category['id'])
+        assert category['total'] == len(cards)
+        assert category['learned'] == sum(card['status'] == 'learned' for card in cards)
+        assert category['due'] == sum(card['status'] == 'learning' and card['next_review'] <= now for card in cards)
+        assert category['avg_difficulty'] == pytest.approx(sum(card['difficulty'] for card in cards) / len(cards))
+
+
+def category_names(telegram_id):
+    with with_connection(telegram_id=telegram_id) as conn:
+        return sorted(category['name'] for category in CategoryUtils.get_user_categories(conn, telegram_id))
+
+
+# Создание, переименование и удаление категории сразу видны в следующем чтении через кэш
+def test_category_changes_visible_through_cache(user_id):
+    before = category_names(user_id)
+    with with_connection(telegram_id=user_id) as conn:
+        category_id = CategoryUtils.create_category(conn, user_id, 'Новая')
+    assert category_names(user_id) == sorted(before + ['Новая'])
+
+    with with_connection(telegram_id=user_id) as conn:
+        CategoryUtils.update_category(conn, category_id, name='Другая')
+    assert category_names(user_id) == sorted(before + ['Другая'])
+
+    with with_connection(telegram_id=user_id) as conn:
+        CategoryUtils.delete_category(conn, category_id)
+    assert category_names(user_id) == before
+
+
+# Внутри транзакции изменение сразу видно через кэш, а после отката кэш снова отдает прежний список
+def test_change_visible_inside_transaction_and_dropped_on_rollback(user_id):
+    before = category_names(user_id)
+
+    with pytest.raises(RuntimeError):
+        with with_connection(telegram_id=user_id) as conn:
+            CategoryUtils.create_category(conn, user_id, 'Новая')
+            assert category_names(user_id) == sorted(before + ['Новая'])
+            raise RuntimeError
+
+    assert category_names(user_id) == before
+
+
+# Чтение из другого потока до коммита закэширует старый список, но сброс после коммита его уберет
+def test_read_during_uncommitted_create_is_not_cached(user_id):
+    before = category_names(user_id)
+    with with_connection(telegram_id=user_id) as conn:
+        CategoryUtils.create_category(conn, user_id, 'Новая')
+        reader = threading.Thread(target=lambda: seen.append(category_names(user_id)))
+        seen = []
+        reader.start()
+        reader.join()
+
+    assert seen == [before]
+    assert category_names(user_id) == sorted(before + ['Новая'])
+
+
+# Список, прочитанный до коммита, но сохраняемый в кэш после сброса, отбрасывается
+def test_read_finished_after_commit_is_not_cached(user_id, monkeypatch):
+    before = category_names(user_id)
+    category_cache.pop(user_id)
+    original_set = category_cache.set
+    reading, release = threading.Event(), threading.Event()
+
+    def slow_set(*args, **kwargs):
+        reading.set()
+        release.wait(5)
+        return original_set(*args, **kwargs)
+
+    monkeypatch.setattr(category_cache, 'set', slow_set)
+    seen = []
+    reader = threading.Thread(target=lambda: seen.append(category_names(user_id)))
+    reader.start()
+    assert reading.wait(5)
+    monkeypatch.setattr(category_cache, 'set', original_set)
+
+    with with_connection(telegram_id=user_id) as conn:
+        CategoryUtils.create_category(conn, user_id, 'Новая')
+    release.set()
+    reader.join()
+
+    assert seen == [before]
+    assert category_names(user_id) == sorted(before + ['Новая'])
+
+
+# До/после: сводка одним запросом против запроса на каждую категорию (150 категорий)
+@benchmark
+def test_summary_benchmark(plan_db):
+    fill_categories(plan_db, 150, 200)
+
+    started = time.perf_counter()
+    for _ in range(20):
+        CategoryUtils.get_categories_summary(plan_db, 1)
+    grouped = (time.perf_counter() - started) / 20 * 1000
+    grouped_queries = len(plan_db.statements) // 20
+
+    plan_db.statements.clear()
+    started = time.perf_counter()
+    for _ in range(20):
+        for category in CategoryUtils.get_user_categories(plan_db, 1):
+            cards = CardUtils.get_user_cards(plan_db, 1, category_id=category['id'])
+            sum(card['status'] == 'learned' for card in cards)
+    per_category = (time.perf_counter() - started) / 20 * 1000
+    per_category_queries = len(plan_db.statements) // 20
+
+    print(f"\n150 categories: {grouped:.2f} ms / {grouped_queries} query grouped, "
+          f"{per_category:.2f} ms / {per_category_queries} queries per category")
+    assert grouped < per_category
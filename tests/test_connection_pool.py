@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from database import DatabaseManager
+
+benchmark = pytest.mark.skipif(not os.getenv('RUN_BENCHMARKS'), reason='set RUN_BENCHMARKS=1 to run benchmarks')
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = DatabaseManager(str(tmp_path / 'pool.db'), pool_size=2)
+    yield manager
+    manager.close()
+
+
+# Поток получает одно и то же соединение, PRAGMA применены при открытии
+def test_connection_is_reused_per_thread(manager):
+    with manager.get_connection() as first:
+        pass
+    with manager.get_connection() as second:
+        assert second is first
+        assert second.execute('PRAGMA foreign_keys').fetchone()[0] == 1
+        assert second.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+    seen = []
+    thread = threading.Thread(target=lambda: seen.append(manager.pool.acquire()[0]))
+    thread.start()
+    thread.join()
+    assert seen[0] is not first
+    assert manager.pool.size() == 2
+
+
+# Вложенные вызовы в одном потоке идут в одну транзакцию
+def test_nested_connections_share_transaction(manager):
+    with pytest.raises(RuntimeError):
+        with manager.get_connection() as outer:
+            outer.execute("INSERT INTO users (telegram_id) VALUES (1)")
+            with manager.get_connection() as inner:
+                assert inner is outer
+                inner.execute("INSERT INTO users (telegram_id) VALUES (2)")
+            raise RuntimeError
+
+    with manager.get_connection() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 0
+
+
+# Сломанное соединение заменяется при выдаче, закрытый пул новых соединений не выдает
+def test_broken_connection_is_reopened_and_pool_closes(manager):
+    with manager.get_connection() as conn:
+        pass
+    conn.close()
+
+    with manager.get_connection() as reopened:
+        assert reopened is not conn
+        assert reopened.execute('SELECT 1').fetchone()[0] == 1
+
+    manager.pool.close_all()
+    assert manager.pool.size() == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        manager.pool.acquire()
+
+
+# Сверх max_size живых потоков выдаются временные соединения, которые закрываются при возврате
+def test_overflow_connections_are_temporary(manager):
+    # Одно постоянное соединение уже у главного потока (инициализация БД), второе займет holder
+    ready, release = threading.Event(), threading.Event()
+
+    def hold():
+        manager.pool.acquire()
+        ready.set()
+        release.wait()
+
+    holder = threading.Thread(target=hold, daemon=True)
+    holder.start()
+    ready.wait()
+
+    result = []
+
+    def overflow():
+        conn, pooled = manager.pool.acquire()
+        manager.pool.release(conn, pooled)
+        try:
+            conn.execute('SELECT 1')
+            result.append((pooled, True))
+        except sqlite3.ProgrammingError:
+            result.append((pooled, False))
+
+    try:
+        thread = threading.Thread(target=overflow)
+        thread.start()
+        thread.join()
+    finally:
+        release.set()
+        holder.join()
+
+    assert result == [(False, False)]
+    assert manager.pool.size() == 2
+
+
+# До/после: операции в секунду через пул против нового соединения на каждый вызов
+@benchmark
+def test_pool_benchmark(manager):
+    with manager.get_connection() as conn:
+        conn.execute("INSERT INTO users (telegram_id) VALUES (1)")
+
+    query = 'SELECT * FROM user_stats WHERE user_id = ?'
+    iterations = 5000
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with manager.get_connection() as conn:
+            conn.execute(query, (1,)).fetchone()
+    pooled = iterations / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        conn = manager.pool._open()
+        conn.execute(query, (1,)).fetchone()
+        conn.commit()
+        conn.close()
+    per_call = iterations / (time.perf_counter() - started)
+
+    print(f"\nconnection pool: {pooled:.0f} ops/s pooled, {per_call:.0f} ops/s open-per-call")
+    assert pooled > per_call
+
+
+# Переключение профилирования переоткрывает соединение потока с нужным классом при следующей выдаче
+def test_profiler_toggle_switches_connection_class(manager, monkeypatch):
+    from database import ProfiledConnection, query_profiler
+
+    monkeypatch.setattr(query_profiler, 'enabled', False)
+    with manager.get_connection() as plain:
+        assert not isinstance(plain, ProfiledConnection)
+
+    query_profiler.enabled = True
+    with manager.get_connection() as profiled:
+        assert isinstance(profiled, ProfiledConnection)
+        with manager.get_connection() as nested:
+            assert nested is profiled
+
+    query_profiler.enabled = False
+    with manager.get_connection() as conn:
+        assert not isinstance(conn, ProfiledConnection)
+    assert manager.pool.size() == 1
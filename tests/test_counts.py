@@ -0,0 +1,37 @@
+import time
+
+from database import CardUtils, CategoryUtils, with_connection
+
+
+# Счетчики совпадают с подсчетом по самим карточкам, в том числе по одной категории
+def test_counts_match_cards(user_id, make_cards):
+    now = int(time.time())
+    with with_connection(telegram_id=user_id) as conn:
+        other = CategoryUtils.create_category(conn, user_id, 'Другая')
+    make_cards(user_id, 12, status=lambda i: 'learned' if i % 3 == 0 else 'learning',
+               next_review=lambda i: now + (i % 4 - 2) * 3600)
+    make_cards(user_id, 5, category_id=other, next_review=now - 60)
+
+    with with_connection(telegram_id=user_id) as conn:
+        for category_id in (None, other):
+            cards = CardUtils.get_user_cards(conn, user_id, category_id=category_id)
+            counts = CardUtils.get_card_counts(conn, user_id, category_id=category_id)
+
+            assert counts == {
+                'total': len(cards),
+                'learned': sum(card['status'] == 'learned' for card in cards),
+                'learning': sum(card['status'] == 'learning' for card in cards),
+                'due': sum(card['status'] == 'learning' and card['next_review'] <= now for card in cards),
+            }
+        assert CardUtils.get_card_counts(conn, 1) == {'total': 0, 'learned': 0, 'learning': 0, 'due': 0}
+
+
+# Подсчет по колоде - одно выражение по покрывающему индексу, строки карточек не читаются
+def test_counts_use_covering_index(plan_db, fill_plan_db):
+    fill_plan_db(plan_db, users=5, cards_per_user=400)
+
+    counts = CardUtils.get_card_counts(plan_db, 1)
+    sql, params = plan_db.statements[-1]
+
+    assert len(plan_db.statements) == 1 and counts['total'] == 400
+    assert 'USING COVERING INDEX idx_cards_due (user_id=?)' in plan_db.explain(sql, params)
@@ -0,0 +1,126 @@
+import random
+import threading
+import time
+
+import pytest
+
+from database import CardUtils, CategoryUtils, due_index, review_buffer, with_connection
+
+
+@pytest.fixture(autouse=True)
+def index_enabled(monkeypatch):
+    monkeypatch.setattr(due_index, 'enabled', True)
+    due_index.clear()
+    yield
+    review_buffer.flush()
+
+
+def due_cards(telegram_id, indexed=True, limit=100):
+    enabled = due_index.enabled
+    due_index.enabled = indexed
+    try:
+        with with_connection(telegram_id=telegram_id) as conn:
+            return CardUtils.get_cards_for_review(conn, telegram_id, limit=limit)
+    finally:
+        due_index.enabled = enabled
+
+
+def snapshot(cards):
+    return [(card['id'], card['front'], card['category_name'], card['status'], card['difficulty'],
+             card['review_count'], card['correct_answers'], card['next_review']) for card in cards]
+
+
+# Индекс после ответов (через буфер и напрямую), правок и удалений выдает то же, что запрос к БД
+def test_index_matches_sql_path(user_id, make_cards, monkeypatch):
+    rnd = random.Random(21)
+    now = int(time.time())
+    card_ids = make_cards(user_id, 80,
+                          status=lambda i: rnd.choice(['learning', 'learning', 'learned']),
+                          difficulty=lambda i: rnd.randint(1, 5),
+                          review_count=lambda i: rnd.randint(0, 6),
+                          correct_answers=lambda i: rnd.randint(0, 3),
+                          next_review=lambda i: now + rnd.randint(-7200, 7200))
+    assert snapshot(due_cards(user_id)) == snapshot(due_cards(user_id, indexed=False))
+
+    for step in range(60):
+        card_id = rnd.choice(card_ids)
+        action = rnd.choice(['buffered', 'direct', 'update', 'delete', 'create'])
+        if action in ('buffered', 'direct'):
+            monkeypatch.setattr(review_buffer, 'enabled', action == 'buffered')
+            CardUtils.record_review(user_id, card_id, rnd.random() < 0.6)
+        elif action == 'update':
+            with with_connection(telegram_id=user_id) as conn:
+                CardUtils.update_card(conn, card_id, front=f'front {step}',
+                                      status=rnd.choice(['learning', 'learned']))
+        elif action == 'delete':
+            with with_connection(telegram_id=user_id) as conn:
+                CardUtils.delete_card(conn, card_id)
+            card_ids.remove(card_id)
+        else:
+            with with_connection(telegram_id=user_id) as conn:
+                category_id = CategoryUtils.get_user_categories(conn, user_id)[0]['id']
+                card_ids.append(CardUtils.create_card(conn, user_id, f'new {step}', 'back', category_id))
+
+        indexed = due_cards(user_id)
+        review_buffer.flush()
+        assert snapshot(indexed) == snapshot(due_cards(user_id, indexed=False)), (step, action)
+
+
+# Прогрев из другого потока во время незакоммиченной правки не остается в индексе после коммита
+def test_warmup_during_uncommitted_change_is_not_kept(user_id, make_cards):
+    card_id, = make_cards(user_id, 1, next_review=int(time.time()) - 60)
+    seen = []
+
+    with with_connection(telegram_id=user_id) as conn:
+        CardUtils.update_card(conn, card_id, status='learned')
+        reader = threading.Thread(target=lambda: seen.append([card['id'] for card in due_cards(user_id)]))
+        reader.start()
+        reader.join()
+
+    assert seen == [[card_id]]
+    assert due_cards(user_id) == []
+
+
+# Внутри транзакции индекс отражает ее изменения, после отката - снова прежнее состояние
+def test_change_visible_inside_transaction_and_dropped_on_rollback(user_id, make_cards):
+    card_id, = make_cards(user_id, 1, next_review=int(time.time()) - 60)
+    assert [card['id'] for card in due_cards(user_id)] == [card_id]
+
+    with pytest.raises(RuntimeError):
+        with with_connection(telegram_id=user_id) as conn:
+            CardUtils.update_card(conn, card_id, status='learned')
+            assert due_cards(user_id) == []
+            raise RuntimeError
+
+    assert [card['id'] for card in due_cards(user_id)] == [card_id]
+
+
+# Прямой вызов update_card_after_review обновляет индекс после коммита
+def test_update_after_review_updates_index(user_id, make_cards):
+    card_id, = make_cards(user_id, 1, next_review=int(time.time()) - 60)
+    assert [card['id'] for card in due_cards(user_id)] == [card_id]
+
+    with with_connection(telegram_id=user_id) as conn:
+        CardUtils.update_card_after_review(conn, card_id, False)
+        assert [card['id'] for card in due_cards(user_id)] == [card_id]
+
+    assert due_cards(user_id) == []
+    assert due_cards(user_id, indexed=False) == []
+
+
+# Прогрев читает только поля расписания, полные строки - только у выбранных карточек
+def test_warmup_reads_schedule_columns_only(user_id, make_cards):
+    make_cards(user_id, 30, next_review=int(time.time()) - 60)
+    statements = []
+
+    with with_connection(telegram_id=user_id) as conn:
+        conn.set_trace_callback(statements.append)
+        try:
+            cards = CardUtils.get_cards_for_review(conn, user_id, limit=5)
+        finally:
+            conn.set_trace_callback(None)
+
+    warmup = [sql for sql in statements if 'WHERE user_id' in sql and 'FROM cards' in sql]
+    assert len(cards) == 5 and len(warmup) == 1
+    assert '*' not in warmup[0] and 'categories' not in warmup[0]
+    assert any('c.id IN (' in sql for sql in statements)
@@ -0,0 +1,63 @@
+import csv
+import io
+import json
+
+import pytest
+
+from database import ExportImportUtils, with_connection
+
+
+def export(telegram_id, format, batch_size=2):
+    output = io.StringIO()
+    with with_connection(telegram_id=telegram_id) as conn:
+        count = ExportImportUtils.write_user_export(conn, telegram_id, output, format=format, batch_size=batch_size)
+    return count, output.getvalue()
+
+
+# Потоковый JSON (в том числе через границы порций и для пустой колоды) совпадает с обычным экспортом
+@pytest.mark.parametrize('cards', [0, 1, 5])
+def test_streamed_json_matches_export(user_id, make_cards, cards):
+    make_cards(user_id, cards)
+
+    count, streamed = export(user_id, 'json')
+    with with_connection(telegram_id=user_id) as conn:
+        expected = json.loads(ExportImportUtils.export_user_data(conn, user_id))
+    data = json.loads(streamed)
+
+    assert count == cards
+    for key in ('user_id', 'format_version', 'categories', 'reminder', 'user_stats'):
+        assert data[key] == expected[key]
+    assert sorted(card['id'] for card in data['cards']) == sorted(card['id'] for card in expected['cards'])
+    assert data['cards'] == sorted(expected['cards'], key=lambda card: (card['created_at'], card['id']), reverse=True)
+
+
+# NDJSON: строка meta, затем категории и карточки, каждая строка - отдельный JSON
+def test_ndjson_lines(user_id, make_cards):
+    make_cards(user_id, 3)
+
+    count, streamed = export(user_id, 'ndjson')
+    lines = [json.loads(line) for line in streamed.splitlines()]
+
+    assert count == 3
+    assert lines[0]['type'] == 'meta' and lines[0]['user_id'] == user_id
+    assert [line['type'] for line in lines[1:]] == ['category', 'card', 'card', 'card']
+
+
+# CSV: заголовок и по строке на карточку; файл для отправки - с BOM для Excel
+def test_csv_rows_and_file(user_id, make_cards):
+    make_cards(user_id, 3)
+
+    count, streamed = export(user_id, 'csv')
+    rows = list(csv.reader(io.StringIO(streamed)))
+
+    assert count == 3 and len(rows) == 4 and rows[0][:3] == ['Front', 'Back', 'Category']
+    assert sorted(row[0] for row in rows[1:]) == [f'front {user_id} {i}' for i in range(3)]
+
+    with with_connection(telegram_id=user_id) as conn:
+        file_data = ExportImportUtils.export_user_data_to_file(conn, user_id, format='csv')
+    assert file_data.read().decode('utf-8-sig').replace('\r\n', '\n') == streamed.replace('\r\n', '\n')
+
+
+def test_unsupported_format_raises(user_id):
+    with pytest.raises(ValueError):
+        export(user_id, 'xml')
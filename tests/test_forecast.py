@@ -0,0 +1,73 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import AnalyticsUtils, CardUtils, review_buffer, with_connection
+
+DAY = 86400
+
+
+# Часовой пояс, в котором местная полночь не совпадает с полночью UTC
+@pytest.fixture
+def local_timezone(monkeypatch):
+    monkeypatch.setenv('TZ', 'Asia/Vladivostok')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def forecast(telegram_id, days=7):
+    with with_connection(telegram_id=telegram_id) as conn:
+        return [day['count'] for day in AnalyticsUtils.get_review_forecast(conn, telegram_id, days)]
+
+
+# Дни отсчитываются от местной полуночи; просроченные карточки попадают в день 0
+def test_forecast_buckets_by_local_day(user_id, make_cards, local_timezone):
+    start = AnalyticsUtils._forecast_start()
+    assert datetime.fromtimestamp(start) == datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    due = [0, start - 30 * DAY, start - 1, start, start + DAY - 1, start + DAY, start + 6 * DAY + DAY - 1,
+           start + 7 * DAY]
+    make_cards(user_id, len(due), next_review=lambda i: due[i])
+    make_cards(user_id, 2, next_review=start, status='learned')
+
+    with with_connection(telegram_id=user_id) as conn:
+        days = AnalyticsUtils.get_review_forecast(conn, user_id)
+    assert [day['count'] for day in days] == [5, 1, 0, 0, 0, 0, 1]
+    assert [day['date'] for day in days] == [datetime.now().date() + timedelta(days=i) for i in range(7)]
+
+
+# Прогноз из кэша сбрасывается при добавлении, изменении, ответе, удалении карточки и сбросе прогресса
+def test_forecast_follows_card_changes(user_id, make_cards):
+    start = AnalyticsUtils._forecast_start()
+    card_id, = make_cards(user_id, 1, next_review=start + 3 * DAY)
+    assert forecast(user_id) == [0, 0, 0, 1, 0, 0, 0]
+
+    with with_connection(telegram_id=user_id) as conn:
+        CardUtils.update_card(conn, card_id, status='learned')
+    assert forecast(user_id) == [0] * 7
+
+    CardUtils.record_review(user_id, card_id, False)
+    review_buffer.flush()
+    assert forecast(user_id) == [1, 0, 0, 0, 0, 0, 0]
+
+    with with_connection(telegram_id=user_id) as conn:
+        category_id = conn.execute('SELECT category_id FROM cards WHERE id = ?', (card_id,)).fetchone()[0]
+        CardUtils.create_card(conn, user_id, 'новая', 'карточка', category_id)
+        CardUtils.delete_card(conn, card_id)
+    assert sum(forecast(user_id)) == 1
+
+
+# Запись в кэш, прочитанная до отката транзакции с изменением, не переживает ее
+def test_forecast_inside_rolled_back_transaction(user_id, make_cards):
+    card_id, = make_cards(user_id, 1, next_review=AnalyticsUtils._forecast_start() + 2 * DAY)
+    assert forecast(user_id)[2] == 1
+
+    with pytest.raises(RuntimeError):
+        with with_connection(telegram_id=user_id) as conn:
+            CardUtils.delete_card(conn, card_id)
+            assert forecast(user_id)[2] == 0
+            raise RuntimeError
+    assert forecast(user_id)[2] == 1
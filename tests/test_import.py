@@ -0,0 +1,94 @@
+from database import CardUtils, CategoryUtils, ExportImportUtils, UserUtils, with_connection
+
+
+def deck(telegram_id):
+    with with_connection(telegram_id=telegram_id) as conn:
+        return sorted((card['front'], card['back'], card['category_name'])
+                      for card in CardUtils.get_user_cards(conn, telegram_id))
+
+
+def category_names(telegram_id):
+    with with_connection(telegram_id=telegram_id) as conn:
+        return sorted(category['name'] for category in CategoryUtils.get_user_categories(conn, telegram_id))
+
+
+# Карточки вставляются одним проходом, категории по имени создаются один раз (без учета регистра),
+# строки без вопроса или ответа пропускаются и категорий не создают
+def test_bulk_create_skips_empty_rows_before_creating_categories(user_id):
+    categories = category_names(user_id)
+    cards = [{'front': 'a', 'back': '1', 'category': 'Глаголы'},
+             {'front': 'b', 'back': '2', 'category': 'глаголы'},
+             {'front': ' ', 'back': 'x', 'category': 'Empty'},
+             {'front': 'c', 'back': '', 'category': 'Пустая'},
+             {'front': 'd', 'back': '4'}]
+
+    with with_connection(telegram_id=user_id) as conn:
+        default_id = CategoryUtils.get_user_categories(conn, user_id)[0]['id']
+        assert CardUtils.bulk_create_cards(conn, user_id, cards, default_category_id=default_id) == 3
+
+    assert category_names(user_id) == sorted(categories + ['Глаголы'])
+    assert deck(user_id) == [('a', '1', 'Глаголы'), ('b', '2', 'Глаголы'), ('d', '4', categories[0])]
+
+
+# Ошибка в одной строке откатывает весь импорт до точки сохранения, но не транзакцию вызывающего
+def test_failing_row_rolls_back_savepoint(user_id):
+    categories = category_names(user_id)
+    cards = [{'front': 'a', 'back': '1', 'category': 'Новая'},
+             {'front': 'b', 'back': '2', 'category_id': 999999999}]
+
+    with with_connection(telegram_id=user_id) as conn:
+        conn.execute("UPDATE users SET username = 'kept' WHERE telegram_id = ?", (user_id,))
+        assert CardUtils.bulk_create_cards(conn, user_id, cards) == 0
+
+    assert deck(user_id) == []
+    assert category_names(user_id) == categories
+    with with_connection(telegram_id=user_id) as conn:
+        assert conn.execute('SELECT username FROM users WHERE telegram_id = ?', (user_id,)).fetchone()[0] == 'kept'
+
+
+# CSV: заголовок и короткие строки пропускаются, кавычки и запятые внутри поля разбираются
+def test_parse_csv():
+    data = 'Вопрос,Ответ,Категория\n"hello, world",привет,Фразы\nодин\ncat,кошка\n,x,Empty\n'
+
+    assert list(ExportImportUtils._parse_csv(data)) == [
+        {'front': 'hello, world', 'back': 'привет', 'category': 'Фразы'},
+        {'front': 'cat', 'back': 'кошка', 'category': None},
+        {'front': '', 'back': 'x', 'category': 'Empty'},
+    ]
+
+
+# TXT: одна карточка на строку, делится по первому " - "
+def test_parse_txt():
+    data = 'dog - собака\nбез разделителя\nwell-known - известный - знакомый\n'
+
+    assert list(ExportImportUtils._parse_txt(data)) == [
+        {'front': 'dog', 'back': 'собака'},
+        {'front': 'well-known', 'back': 'известный - знакомый'},
+    ]
+
+
+# JSON-экспорт одного пользователя импортируется другому: категории пересоздаются, карточки
+# переносятся в них по новым id; созданные категории и карточки считаются отдельно
+def test_json_round_trip_remaps_categories(user_id):
+    source = user_id
+    target = user_id + 500000
+    with with_connection(telegram_id=target) as conn:
+        UserUtils.create_or_update_user(conn, target, 'target')
+
+    with with_connection(telegram_id=source) as conn:
+        verbs = CategoryUtils.create_category(conn, source, 'Глаголы')
+        nouns = CategoryUtils.create_category(conn, source, 'Существительные')
+        CardUtils.bulk_create_cards(conn, source, [{'front': 'run', 'back': 'бежать', 'category_id': verbs},
+                                                   {'front': 'go', 'back': 'идти', 'category_id': verbs},
+                                                   {'front': 'cat', 'back': 'кошка', 'category_id': nouns}])
+        exported = ExportImportUtils.export_user_data(conn, source)
+
+    with with_connection(telegram_id=target) as conn:
+        imported = ExportImportUtils.import_user_data(conn, target, exported)
+
+    assert imported == {'categories': 2, 'cards': 3}
+    assert deck(target) == deck(source)
+    assert category_names(target) == category_names(source)
+    with with_connection(telegram_id=target) as conn:
+        target_categories = {c['id'] for c in CategoryUtils.get_user_categories(conn, target)}
+        assert {card['category_id'] for card in CardUtils.get_user_cards(conn, target)} <= target_categories
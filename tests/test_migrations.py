@@ -0,0 +1,142 @@
+import sqlite3
+import time
+from datetime import datetime
+
+from database import DatabaseManager
+
+# Схема до введения версионированных миграций (PRAGMA user_version = 0)
+BASELINE_SCHEMA = '''
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id INTEGER UNIQUE NOT NULL, username TEXT, first_name TEXT,
+    last_name TEXT, language_code TEXT DEFAULT 'ru', created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    last_active DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE categories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, name TEXT NOT NULL, description TEXT,
+    color TEXT DEFAULT '#3498db', created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (telegram_id) ON DELETE CASCADE
+);
+CREATE TABLE cards (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, front TEXT NOT NULL, back TEXT NOT NULL,
+    category_id INTEGER NOT NULL, status TEXT DEFAULT 'learning', difficulty INTEGER DEFAULT 1,
+    last_reviewed DATETIME, next_review DATETIME, review_count INTEGER DEFAULT 0,
+    correct_answers INTEGER DEFAULT 0, wrong_answers INTEGER DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (telegram_id) ON DELETE CASCADE,
+    FOREIGN KEY (category_id) REFERENCES categories (id) ON DELETE CASCADE
+);
+CREATE TABLE reminders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, enabled BOOLEAN DEFAULT 1,
+    reminder_time TIME DEFAULT '20:00', timezone TEXT DEFAULT 'Europe/Moscow',
+    days_of_week TEXT DEFAULT '1,2,3,4,5,6,7', last_sent DATETIME, next_sent DATETIME,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP, updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (telegram_id) ON DELETE CASCADE
+);
+CREATE TABLE study_sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, cards_studied INTEGER DEFAULT 0,
+    correct_answers INTEGER DEFAULT 0, wrong_answers INTEGER DEFAULT 0, session_duration INTEGER DEFAULT 0,
+    session_type TEXT DEFAULT 'manual', created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (telegram_id) ON DELETE CASCADE
+);
+CREATE TABLE user_stats (
+    id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE NOT NULL, total_cards INTEGER DEFAULT 0,
+    learned_cards INTEGER DEFAULT 0, total_study_time INTEGER DEFAULT 0, total_sessions INTEGER DEFAULT 0,
+    correct_answers INTEGER DEFAULT 0, wrong_answers INTEGER DEFAULT 0, streak_days INTEGER DEFAULT 0,
+    last_study_date DATE, created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (telegram_id) ON DELETE CASCADE
+);
+CREATE INDEX idx_cards_user_id ON cards(user_id);
+CREATE INDEX idx_cards_next_review ON cards(next_review);
+CREATE INDEX idx_study_sessions_user_id ON study_sessions(user_id);
+'''
+
+TRIGGERS = {'cards_fts_insert', 'cards_fts_delete', 'cards_fts_update', 'user_stats_card_insert',
+            'user_stats_card_delete', 'user_stats_card_status', 'user_stats_session_insert',
+            'daily_stats_session_insert', 'users_default_data'}
+INDEXES = {'idx_cards_due', 'idx_cards_user_created', 'idx_study_sessions_user_created',
+           'idx_quiz_sessions_updated', 'idx_cards_user_success_rate', 'idx_cards_category_success_rate'}
+
+
+# БД в том виде, в каком ее оставляла версия без миграций: next_review строкой в локальном времени,
+# пользователи и их категории без триггера, user_stats только у одного пользователя и с устаревшими
+# счетчиками карточек (счетчики сессий старый код вел сам)
+def make_baseline_db(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany('INSERT INTO users (telegram_id, username) VALUES (?, ?)', [(1, 'first'), (2, 'second')])
+    conn.executemany('INSERT INTO categories (id, user_id, name) VALUES (?, ?, ?)',
+                     [(1, 1, 'По умолчанию'), (2, 2, 'По умолчанию')])
+    conn.executemany('''
+                     INSERT INTO cards (user_id, category_id, front, back, status, next_review)
+                     VALUES (?, ?, ?, ?, ?, ?)
+                     ''', [(1, 1, 'apple', 'яблоко', 'learning', '2024-03-01 10:30:00'),
+                           (1, 1, 'pear', 'груша', 'learned', None),
+                           (2, 2, 'plum', 'слива', 'learning', '2024-03-02 08:00:00')])
+    conn.execute('''
+                 INSERT INTO user_stats (user_id, total_cards, learned_cards, total_sessions, total_study_time,
+                                         correct_answers, wrong_answers)
+                 VALUES (1, 10, 10, 2, 90, 5, 3)
+                 ''')
+    conn.executemany('''
+                     INSERT INTO study_sessions (user_id, cards_studied, correct_answers, wrong_answers,
+                                                 session_duration, created_at)
+                     VALUES (1, ?, ?, ?, ?, ?)
+                     ''', [(6, 4, 2, 60, '2024-03-01 09:00:00'), (2, 1, 1, 30, '2024-03-01 18:00:00')])
+    conn.commit()
+    conn.close()
+
+
+def local_epoch(value):
+    return int(time.mktime(datetime.strptime(value, '%Y-%m-%d %H:%M:%S').timetuple()))
+
+
+# Открытие старой БД прогоняет все миграции по порядку и переносит данные в новый формат
+def test_baseline_database_is_migrated_to_latest_version(tmp_path):
+    path = str(tmp_path / 'baseline.db')
+    make_baseline_db(path)
+
+    DatabaseManager(path).close()
+
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == DatabaseManager.MIGRATIONS[-1][0]
+
+    next_review = dict(conn.execute('SELECT front, next_review FROM cards'))
+    assert next_review == {'apple': local_epoch('2024-03-01 10:30:00'), 'pear': 0,
+                           'plum': local_epoch('2024-03-02 08:00:00')}
+
+    found = conn.execute("SELECT rowid FROM cards_fts WHERE cards_fts MATCH 'груш'").fetchall()
+    assert [row[0] for row in found] == [2]
+
+    stats = {row['user_id']: dict(row) for row in conn.execute('SELECT * FROM user_stats')}
+    assert (stats[1]['total_cards'], stats[1]['learned_cards']) == (2, 1)
+    assert (stats[1]['total_sessions'], stats[1]['total_study_time']) == (2, 90)
+    assert (stats[2]['total_cards'], stats[2]['learned_cards'], stats[2]['total_sessions']) == (1, 0, 0)
+
+    daily = [dict(row) for row in conn.execute('SELECT * FROM daily_stats')]
+    assert daily == [{'user_id': 1, 'date': '2024-03-01', 'sessions': 2, 'cards_studied': 8,
+                      'correct_answers': 5, 'wrong_answers': 3, 'total_time': 90,
+                      'accuracy_sum': 4 * 100.0 / 6 + 50.0, 'accuracy_sessions': 2}]
+
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('trigger', 'index')")}
+    assert TRIGGERS <= names and INDEXES <= names
+    conn.close()
+
+
+# Повторное открытие уже мигрированной БД ничего не меняет
+def test_reopening_migrated_database_is_noop(tmp_path):
+    path = str(tmp_path / 'baseline.db')
+    make_baseline_db(path)
+    DatabaseManager(path).close()
+
+    def snapshot():
+        conn = sqlite3.connect(path)
+        dump = list(conn.iterdump())
+        conn.close()
+        return dump
+
+    before = snapshot()
+    DatabaseManager(path).close()
+    assert snapshot() == before
@@ -0,0 +1,46 @@
+from database import CardUtils, with_connection
+
+
+def page(telegram_id, cursor=None, direction='next', limit=5):
+    with with_connection(telegram_id=telegram_id) as conn:
+        cards, next_cursor, prev_cursor = CardUtils.get_user_cards_page(conn, telegram_id, cursor=cursor,
+                                                                        direction=direction, limit=limit)
+    return [card['id'] for card in cards], next_cursor, prev_cursor
+
+
+# Курсор переживает кодирование и помещается в callback_data кнопки (до 64 байт) вместе с префиксом
+def test_cursor_round_trip_fits_callback_data():
+    card = {'created_at': '2024-12-31 23:59:59', 'id': 9_999_999_999}
+    cursor = CardUtils._encode_cursor(card)
+
+    assert CardUtils._decode_cursor(cursor) == ('2024-12-31 23:59:59', 9_999_999_999)
+    assert len(f'cards_page_9999_n_{cursor}'.encode('utf-8')) <= 64
+    assert f'cards_page_2_p_{cursor}'.replace('cards_page_', '').split('_', 2)[2] == cursor
+
+
+# Испорченный курсор не ломает выдачу: возвращается первая страница
+def test_invalid_cursor_falls_back_to_first_page(user_id, make_cards):
+    make_cards(user_id, 7)
+
+    assert CardUtils._decode_cursor('не курсор') is None
+    assert CardUtils._decode_cursor('Zm9v') is None
+    assert page(user_id, cursor='Zm9v') == page(user_id)
+
+
+# Границы: ровно limit карточек - одна страница без курсоров; limit + 1 - вторая страница из одной карточки
+def test_page_boundaries(user_id, make_cards):
+    assert page(user_id) == ([], None, None)
+
+    ids = make_cards(user_id, 5, created_at='2024-01-01 00:00:00')
+    first, next_cursor, prev_cursor = page(user_id)
+    assert first == sorted(ids, reverse=True) and next_cursor is None and prev_cursor is None
+
+    extra, = make_cards(user_id, 1, created_at='2023-12-31 00:00:00')
+    first, next_cursor, prev_cursor = page(user_id)
+    assert first == sorted(ids, reverse=True) and next_cursor and prev_cursor is None
+
+    last, last_next, last_prev = page(user_id, next_cursor)
+    assert last == [extra] and last_next is None and last_prev
+
+    back, back_next, back_prev = page(user_id, last_prev, 'prev')
+    assert back == first and back_next and back_prev is None
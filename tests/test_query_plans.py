@@ -0,0 +1,209 @@
+import os
+import time
+
+import pytest
+
+from database import CardUtils, due_index
+
+# Замеры на больших объемах запускаются только по RUN_BENCHMARKS=1
+benchmark = pytest.mark.skipif(not os.getenv('RUN_BENCHMARKS'), reason='set RUN_BENCHMARKS=1 to run benchmarks')
+
+
+# Выражение, выполненное функцией последним среди тех, что читают из указанной таблицы
+def last_query(conn, marker):
+    return [statement for statement in conn.statements if marker in statement[0]][-1]
+
+
+# Карточки к повторению выбираются диапазоном по idx_cards_due, без полного просмотра карточек
+def test_due_query_uses_composite_index(plan_db, fill_plan_db, monkeypatch):
+    monkeypatch.setattr(due_index, 'enabled', False)
+    fill_plan_db(plan_db, users=20, cards_per_user=500)
+
+    cards = CardUtils.get_cards_for_review(plan_db, 1, limit=20)
+    plan = plan_db.explain(*last_query(plan_db, 'FROM cards c'))
+
+    assert cards
+    assert 'USING INDEX idx_cards_due (user_id=? AND status=? AND next_review<?)' in plan
+    assert 'SCAN c' not in plan.splitlines()
+
+
+# next_review хранится как unix-время, текстовые значения старой схемы переводятся миграцией
+def test_due_migration_converts_next_review_to_epoch(plan_db):
+    from database import DatabaseManager
+
+    plan_db.execute("INSERT INTO users (telegram_id) VALUES (1)")
+    category_id = plan_db.execute('SELECT id FROM categories WHERE user_id = 1').fetchone()[0]
+    plan_db.execute("INSERT INTO cards (user_id, category_id, front, back, next_review) "
+                    "VALUES (1, ?, 'a', 'b', '2030-01-01 00:00:00'), (1, ?, 'c', 'd', NULL)",
+                    (category_id, category_id))
+
+    DatabaseManager._migration_due_index(None, plan_db)
+
+    rows = plan_db.execute('SELECT typeof(next_review), next_review FROM cards ORDER BY id').fetchall()
+    assert [row[0] for row in rows] == ['integer', 'integer']
+    assert rows[0][1] > time.time() and rows[1][1] == 0
+
+
+# До/после на 1M карточек: выборка по idx_cards_due против прежнего пути по idx_cards_user_id
+@benchmark
+def test_due_query_benchmark(plan_db, fill_plan_db, monkeypatch):
+    monkeypatch.setattr(due_index, 'enabled', False)
+    fill_plan_db(plan_db, users=1000, cards_per_user=1000)
+
+    CardUtils.get_cards_for_review(plan_db, 1, limit=20)
+    sql, params = last_query(plan_db, 'FROM cards c')
+    assert 'idx_cards_due' in plan_db.explain(sql, params)
+
+    old_sql = sql.replace('FROM cards c', 'FROM cards c INDEXED BY idx_cards_user_id', 1)
+    timings = {}
+    for name, query in (('idx_cards_due', sql), ('idx_cards_user_id', old_sql)):
+        started = time.perf_counter()
+        for telegram_id in range(1, 201):
+            plan_db.execute(query, (telegram_id,) + tuple(params[1:])).fetchall()
+        timings[name] = (time.perf_counter() - started) / 200 * 1000
+
+    print(f"\ndue query, 1M cards: {timings['idx_cards_due']:.3f} ms with idx_cards_due, "
+          f"{timings['idx_cards_user_id']:.3f} ms with idx_cards_user_id")
+    assert timings['idx_cards_due'] < timings['idx_cards_user_id']
+
+
+# Поиск идет через cards_fts, карточки подтягиваются по первичному ключу; кириллица без учета регистра
+def test_search_uses_fts_index(plan_db, fill_plan_db):
+    fill_plan_db(plan_db, users=5, cards_per_user=400)
+
+    results = CardUtils.search_cards(plan_db, 1, 'СЛОВО 10', limit=10)
+    plan = plan_db.explain(*last_query(plan_db, 'cards_fts'))
+
+    assert results and all('слово 10' in card['front'] for card in results)
+    assert 'SCAN cards_fts VIRTUAL TABLE INDEX' in plan
+    assert 'SEARCH c USING INTEGER PRIMARY KEY' in plan
+    assert 'SCAN c' not in plan.splitlines()
+
+
+# До/после на колоде в 50k карточек: FTS5 против LIKE '%q%'
+@benchmark
+def test_search_benchmark(plan_db, fill_plan_db):
+    fill_plan_db(plan_db, users=1, cards_per_user=50000)
+
+    timings = {}
+    for name, search in (('fts', CardUtils.search_cards), ('like', None)):
+        started = time.perf_counter()
+        for i in range(100):
+            query = f'слово {i * 397 % 50000}'
+            if search:
+                search(plan_db, 1, query, limit=10)
+            else:
+                plan_db.execute('SELECT id FROM cards WHERE user_id = ? AND (front LIKE ? OR back LIKE ?) '
+                                'ORDER BY front LIMIT 10', (1, f'%{query}%', f'%{query}%')).fetchall()
+        timings[name] = (time.perf_counter() - started) / 100 * 1000
+
+    print(f"\nsearch, 50k cards: {timings['fts']:.3f} ms FTS5, {timings['like']:.3f} ms LIKE")
+    assert timings['fts'] < timings['like']
+
+
+# Страница по курсору - диапазон по idx_cards_user_created без сортировки и без пропуска строк
+def test_keyset_page_uses_index(plan_db, fill_plan_db):
+    fill_plan_db(plan_db, users=5, cards_per_user=400)
+
+    pages, cursor = [], None
+    for _ in range(6):
+        cards, cursor, prev_cursor = CardUtils.get_user_cards_page(plan_db, 1, cursor=cursor, limit=10)
+        pages.append([card['id'] for card in cards])
+    deep = plan_db.explain(*last_query(plan_db, 'FROM cards c'))
+
+    back, _, _ = CardUtils.get_user_cards_page(plan_db, 1, cursor=prev_cursor, direction='prev', limit=10)
+    previous = plan_db.explain(*last_query(plan_db, 'FROM cards c'))
+
+    assert [card['id'] for card in back] == pages[-2]
+    for plan in (deep, previous):
+        assert 'SEARCH c USING INDEX idx_cards_user_created (user_id=? AND created_at' in plan
+        assert 'USE TEMP B-TREE FOR ORDER BY' not in plan
+
+
+# Страницы по курсору не повторяются и не пропускают карточки, в том числе при равном created_at
+def test_keyset_pages_cover_deck_once(plan_db, fill_plan_db):
+    fill_plan_db(plan_db, users=2, cards_per_user=95)
+
+    seen, cursor = [], None
+    while True:
+        cards, cursor, _ = CardUtils.get_user_cards_page(plan_db, 1, cursor=cursor, limit=10)
+        seen.extend(card['id'] for card in cards)
+        if not cursor:
+            break
+
+    expected = [row[0] for row in plan_db.execute(
+        'SELECT id FROM cards WHERE user_id = 1 ORDER BY created_at DESC, id DESC')]
+    assert seen == expected
+
+
+# Глубокая страница стоит столько же, сколько первая (OFFSET для сравнения)
+@benchmark
+def test_keyset_benchmark(plan_db, fill_plan_db):
+    fill_plan_db(plan_db, users=1, cards_per_user=100000)
+
+    cursor = None
+    for _ in range(9000):
+        _, cursor, _ = CardUtils.get_user_cards_page(plan_db, 1, cursor=cursor, limit=10)
+
+    timings = {}
+    for name, call in (('first', lambda: CardUtils.get_user_cards_page(plan_db, 1, limit=10)),
+                       ('keyset', lambda: CardUtils.get_user_cards_page(plan_db, 1, cursor=cursor, limit=10)),
+                       ('offset', lambda: CardUtils.get_user_cards(plan_db, 1, limit=10, offset=90000))):
+        started = time.perf_counter()
+        for _ in range(50):
+            call()
+        timings[name] = (time.perf_counter() - started) / 50 * 1000
+
+    print(f"\npage 9001 of 100k cards: {timings['keyset']:.3f} ms keyset, {timings['offset']:.3f} ms OFFSET, "
+          f"page 1: {timings['first']:.3f} ms")
+    assert timings['keyset'] < timings['offset']
+
+
+# Выборка при id пользователя вперемешку с чужими: k чтений по позиции в индексе, без проб и ORDER BY random()
+def test_sample_reads_by_position_with_interleaved_users(plan_db, fill_plan_db):
+    fill_plan_db(plan_db, users=50, cards_per_user=200)
+
+    sampled = CardUtils.sample_cards(plan_db, 7, 10)
+    statements = list(plan_db.statements)
+    plan = plan_db.explain(*last_query(plan_db, 'OFFSET'))
+
+    owners = {row[0] for row in plan_db.execute(
+        f"SELECT user_id FROM cards WHERE id IN ({','.join('?' * len(sampled))})", sampled)}
+    assert len(set(sampled)) == 10 and owners == {7}
+    assert len(statements) == 11
+    assert not any('random()' in statement[0] for statement in statements)
+    assert 'idx_cards_user_id (user_id=? AND rowid>?)' in plan and 'TEMP B-TREE' not in plan
+
+
+# Каждая карточка пользователя (в том числе с фильтром по статусу) выпадает примерно одинаково часто
+def test_sample_is_uniform_with_interleaved_users(plan_db, fill_plan_db):
+    fill_plan_db(plan_db, users=30, cards_per_user=30)
+    learning = {row[0] for row in plan_db.execute("SELECT id FROM cards WHERE user_id = 3 AND status = 'learning'")}
+
+    counts = {}
+    for _ in range(400):
+        for card_id in CardUtils.sample_cards(plan_db, 3, 5, status='learning'):
+            counts[card_id] = counts.get(card_id, 0) + 1
+
+    assert set(counts) == learning
+    expected = 400 * 5 / len(learning)
+    assert all(0.5 * expected < count < 1.5 * expected for count in counts.values())
+
+
+# До/после на 1M карточек вперемешку у 10 пользователей: выборка по позиции против ORDER BY random()
+@benchmark
+def test_sample_benchmark(plan_db, fill_plan_db):
+    fill_plan_db(plan_db, users=10, cards_per_user=100000)
+
+    timings = {}
+    for name, call in (('position', lambda user: CardUtils.sample_cards(plan_db, user, 10)),
+                       ('random', lambda user: plan_db.execute(
+                           'SELECT id FROM cards WHERE user_id = ? ORDER BY random() LIMIT 10', (user,)).fetchall())):
+        started = time.perf_counter()
+        for i in range(50):
+            call(1 + i % 10)
+        timings[name] = (time.perf_counter() - started) / 50 * 1000
+
+    print(f"\nsample 10 of 100k interleaved cards: {timings['position']:.3f} ms by position, "
+          f"{timings['random']:.3f} ms ORDER BY random()")
+    assert timings['position'] < timings['random']
@@ -0,0 +1,40 @@
+from database import CardUtils, CategoryUtils, review_buffer, with_connection
+
+DECK_COLUMNS = ('difficulty', 'status', 'review_count', 'correct_answers', 'wrong_answers')
+
+
+# Колода сессии читается порциями по 500 id; удаленные карточки в колоду не попадают
+def test_cards_by_ids_loads_deck_in_chunks(plan_db, fill_plan_db):
+    fill_plan_db(plan_db, users=3, cards_per_user=400)
+    card_ids = [row[0] for row in plan_db.execute('SELECT id FROM cards WHERE user_id = 2 ORDER BY id')]
+    plan_db.execute('DELETE FROM cards WHERE id = ?', (card_ids[10],))
+
+    start = len(plan_db.statements)
+    deck = CardUtils.get_cards_by_ids(plan_db, card_ids + card_ids[:200])
+    assert len(plan_db.statements) - start == 2
+
+    assert sorted(deck) == card_ids[:10] + card_ids[11:]
+    card = deck[card_ids[0]]
+    assert card['front'] == 'слово 1' and card['category_name'] is not None
+    assert set(DECK_COLUMNS) <= set(card)
+    assert CardUtils.get_cards_by_ids(plan_db, []) == {}
+
+
+# record_review обновляет карточку в колоде тем же расчетом, который уходит в БД
+def test_record_review_keeps_deck_in_sync(user_id, make_cards):
+    card_ids = make_cards(user_id, 3)
+    with with_connection(telegram_id=user_id) as conn:
+        deck = CardUtils.get_cards_by_ids(conn, card_ids)
+        category = CategoryUtils.get_user_categories(conn, user_id)[0]['name']
+    assert {card['category_name'] for card in deck.values()} == {category}
+
+    for card_id, answers in zip(card_ids, ([True, True], [False], [True, False, True])):
+        for is_correct in answers:
+            CardUtils.record_review(user_id, card_id, is_correct, deck[card_id])
+    review_buffer.flush()
+
+    with with_connection(telegram_id=user_id) as conn:
+        stored = CardUtils.get_cards_by_ids(conn, card_ids)
+    for card_id in card_ids:
+        assert {c: deck[card_id][c] for c in DECK_COLUMNS} == {c: stored[card_id][c] for c in DECK_COLUMNS}
+        assert abs(deck[card_id]['next_review'] - stored[card_id]['next_review']) <= 1
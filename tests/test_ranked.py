@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from database import CardUtils, CategoryUtils, SUCCESS_RATE_SQL, with_connection
+
+# (верных, неверных) для карточек пользователя: доли 0, 0.25, 0.3, 0.5, 0.7, 0.75, 1 и карточка без ответов
+ANSWERS = [(0, 3), (1, 3), (3, 7), (1, 1), (7, 3), (3, 1), (2, 0), (0, 0)]
+
+
+@pytest.fixture
+def ranked(user_id, make_cards):
+    with with_connection(telegram_id=user_id) as conn:
+        default = CategoryUtils.get_user_categories(conn, user_id)[0]['id']
+        other = CategoryUtils.create_category(conn, user_id, 'Другая')
+    now = int(time.time())
+    card_ids = make_cards(user_id, len(ANSWERS), category_id=default,
+                          correct_answers=lambda i: ANSWERS[i][0], wrong_answers=lambda i: ANSWERS[i][1],
+                          next_review=lambda i: now - 60 if i % 2 else now + 3600)
+    other_ids = make_cards(user_id, 2, category_id=other, correct_answers=1, wrong_answers=lambda i: 3 * i)
+    return user_id, card_ids, other_ids, other
+
+
+def ranked_ids(telegram_id, **kwargs):
+    with with_connection(telegram_id=telegram_id) as conn:
+        return [card['id'] for card in CardUtils.get_ranked_cards(conn, telegram_id, limit=100, **kwargs)]
+
+
+# Сложные карточки идут по возрастанию доли верных ответов, легкие - по убыванию; карточки без ответов пропускаются
+def test_ranked_direction(ranked):
+    user_id, card_ids, other_ids, _ = ranked
+    hardest = ranked_ids(user_id)
+    with with_connection(telegram_id=user_id) as conn:
+        rates = [card['success_rate'] for card in CardUtils.get_ranked_cards(conn, user_id, limit=100)]
+
+    assert rates == sorted(rates) and len(hardest) == len(card_ids) - 1 + len(other_ids)
+    assert card_ids[-1] not in hardest
+    assert ranked_ids(user_id, hardest=False) == hardest[::-1]
+    # При равной доле порядок задает id в том же направлении
+    assert hardest[0] == card_ids[0] and hardest[-2:] == [card_ids[6], other_ids[0]]
+
+
+# Фильтры по категории, границам доли (min включительно, max нет) и по карточкам на сегодня
+def test_ranked_filters(ranked):
+    user_id, card_ids, other_ids, other = ranked
+
+    assert sorted(ranked_ids(user_id, category_id=other)) == other_ids
+    assert sorted(ranked_ids(user_id, min_rate=CardUtils.EASY_MIN_RATE)) == card_ids[4:7] + other_ids[:1]
+    assert sorted(ranked_ids(user_id, max_rate=CardUtils.HARD_MAX_RATE)) == card_ids[:2] + other_ids[1:]
+    assert sorted(ranked_ids(user_id, min_rate=0.3, max_rate=0.75)) == card_ids[2:5]
+    assert sorted(ranked_ids(user_id, due_only=True)) == [card_ids[1], card_ids[3], card_ids[5]] + other_ids
+
+
+# Счетчики для кнопок «Только легкие» и «Только сложные» совпадают с тем, что эти кнопки выберут
+@pytest.mark.parametrize('due_only', [False, True])
+def test_ranked_counts_match_selection(ranked, due_only):
+    user_id, _, _, other = ranked
+
+    for category_id in (None, other):
+        with with_connection(telegram_id=user_id) as conn:
+            counts = CardUtils.get_ranked_counts(conn, user_id, category_id=category_id, due_only=due_only)
+        assert counts == {
+            'rated': len(ranked_ids(user_id, category_id=category_id, due_only=due_only)),
+            'easy': len(ranked_ids(user_id, category_id=category_id, due_only=due_only,
+                                   min_rate=CardUtils.EASY_MIN_RATE)),
+            'hard': len(ranked_ids(user_id, category_id=category_id, due_only=due_only,
+                                   max_rate=CardUtils.HARD_MAX_RATE)),
+        }
+
+
+# Сортировка и границы доли идут по индексам выражения миграции 9, без временного B-дерева
+def test_ranked_query_uses_expression_index(plan_db, fill_plan_db):
+    fill_plan_db(plan_db, users=10, cards_per_user=300)
+    plan_db.execute('UPDATE cards SET correct_answers = id % 7, wrong_answers = 3')
+
+    assert CardUtils.get_ranked_cards(plan_db, 3, limit=10, max_rate=CardUtils.HARD_MAX_RATE)
+    statement = [s for s in plan_db.statements if 'ORDER BY' in s[0] and SUCCESS_RATE_SQL in s[0]][-1]
+    plan = plan_db.explain(*statement)
+    assert 'idx_cards_user_success_rate' in plan and 'TEMP B-TREE' not in plan
+
+    category_id = plan_db.execute('SELECT id FROM categories WHERE user_id = 3').fetchone()[0]
+    CardUtils.get_ranked_cards(plan_db, 3, limit=10, hardest=False, category_id=category_id)
+    statement = [s for s in plan_db.statements if 'ORDER BY' in s[0] and SUCCESS_RATE_SQL in s[0]][-1]
+    plan = plan_db.explain(*statement)
+    assert 'idx_cards_category_success_rate' in plan and 'TEMP B-TREE' not in plan
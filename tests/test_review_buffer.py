@@ -0,0 +1,91 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from database import CardUtils, ReviewBuffer, db_manager, with_connection
+
+
+@pytest.fixture
+def buffer():
+    buffer = ReviewBuffer(max_items=100, max_delay_ms=60000)
+    yield buffer
+    buffer.close()
+
+
+def card_state(card_id, telegram_id):
+    with with_connection(telegram_id=telegram_id) as conn:
+        return dict(conn.execute('''
+                                 SELECT review_count, correct_answers, wrong_answers, difficulty, status, next_review,
+                                        CAST(strftime('%s', last_reviewed) AS INTEGER) as last_reviewed
+                                 FROM cards
+                                 WHERE id = ?
+                                 ''', (card_id,)).fetchone())
+
+
+# Несколько ответов по одной карточке в одной порции применяются по порядку, как при записи по одному
+def test_answers_applied_in_order(user_id, make_cards, buffer):
+    card_id, = make_cards(user_id, 1)
+    answers = [True, True, False, True, False]
+
+    expected = {'review_count': 0, 'correct_answers': 0, 'wrong_answers': 0, 'difficulty': 3, 'status': 'learning'}
+    for is_correct in answers:
+        buffer.add(user_id, card_id, is_correct)
+    timestamps = [entry[3] for entry in buffer._pending]
+    for is_correct, timestamp in zip(answers, timestamps):
+        expected.update(CardUtils._apply_review(expected, is_correct, datetime.fromtimestamp(timestamp)))
+
+    assert buffer.flush() == len(answers)
+    state = card_state(card_id, user_id)
+    assert state == dict(expected, last_reviewed=int(timestamps[-1]))
+    assert state['next_review'] == int(timestamps[-1]) + CardUtils.RETRY_SECONDS
+
+
+# Порция записывается сама по достижении max_items
+def test_flush_on_max_items(user_id, make_cards):
+    buffer = ReviewBuffer(max_items=3, max_delay_ms=60000)
+    try:
+        card_ids = make_cards(user_id, 3)
+        buffer.add(user_id, card_ids[0], True)
+        buffer.add(user_id, card_ids[1], True)
+        assert buffer.pending() == 2 and card_state(card_ids[0], user_id)['review_count'] == 0
+
+        buffer.add(user_id, card_ids[2], True)
+        assert buffer.pending() == 0
+        assert [card_state(card_id, user_id)['review_count'] for card_id in card_ids] == [1, 1, 1]
+    finally:
+        buffer.close()
+
+
+# Неудачная запись возвращает ответы в начало очереди, перед пришедшими позже, и порядок сохраняется
+def test_failed_flush_keeps_order(user_id, make_cards, buffer, monkeypatch):
+    card_id, = make_cards(user_id, 1)
+    writer = db_manager.shard_for(user_id).writer
+    submit = writer.submit
+
+    def failing_submit(func, *args, **kwargs):
+        raise RuntimeError('disk is full')
+
+    buffer.add(user_id, card_id, True)
+    buffer.add(user_id, card_id, False)
+    monkeypatch.setattr(writer, 'submit', failing_submit)
+    assert buffer.flush() == 0
+    monkeypatch.setattr(writer, 'submit', submit)
+
+    buffer.add(user_id, card_id, True)
+    assert [entry[2] for entry in buffer._pending] == [True, False, True]
+
+    assert buffer.flush() == 3
+    state = card_state(card_id, user_id)
+    assert (state['review_count'], state['correct_answers'], state['wrong_answers']) == (3, 2, 1)
+    assert state['next_review'] > time.time() + CardUtils.RETRY_SECONDS
+
+
+# Остановка буфера записывает оставшиеся ответы
+def test_close_flushes(user_id, make_cards):
+    card_id, = make_cards(user_id, 1)
+    buffer = ReviewBuffer(max_items=100, max_delay_ms=60000)
+    buffer.add(user_id, card_id, False)
+
+    assert buffer.close() == 1
+    assert card_state(card_id, user_id)['wrong_answers'] == 1
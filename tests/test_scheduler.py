@@ -0,0 +1,106 @@
+import random
+
+import pytest
+
+from database import CardUtils, SchedulerUtils, np, review_buffer, with_connection
+
+
+def schedule(telegram_id):
+    with with_connection(telegram_id=telegram_id) as conn:
+        return {row['id']: (row['difficulty'], row['status'], row['next_review'], row['last_reviewed'])
+                for row in conn.execute('''
+                                        SELECT id, difficulty, status, next_review,
+                                               CAST(strftime('%s', last_reviewed) AS INTEGER) as last_reviewed
+                                        FROM cards
+                                        WHERE user_id = ?
+                                        ''', (telegram_id,))}
+
+
+# Карточки, на которые отвечали через буфер и напрямую, верно и неверно; возвращает id с последним неверным ответом
+@pytest.fixture
+def reviewed(user_id, make_cards, monkeypatch):
+    rnd = random.Random(22)
+    card_ids = make_cards(user_id, 40)
+    last_wrong = set()
+    for _ in range(200):
+        card_id = rnd.choice(card_ids)
+        is_correct = rnd.random() < 0.7
+        buffered = rnd.random() < 0.5
+        if not buffered:
+            review_buffer.flush()
+        monkeypatch.setattr(review_buffer, 'enabled', buffered)
+        CardUtils.record_review(user_id, card_id, is_correct)
+        (last_wrong.discard if is_correct else last_wrong.add)(card_id)
+    review_buffer.flush()
+    assert last_wrong
+    return user_id, last_wrong
+
+
+# По неизменным правилам пересчет совпадает с расчетом после ответа и ничего не меняет, сколько его ни запускай
+def test_reschedule_with_unchanged_rules_is_noop(reviewed):
+    user_id, _ = reviewed
+    before = schedule(user_id)
+
+    first = SchedulerUtils.reschedule_cards(telegram_id=user_id)
+    second = SchedulerUtils.reschedule_cards(telegram_id=user_id)
+
+    assert first['cards'] > 0
+    assert first['updated'] == 0 and second['updated'] == 0
+    assert schedule(user_id) == before
+
+
+# Новые интервалы переносят повторение в обе стороны, но не отменяют повтор через 10 минут после ошибки
+@pytest.mark.parametrize('scale', [0.5, 2])
+def test_new_intervals_move_cards_and_keep_retry(reviewed, monkeypatch, scale):
+    user_id, last_wrong = reviewed
+    before = schedule(user_id)
+    monkeypatch.setattr(CardUtils, 'BASE_INTERVALS',
+                        {level: days * scale for level, days in CardUtils.BASE_INTERVALS.items()})
+
+    first = SchedulerUtils.reschedule_cards(telegram_id=user_id)
+    after = schedule(user_id)
+    second = SchedulerUtils.reschedule_cards(telegram_id=user_id)
+
+    assert first['updated'] > 0 and second['updated'] == 0
+    for card_id, (_, _, next_review, last_reviewed) in after.items():
+        if card_id in last_wrong:
+            assert next_review == before[card_id][2] == last_reviewed + CardUtils.RETRY_SECONDS
+        elif last_reviewed is not None:
+            # Интервалы ограничены MAX_INTERVAL_DAYS, поэтому часть карточек остается на месте
+            assert (next_review - before[card_id][2]) * (scale - 1) >= 0
+
+
+# Изученная карточка теряет статус по новым порогам, только если последний ответ был неверным
+def test_status_demoted_only_after_wrong_answer(user_id, make_cards, monkeypatch):
+    monkeypatch.setattr(review_buffer, 'enabled', False)
+    wrong_last, correct_last = make_cards(user_id, 2)
+    for card_id, answers in ((wrong_last, [True] * 6 + [False]), (correct_last, [True] * 6)):
+        for is_correct in answers:
+            CardUtils.record_review(user_id, card_id, is_correct)
+    assert {schedule(user_id)[card_id][1] for card_id in (wrong_last, correct_last)} == {'learned'}
+
+    monkeypatch.setattr(CardUtils, 'LEARNED_MIN_RATE', 0.95)
+    SchedulerUtils.reschedule_cards(telegram_id=user_id)
+    after = schedule(user_id)
+    assert after[wrong_last][1] == 'learning' and after[correct_last][1] == 'learned'
+
+
+# Векторный и построчный расчет дают одинаковые обновления
+@pytest.mark.skipif(np is None, reason='NumPy is not installed')
+def test_numpy_and_python_passes_agree():
+    rnd = random.Random(7)
+    count = 5000
+    columns = [list(range(1, count + 1)),
+               [rnd.randint(1, 5) for _ in range(count)],
+               [rnd.randint(1, 20) for _ in range(count)],
+               [rnd.randint(0, 10) for _ in range(count)],
+               [rnd.randint(0, 10) for _ in range(count)],
+               [rnd.random() < 0.3 for _ in range(count)],
+               [rnd.choice([None, 1700000000 + rnd.randint(0, 10 ** 7)]) for _ in range(count)],
+               [rnd.choice([None, 0, 1700000000 + rnd.randint(0, 10 ** 8)]) for _ in range(count)]]
+    # Часть карточек ждет повтора после неверного ответа
+    for i in range(0, count, 3):
+        if columns[6][i] is not None:
+            columns[7][i] = columns[6][i] + CardUtils.RETRY_SECONDS
+
+    assert SchedulerUtils._compute_numpy(*columns) == SchedulerUtils._compute_python(*columns)
@@ -0,0 +1,44 @@
+from database import CardUtils, with_connection
+
+
+def fts_ids(conn, query):
+    return sorted(row[0] for row in conn.execute('SELECT rowid FROM cards_fts WHERE cards_fts MATCH ?',
+                                                 (f'"{query}"',)))
+
+
+def search_ids(telegram_id, query):
+    with with_connection(telegram_id=telegram_id) as conn:
+        return sorted(card['id'] for card in CardUtils.search_cards(conn, telegram_id, query))
+
+
+# Индекс cards_fts следует за изменением и удалением карточек (триггеры), совпадая с таблицей cards
+def test_fts_follows_update_and_delete(user_id, make_cards):
+    first, second = make_cards(user_id, 2)
+    with with_connection(telegram_id=user_id) as conn:
+        CardUtils.update_card(conn, first, front='яблоко', back='apple')
+        CardUtils.update_card(conn, second, back='грушевый')
+
+    with with_connection(telegram_id=user_id) as conn:
+        assert fts_ids(conn, 'яблоко') == [first]
+        assert fts_ids(conn, f'front {user_id} 0') == []
+        assert fts_ids(conn, 'грушев') == [second]
+        assert fts_ids(conn, f'front {user_id} 1') == [second]
+    assert search_ids(user_id, 'ЯБЛОК') == [first]
+
+    with with_connection(telegram_id=user_id) as conn:
+        CardUtils.delete_card(conn, first)
+
+    with with_connection(telegram_id=user_id) as conn:
+        assert fts_ids(conn, 'яблоко') == []
+        conn.execute("INSERT INTO cards_fts (cards_fts, rank) VALUES ('integrity-check', 1)")
+    assert search_ids(user_id, 'яблоко') == []
+
+
+# Изменение других полей карточки индекс не трогает, поиск по-прежнему находит ее
+def test_fts_untouched_by_other_columns(user_id, make_cards):
+    card_id, = make_cards(user_id, 1)
+    with with_connection(telegram_id=user_id) as conn:
+        CardUtils.update_card(conn, card_id, status='learned')
+        conn.execute("INSERT INTO cards_fts (cards_fts, rank) VALUES ('integrity-check', 1)")
+
+    assert search_ids(user_id, f'front {user_id} 0') == [card_id]
@@ -0,0 +1,41 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from database import SQLiteSessionStore
+
+
+@pytest.fixture
+def store():
+    store = SQLiteSessionStore(max_size=10, ttl=3600)
+    yield store
+    store.close()
+
+
+def stored_data(store, session_id):
+    with store.shard.get_connection() as conn:
+        row = conn.execute('SELECT data FROM quiz_sessions WHERE session_id = ?', (session_id,)).fetchone()
+        return row[0] if row else None
+
+
+# Сессия сохраняется в JSON и читается обратно без потерь: int-ключи карточек и время начала
+def test_session_round_trips_as_json(store):
+    session = {'user_id': 1, 'card_ids': [3, 7], 'current_index': 0, 'current_card_id': 3,
+               'cards': {3: {'id': 3, 'front': 'слово', 'next_review': 0}, 7: {'id': 7, 'front': 'b', 'next_review': 1}},
+               'start_time': datetime(2024, 5, 1, 12, 30, 15, 250), 'session_type': 'all'}
+
+    store.save('1_json', session)
+
+    assert json.loads(stored_data(store, '1_json'))['user_id'] == 1
+    assert store.get('1_json') == session
+
+
+# Нечитаемая запись (например, оставшаяся от прежнего формата) считается отсутствующей и удаляется
+def test_undecodable_session_is_dropped(store):
+    store.save('1_old', {'user_id': 1})
+    with store.shard.get_connection() as conn:
+        conn.execute("UPDATE quiz_sessions SET data = X'80049504' WHERE session_id = '1_old'")
+
+    assert store.get('1_old') is None
+    assert stored_data(store, '1_old') is None
@@ -0,0 +1,101 @@
+from database import ShardRouter
+
+USERS = (10, 11, 13)
+
+
+# Пользователь с двумя категориями, карточками, свежими и архивными сессиями;
+# архивная сессия переносится так же, как в archive_old_sessions (счетчики уже учли ее триггерами)
+def seed_user(router, telegram_id):
+    with router.get_connection(telegram_id) as conn:
+        conn.execute('INSERT INTO users (telegram_id, username) VALUES (?, ?)', (telegram_id, f'user{telegram_id}'))
+        default = conn.execute('SELECT id FROM categories WHERE user_id = ?', (telegram_id,)).fetchone()[0]
+        other = conn.execute("INSERT INTO categories (user_id, name) VALUES (?, 'Слова')", (telegram_id,)).lastrowid
+        conn.executemany('''
+                         INSERT INTO cards (user_id, category_id, front, back, status)
+                         VALUES (?, ?, ?, ?, ?)
+                         ''', [(telegram_id, default if i % 2 else other, f'front {telegram_id} {i}', f'back {i}',
+                                'learned' if i < 2 else 'learning') for i in range(5)])
+        conn.executemany('''
+                         INSERT INTO study_sessions (user_id, cards_studied, correct_answers, wrong_answers,
+                                                     session_duration, created_at)
+                         VALUES (?, ?, ?, ?, ?, ?)
+                         ''', [(telegram_id, 4, 3, 1, 60, '2020-01-01 10:00:00'),
+                               (telegram_id, 2, 2, 0, 30, '2020-01-01 12:00:00'),
+                               (telegram_id, 5, 1, 4, 90, '2099-01-01 10:00:00')])
+        conn.execute('''
+                     INSERT INTO archive.study_sessions
+                     SELECT * FROM main.study_sessions WHERE user_id = ? AND created_at < '2021-01-01'
+                     ''', (telegram_id,))
+        conn.execute("DELETE FROM main.study_sessions WHERE user_id = ? AND created_at < '2021-01-01'",
+                     (telegram_id,))
+
+
+def rows(conn, sql, telegram_id):
+    return sorted(tuple(row) for row in conn.execute(sql, (telegram_id,)))
+
+
+# Все данные пользователя без суррогатных id; карточки привязаны к категориям по имени
+def snapshot(router, telegram_id):
+    with router.get_connection(telegram_id) as conn:
+        assert conn.execute('PRAGMA foreign_key_check').fetchall() == []
+        session_columns = 'cards_studied, correct_answers, wrong_answers, session_duration, created_at'
+        return {
+            'users': rows(conn, 'SELECT telegram_id, username FROM users WHERE telegram_id = ?', telegram_id),
+            'reminders': rows(conn, 'SELECT reminder_time, enabled FROM reminders WHERE user_id = ?', telegram_id),
+            'cards': rows(conn, '''
+                                SELECT cards.front, cards.status, categories.name
+                                FROM cards
+                                         JOIN categories ON categories.id = cards.category_id
+                                    AND categories.user_id = cards.user_id
+                                WHERE cards.user_id = ?
+                                ''', telegram_id),
+            'categories': rows(conn, 'SELECT name FROM categories WHERE user_id = ?', telegram_id),
+            'sessions': rows(conn, f'SELECT {session_columns} FROM main.study_sessions WHERE user_id = ?',
+                             telegram_id),
+            'archive': rows(conn, f'SELECT {session_columns} FROM archive.study_sessions WHERE user_id = ?',
+                            telegram_id),
+            'daily_stats': rows(conn, 'SELECT * FROM daily_stats WHERE user_id = ?', telegram_id),
+            'user_stats': rows(conn, '''
+                                     SELECT total_cards, learned_cards, total_sessions, total_study_time,
+                                            correct_answers, wrong_answers
+                                     FROM user_stats
+                                     WHERE user_id = ?
+                                     ''', telegram_id),
+        }
+
+
+def shard_users(shard):
+    with shard.get_connection() as conn:
+        return (sorted(row[0] for row in conn.execute('SELECT telegram_id FROM users')),
+                sorted({row[0] for row in conn.execute('SELECT user_id FROM archive.study_sessions')}))
+
+
+# 1 -> 2 -> 1 шард: данные пользователей переносятся без потерь и без повторного счета триггерами,
+# повторная перебалансировка ничего не меняет
+def test_rebalance_moves_users_between_shards(tmp_path):
+    path = str(tmp_path / 'flashcards.db')
+
+    router = ShardRouter(path, shard_count=1)
+    for telegram_id in USERS:
+        seed_user(router, telegram_id)
+    expected = {telegram_id: snapshot(router, telegram_id) for telegram_id in USERS}
+    assert len(expected[11]['cards']) == 5 and len(expected[11]['archive']) == 2
+    assert expected[11]['user_stats'] == [(5, 2, 3, 180, 6, 5)]
+    router.close()
+
+    router = ShardRouter(path, shard_count=2)
+    assert router.rebalance() == 2
+    assert shard_users(router.shards[0]) == ([10], [10])
+    assert shard_users(router.shards[1]) == ([11, 13], [11, 13])
+    assert {telegram_id: snapshot(router, telegram_id) for telegram_id in USERS} == expected
+
+    assert router.rebalance() == 0
+    assert {telegram_id: snapshot(router, telegram_id) for telegram_id in USERS} == expected
+    router.close()
+
+    router = ShardRouter(path, shard_count=1)
+    assert router.rebalance() == 2
+    assert shard_users(router.shards[0]) == ([10, 11, 13], [10, 11, 13])
+    assert {telegram_id: snapshot(router, telegram_id) for telegram_id in USERS} == expected
+    assert router.rebalance() == 0
+    router.close()
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta, timezone
+
+from database import AnalyticsUtils, CardUtils, CategoryUtils, MaintenanceUtils, UserUtils, with_connection
+
+STAT_COLUMNS = ('total_cards', 'learned_cards', 'total_sessions', 'total_study_time', 'correct_answers', 'wrong_answers')
+
+
+def user_stats(telegram_id):
+    with with_connection(telegram_id=telegram_id) as conn:
+        stats = UserUtils.get_user_stats(conn, telegram_id)
+    return {column: stats[column] for column in STAT_COLUMNS}
+
+
+def add_session(telegram_id, correct, wrong, duration, created_at=None):
+    with with_connection(telegram_id=telegram_id) as conn:
+        conn.execute('''
+                     INSERT INTO study_sessions
+                     (user_id, cards_studied, correct_answers, wrong_answers, session_duration, session_type,
+                      created_at)
+                     VALUES (?, ?, ?, ?, ?, 'all', COALESCE(?, CURRENT_TIMESTAMP))
+                     ''', (telegram_id, correct + wrong, correct, wrong, duration, created_at))
+
+
+# Триггеры ведут счетчики при добавлении, смене статуса и удалении карточек (в том числе каскадном)
+# и при сохранении сессий; пересчет по таблицам дает те же значения
+def test_user_stats_follow_cards_and_sessions(user_id, make_cards):
+    assert user_stats(user_id) == dict.fromkeys(STAT_COLUMNS, 0)
+
+    with with_connection(telegram_id=user_id) as conn:
+        default = CategoryUtils.get_user_categories(conn, user_id)[0]['id']
+        other = CategoryUtils.create_category(conn, user_id, 'Другая')
+    card_ids = make_cards(user_id, 6, category_id=default, status=lambda i: 'learned' if i < 2 else 'learning')
+    make_cards(user_id, 3, category_id=other, status='learned')
+    assert user_stats(user_id)['total_cards'] == 9 and user_stats(user_id)['learned_cards'] == 5
+
+    with with_connection(telegram_id=user_id) as conn:
+        CardUtils.update_card(conn, card_ids[0], status='learning')
+        CardUtils.update_card(conn, card_ids[3], status='learned')
+        CardUtils.update_card(conn, card_ids[4], front='без смены статуса')
+        CardUtils.delete_card(conn, card_ids[1])
+        CategoryUtils.delete_category(conn, other)
+    add_session(user_id, 7, 3, 120)
+    add_session(user_id, 2, 0, 30)
+
+    expected = {'total_cards': 5, 'learned_cards': 1, 'total_sessions': 2, 'total_study_time': 150,
+                'correct_answers': 9, 'wrong_answers': 3}
+    assert user_stats(user_id) == expected
+
+    with with_connection(telegram_id=user_id) as conn:
+        conn.execute('UPDATE user_stats SET total_cards = 100, learned_cards = 100, total_sessions = 0 '
+                     'WHERE user_id = ?', (user_id,))
+        MaintenanceUtils.rebuild_user_stats(conn, user_id, include_sessions=True)
+    assert user_stats(user_id) == expected
+
+
+# Счетчики сессий накопительные: перенос в архив и удаление старых сессий их не уменьшают
+def test_session_counters_survive_archiving(user_id):
+    add_session(user_id, 5, 5, 60, '2020-01-01 10:00:00')
+    add_session(user_id, 1, 0, 10)
+
+    assert MaintenanceUtils.archive_old_sessions(days_old=180, telegram_id=user_id) == 1
+    stats = user_stats(user_id)
+    assert (stats['total_sessions'], stats['correct_answers'], stats['wrong_answers']) == (2, 6, 5)
+
+    with with_connection(telegram_id=user_id) as conn:
+        MaintenanceUtils.rebuild_user_stats(conn, user_id, include_sessions=True)
+    assert user_stats(user_id) == stats
+
+
+# Дневные итоги совпадают с агрегатами по сессиям; сессии без ответов не входят в среднюю точность
+def test_daily_stats_roll_up_sessions(user_id):
+    today = datetime.now(timezone.utc).date()
+    yesterday = today - timedelta(days=1)
+    add_session(user_id, 3, 1, 40, f'{yesterday} 09:00:00')
+    add_session(user_id, 1, 1, 20, f'{yesterday} 21:00:00')
+    add_session(user_id, 0, 0, 5, f'{yesterday} 22:00:00')
+    add_session(user_id, 4, 0, 30, f'{today} 00:00:00')
+    add_session(user_id, 1, 3, 10, '2020-05-10 12:00:00')
+    add_session(user_id, 0, 0, 10, '2020-05-20 12:00:00')
+
+    with with_connection(telegram_id=user_id) as conn:
+        expected = [dict(row) for row in conn.execute('''
+                                                      SELECT DATE(created_at)         as date,
+                                                             COUNT(*)                 as sessions,
+                                                             SUM(cards_studied)       as cards_studied,
+                                                             SUM(correct_answers)     as correct,
+                                                             SUM(wrong_answers)       as wrong,
+                                                             SUM(session_duration)    as total_time
+                                                      FROM study_sessions
+                                                      WHERE user_id = ? AND created_at >= DATE('now', '-30 days')
+                                                      GROUP BY DATE(created_at)
+                                                      ORDER BY date DESC
+                                                      ''', (user_id,))]
+        daily = AnalyticsUtils.get_daily_stats(conn, user_id)
+        progress = AnalyticsUtils.get_learning_progress(conn, user_id)
+        accuracy = dict(conn.execute('SELECT date, accuracy_sum / accuracy_sessions FROM daily_stats '
+                                     'WHERE user_id = ?', (user_id,)))
+
+    assert daily == expected
+    assert [row['sessions'] for row in daily] == [1, 3]
+    assert accuracy == {str(yesterday): (75.0 + 50.0) / 2, str(today): 100.0, '2020-05-10': 25.0,
+                        '2020-05-20': None}
+
+    old_month = next(row for row in progress if row['month'] == '2020-05')
+    assert (old_month['sessions'], old_month['cards_studied'], old_month['accuracy']) == (2, 4, 25.0)
+    assert sum(row['sessions'] for row in progress) == 6
@@ -0,0 +1,40 @@
+import pytest
+
+from database import UserUtils, known_users, with_connection
+
+
+def user_exists(telegram_id):
+    with with_connection(telegram_id=telegram_id) as conn:
+        return conn.execute('SELECT 1 FROM users WHERE telegram_id = ?', (telegram_id,)).fetchone() is not None
+
+
+# Откаченное создание пользователя не запоминается - следующий вызов записывает его снова
+def test_rolled_back_user_is_not_remembered():
+    telegram_id = 990001
+    with pytest.raises(RuntimeError):
+        with with_connection(telegram_id=telegram_id) as conn:
+            UserUtils.create_or_update_user(conn, telegram_id, 'user', 'Test')
+            raise RuntimeError
+
+    assert known_users.get(telegram_id) is None and not user_exists(telegram_id)
+    with with_connection(telegram_id=telegram_id) as conn:
+        assert UserUtils.create_or_update_user(conn, telegram_id, 'user', 'Test')
+    assert user_exists(telegram_id)
+    assert known_users.get(telegram_id) == ('user', 'Test', None, 'ru')
+
+
+# После вытеснения из known_users тот же профиль не переписывает строку, измененный - переписывает
+def test_unchanged_profile_is_not_rewritten(user_id):
+    known_users.invalidate(user_id)
+    with with_connection(telegram_id=user_id) as conn:
+        changes = conn.total_changes
+        assert UserUtils.create_or_update_user(conn, user_id, f'user{user_id}', 'Test')
+        assert conn.total_changes == changes
+
+    known_users.invalidate(user_id)
+    with with_connection(telegram_id=user_id) as conn:
+        changes = conn.total_changes
+        assert UserUtils.create_or_update_user(conn, user_id, 'renamed', 'Test')
+        assert conn.total_changes == changes + 1
+        assert conn.execute('SELECT username FROM users WHERE telegram_id = ?', (user_id,)).fetchone()[0] == 'renamed'
+    assert known_users.get(user_id) == ('renamed', 'Test', None, 'ru')
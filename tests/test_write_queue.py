@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from database import DatabaseManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = DatabaseManager(str(tmp_path / 'writer.db'))
+    manager.writer.enabled = True
+    yield manager
+    manager.close()
+
+
+def add_user(conn, telegram_id):
+    conn.execute('INSERT INTO users (telegram_id) VALUES (?)', (telegram_id,))
+    return telegram_id
+
+
+def fail(conn, telegram_id):
+    conn.execute('INSERT INTO users (telegram_id) VALUES (?)', (telegram_id,))
+    raise ValueError('boom')
+
+
+def user_ids(manager):
+    with manager.get_connection() as conn:
+        return sorted(row[0] for row in conn.execute('SELECT telegram_id FROM users'))
+
+
+# Операции из разных потоков выполняются писателем; ошибка одной откатывает только ее
+def test_writer_commits_batches_and_isolates_failures(manager):
+    futures = []
+    threads = [threading.Thread(target=lambda i=i: futures.append(manager.writer.submit(add_user, i)))
+               for i in range(1, 21)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    failed = manager.writer.submit(fail, 100)
+
+    assert sorted(future.result(timeout=5) for future in futures) == list(range(1, 21))
+    with pytest.raises(ValueError):
+        failed.result(timeout=5)
+    assert user_ids(manager) == list(range(1, 21))
+
+
+# Ожидание результата, держа незакоммиченную запись в том же шарде, не блокируется:
+# операция выполняется в транзакции вызывающего и фиксируется вместе с ней
+def test_submit_inside_write_transaction_runs_inline(manager):
+    with manager.get_connection() as conn:
+        conn.execute('INSERT INTO users (telegram_id) VALUES (1)')
+        started = time.monotonic()
+        assert manager.writer.submit(add_user, 2).result(timeout=10) == 2
+        with pytest.raises(ValueError):
+            manager.writer.submit(fail, 3).result(timeout=10)
+        elapsed = time.monotonic() - started
+
+    assert elapsed < 1
+    assert user_ids(manager) == [1, 2]
+
+
+# Откат транзакции вызывающего откатывает и выполненную в ней операцию
+def test_inline_submit_rolls_back_with_caller(manager):
+    with pytest.raises(RuntimeError):
+        with manager.get_connection() as conn:
+            conn.execute('INSERT INTO users (telegram_id) VALUES (1)')
+            manager.writer.submit(add_user, 2).result(timeout=10)
+            raise RuntimeError
+
+    assert user_ids(manager) == []